@@ -1 +1 @@
-__all__ = ['io', 'plots', 'setups', 'run', 'setup_base', 'simulation', 'utils']
+__all__ = ['io', 'plots', 'setups', 'run', 'setup_base', 'simulation', 'utils', 'backend_numba', 'decomposition', 'amr', 'riemann', 'ensemble', 'sweep', 'cache', 'output']
@@ -0,0 +1,1045 @@
+###################################################################################################
+#
+# Ulula -- amr.py
+#
+# Block-structured adaptive mesh refinement
+#
+# by Benedikt Diemer
+#
+###################################################################################################
+
+import numpy as np
+import io
+import copy
+import math
+import contextlib
+
+import ulula.simulation as ulula_sim
+
+###################################################################################################
+
+class AMRSimulation(ulula_sim.Simulation):
+	"""
+	Simulation with block-structured adaptive mesh refinement
+
+	The domain is covered by a coarse grid with half the resolution of the given simulation, which
+	is divided into square blocks of ``block_size`` by ``block_size`` cells. Where the flow has
+	steep gradients or shocks, a block is covered by a patch, i.e., a separate simulation with
+	twice the resolution of the coarse grid (and thus the resolution of the given simulation).
+	Each patch is advanced with the usual sweeps; its ghost cells are copied from neighboring
+	patches or, where there is none, interpolated from the coarse grid. The coarse grid is this
+	object itself and is advanced as a whole, including the blocks that are covered by patches.
+
+	Both levels take the same timestep, which is set by the CFL condition on the patches. In each
+	sweep, the coarse cells that border a patch are corrected such that their flux across the
+	coarse-fine boundary is the average of the fine fluxes (refluxing), and the coarse cells
+	covered by a patch are replaced by the average of the fine cells (restriction). Together,
+	this means that mass, momentum, and energy are conserved exactly (up to round-off).
+
+	Every ``regrid_interval`` timesteps, the blocks are flagged for refinement according to the
+	criteria described in :func:`refinementFlags`. New patches are filled by conservative
+	interpolation from the coarse grid (prolongation), and patches that are no longer needed are
+	removed (the coarse grid already holds their restricted state). Since the coarse grid covers
+	the entire domain, it can be plotted like any other simulation; :func:`uniformSimulation` 
+	returns the composite state at the fine resolution, which is also what :func:`save` writes.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	sim: Simulation
+		Simulation object with initial conditions at the finest resolution; its number of cells
+		in x and y must be divisible by twice the block size. The initial conditions are copied
+		into the patches where the coarse grid is refined.
+	block_size: int
+		Size of the blocks in coarse cells; each patch has twice as many cells on each side
+	refine_threshold: float
+		Value of the second-derivative indicator (between 0 and 1) above which a cell is refined;
+		see :func:`refinementFlags`
+	refine_filter: float
+		Noise filter of the indicator; relative variations much smaller than this value are not
+		refined
+	refine_length: float
+		Gradient length scale, in units of the domain size in x, below which a cell is refined
+	regrid_interval: int
+		Number of timesteps between regridding operations
+	"""
+
+	def __init__(self, sim, block_size = 16, refine_threshold = 0.5, refine_filter = 0.01,
+				refine_length = 0.2, regrid_interval = 4):
+
+		ulula_sim.Simulation.__init__(self, sim.hs)
+
+		if (sim.nx % (2 * block_size) != 0) or (sim.ny % (2 * block_size) != 0):
+			raise Exception('Domain of %d x %d cells cannot be divided into blocks of %d x %d fine cells.' \
+						% (sim.nx, sim.ny, 2 * block_size, 2 * block_size))
+		if regrid_interval < 1:
+			raise Exception('Invalid regrid interval, %s (must be a positive integer).' \
+						% (str(regrid_interval)))
+		if sim.hs.time_integration in ulula_sim.rk_stages:
+			raise Exception('Adaptive and nested grids do not support time integration scheme %s.' \
+						% (sim.hs.time_integration))
+		if sim.hs.unsplit:
+			raise Exception('Adaptive and nested grids do not support unsplit time integration.')
+
+		with contextlib.redirect_stdout(io.StringIO()):
+			self.setDomain(sim.nx // 2, sim.ny // 2, xmin = sim.xmin, xmax = sim.xmax, ymin = sim.ymin,
+						bc_type = sim.bc_type)
+		self.setFluidProperties(sim.gamma)
+		self.createFluxStore()
+		self.t = sim.t
+		self.step = sim.step
+		self.last_dir = sim.last_dir
+
+		self.block_size = block_size
+		self.n_blocks_x = self.nx // block_size
+		self.n_blocks_y = self.ny // block_size
+		self.refine_threshold = refine_threshold
+		self.refine_filter = refine_filter
+		self.refine_length = refine_length
+		self.regrid_interval = regrid_interval
+		self.n_cell_updates = 0
+
+		# The patches are swept concurrently by the threads of the coarse grid, so they do not
+		# need threads of their own
+		self.hs_patch = copy.copy(sim.hs)
+		self.hs_patch.n_threads = 1
+		self.patches = {}
+
+		# The coarse grid starts from the average of the fine initial conditions
+		self.U[self.slc3dom] = restrict(sim.U[sim.slc3dom])
+		self.conservedToPrimitive(self.U[self.slc3dom], self.V[self.slc3dom])
+		self.enforceBoundaryConditions()
+		self.regrid(sim_ini = sim)
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def createPatch(self, box):
+		"""
+		Create the simulation of a patch
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		box: tuple
+			Range of blocks covered by the patch, given as (bx_min, bx_max, by_min, by_max), where 
+			the upper limits are exclusive
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		patch: Simulation
+			Simulation covering the blocks at twice the resolution, with a flux store
+		"""
+
+		nf = 2 * self.block_size
+		dx = 0.5 * self.dx
+		xmin = self.xmin + box[0] * self.block_size * self.dx
+		ymin = self.ymin + box[2] * self.block_size * self.dx
+		nx = nf * (box[1] - box[0])
+		ny = nf * (box[3] - box[2])
+
+		patch = ulula_sim.Simulation(self.hs_patch)
+		with contextlib.redirect_stdout(io.StringIO()):
+			patch.setDomain(nx, ny, xmin = xmin, xmax = xmin + nx * dx, ymin = ymin, bc_type = self.bc_type)
+		patch.setFluidProperties(self.gamma)
+		patch.createFluxStore()
+
+		# The cell size must be exactly half the coarse cell size for the fluxes to match
+		patch.dx = dx
+
+		return patch
+
+	# ---------------------------------------------------------------------------------------------
+
+	def refinementFlags(self):
+		"""
+		Find the blocks that need to be refined
+
+		A coarse cell is flagged if the density, the pressure, or the transverse velocity (i.e., 
+		the velocity perpendicular to the direction of the derivative) meets either of two 
+		criteria, which are evaluated separately along x and y and which, taken together, do not 
+		weaken as the resolution increases. The first is the normalized second-derivative 
+		indicator of Löhner (1987),
+
+			E = |q[i+1] - 2 q[i] + q[i-1]| / (|q[i+1] - q[i]| + |q[i] - q[i-1]|
+				+ eps * (|q[i+1]| + 2 |q[i]| + |q[i-1]|))
+
+		where the last term, set by ``refine_filter``, suppresses small ripples. The indicator is 
+		close to one at discontinuities (shocks and contacts) that are spread over a few cells,
+		regardless of their strength, and a cell is flagged if it exceeds ``refine_threshold``. 
+		The indicator falls as a smooth feature is resolved by more and more cells, however, which
+		is why the second criterion flags cells where the gradient length scale, |q| / |dq/dx|,
+		is shorter than ``refine_length`` times the domain size. This criterion captures features
+		of a given physical width, such as the smooth shear layers of the Kelvin-Helmholtz setup. 
+		For the transverse velocity, the sound speed takes the place of |q| in both criteria.
+
+		A block is refined if it contains a flagged cell or borders such a block (including 
+		diagonally). Features move by less than one fine cell per timestep, so that the buffer of
+		one block keeps them on the fine grid until the next regridding as long as 
+		``regrid_interval`` is less than the block size.
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		flags: array_like
+			Boolean array with dimensions [n_blocks_x, n_blocks_y]
+		"""
+
+		DN = self.q_prim['DN']
+		PR = self.q_prim['PR']
+		eps = self.refine_filter
+		l_ref = self.refine_length * (self.xmax - self.xmin)
+
+		flag = np.zeros((self.nx, self.ny), bool)
+		for idir in range(2):
+			self.enforceBoundaryConditions(idir)
+			if idir == 0:
+				slcs = [(slice(self.xlo + i - 1, self.xhi + i), self.slc1dC[1]) for i in range(3)]
+			else:
+				slcs = [(self.slc1dC[0], slice(self.ylo + i - 1, self.yhi + i)) for i in range(3)]
+			cs = np.sqrt(self.gamma * self.V[PR] / self.V[DN])
+			v_trans = self.V[self.q_prim['VX'] + 1 - idir]
+			for q, q_abs in [(self.V[DN], self.V[DN]), (self.V[PR], self.V[PR]), (v_trans, cs)]:
+				q_l, q_c, q_r = [q[slc] for slc in slcs]
+				a_l, a_c, a_r = [q_abs[slc] for slc in slcs]
+				num = np.abs(q_r - 2.0 * q_c + q_l)
+				den = np.abs(q_r - q_c) + np.abs(q_c - q_l) + eps * (a_l + 2.0 * a_c + a_r)
+				flag |= (num > self.refine_threshold * den)
+				flag |= (np.abs(q_r - q_l) * l_ref > 2.0 * self.dx * a_c)
+
+		bs = self.block_size
+		flags = np.any(flag.reshape(self.n_blocks_x, bs, self.n_blocks_y, bs), axis = (1, 3))
+
+		if self.bc_type == 'periodic':
+			mode = 'wrap'
+		else:
+			mode = 'constant'
+		padded = np.pad(flags, 1, mode = mode)
+		nbx = self.n_blocks_x
+		nby = self.n_blocks_y
+		for i in range(3):
+			for j in range(3):
+				flags = flags | padded[i:i + nbx, j:j + nby]
+
+		return flags
+
+	# ---------------------------------------------------------------------------------------------
+
+	def patchBoxes(self):
+		"""
+		Find the ranges of blocks that should be covered by patches
+
+		Each block flagged by :func:`refinementFlags` is covered by its own patch.
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		boxes: list
+			List of block ranges (bx_min, bx_max, by_min, by_max), where the upper limits are 
+			exclusive; the ranges must not overlap
+		"""
+
+		flags = self.refinementFlags()
+		boxes = [(int(bx), int(bx) + 1, int(by), int(by) + 1) for bx, by in zip(*np.nonzero(flags))]
+
+		return boxes
+
+	# ---------------------------------------------------------------------------------------------
+
+	def regrid(self, sim_ini = None):
+		"""
+		Create and remove patches according to the refinement criteria
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		sim_ini: Simulation
+			If not ``None``, new patches are filled from the physical cells of this simulation,
+			which must have the fine resolution; otherwise, they are filled by prolongation from
+			the coarse grid.
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		n_new: int
+			Number of patches created
+		"""
+
+		boxes = self.patchBoxes()
+
+		for key in list(self.patches.keys()):
+			if not key in boxes:
+				del self.patches[key]
+
+		bs = self.block_size
+		ng = self.nghost
+		n_new = 0
+		for key in boxes:
+			if key in self.patches:
+				continue
+			patch = self.createPatch(key)
+			if sim_ini is not None:
+				slc = (slice(None), slice(ng + 2 * bs * key[0], ng + 2 * bs * key[1]),
+					slice(ng + 2 * bs * key[2], ng + 2 * bs * key[3]))
+				patch.U[patch.slc3dom] = sim_ini.U[slc]
+				patch.V[patch.slc3dom] = sim_ini.V[slc]
+			else:
+				ci = np.arange(bs * key[0], bs * key[1])
+				cj = np.arange(bs * key[2], bs * key[3])
+				U = self.prolongate(self.U, self.prolongationIndices(ci, cj))
+				patch.U[patch.slc3dom] = U.reshape((self.nq, patch.nx, patch.ny))
+				patch.conservedToPrimitive(patch.U[patch.slc3dom], patch.V[patch.slc3dom])
+
+			# The ghost cells are filled before each sweep, but the conversions also touch the
+			# ghost cells perpendicular to the sweep, which thus need to hold a valid state
+			patch.enforceBoundaryConditions()
+			patch.t = self.t
+			patch.step = self.step
+			self.patches[key] = patch
+			n_new += 1
+
+		# The patch that covers each block, if any
+		self.block_owner = {}
+		for key in self.patches:
+			for bx in range(key[0], key[1]):
+				for by in range(key[2], key[3]):
+					self.block_owner[(bx, by)] = key
+
+		self.ghost_copies = [[], []]
+		self.ghost_prolong = [[], []]
+		self.reflux = [[], []]
+		for key in self.patches:
+			for idir in range(2):
+				self.connectPatch(key, idir)
+		self.prolong_idx = []
+		n_max = 1
+		for idir in range(2):
+			if len(self.ghost_prolong[idir]) > 0:
+				fi = np.concatenate([r[4] for r in self.ghost_prolong[idir]])
+				fj = np.concatenate([r[5] for r in self.ghost_prolong[idir]])
+				self.prolong_idx.append(self.prolongationIndices(fi, fj, pairs = True))
+				n_max = max(n_max, len(fi))
+			else:
+				self.prolong_idx.append(None)
+		self.ws_ghost = ulula_sim.Workspace(self.nq, n_max, 1, buffers_3d = [], 
+										buffers_2d = ['tmp_a', 'tmp_b'], buffers_bool = [], 
+										dtype = self.dtype)
+
+		return n_new
+
+	# ---------------------------------------------------------------------------------------------
+
+	def connectPatch(self, key, idir):
+		"""
+		Compute the operations that connect a patch to its surroundings in one direction
+
+		For each side of the patch along the sweep direction, the ghost cells are either copied
+		from the patch's own edge (for outflow boundaries) or, block by block, from the 
+		neighboring patch or interpolated from the coarse grid. In the latter case, the coarse 
+		cells next to the block are corrected with the fine fluxes after each sweep. The 
+		operations are appended to the ``ghost_copies``, ``ghost_prolong``, and ``reflux`` lists.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		key: tuple
+			Block range of the patch
+		idir: int
+			Direction (0 = x, 1 = y)
+		"""
+
+		bs = self.block_size
+		nf = 2 * bs
+		ng = self.nghost
+		n_blocks = [self.n_blocks_x, self.n_blocks_y][idir]
+		n_cells = [self.nx, self.ny][idir]
+		b0, b1 = key[2 * idir:2 * idir + 2]
+		p0, p1 = key[2 - 2 * idir:4 - 2 * idir]
+		n_along = nf * (b1 - b0)
+
+		# Arrange slices as (along the sweep, perpendicular to the sweep)
+		def slice3d(slc_along, slc_perp):
+			if idir == 0:
+				return (slice(None), slc_along, slc_perp)
+			else:
+				return (slice(None), slc_perp, slc_along)
+
+		for side in [-1, 1]:
+			if side == -1:
+				slc_dst = slice(0, ng)
+				f_fine = 0
+				b_nb = b0 - 1
+			else:
+				slc_dst = slice(ng + n_along, n_along + 2 * ng)
+				f_fine = n_along
+				b_nb = b1
+
+			# Outside the domain with outflow boundaries: copy the edge of the patch
+			if (b_nb < 0) or (b_nb >= n_blocks):
+				if self.bc_type == 'outflow':
+					if side == -1:
+						slc_src = slice(ng, ng + 1)
+					else:
+						slc_src = slice(ng + n_along - 1, ng + n_along)
+					slc_perp = slice(ng, ng + nf * (p1 - p0))
+					self.ghost_copies[idir].append((key, slice3d(slc_dst, slc_perp), key,
+												slice3d(slc_src, slc_perp)))
+					continue
+				b_nb = b_nb % n_blocks
+
+			for p in range(p0, p1):
+				slc_perp = slice(ng + nf * (p - p0), ng + nf * (p - p0 + 1))
+				if idir == 0:
+					key_nb = self.block_owner.get((b_nb, p), None)
+				else:
+					key_nb = self.block_owner.get((p, b_nb), None)
+
+				# Neighboring patch: copy its physical cells on the facing side. The patches do not
+				# overlap, so the neighbor ends (or starts) at the block next to this patch.
+				if key_nb is not None:
+					if side == -1:
+						n_along_nb = nf * (key_nb[2 * idir + 1] - key_nb[2 * idir])
+						slc_src = slice(n_along_nb, n_along_nb + ng)
+					else:
+						slc_src = slice(ng, 2 * ng)
+					q0 = key_nb[2 - 2 * idir]
+					slc_perp_src = slice(ng + nf * (p - q0), ng + nf * (p - q0 + 1))
+					self.ghost_copies[idir].append((key, slice3d(slc_dst, slc_perp), key_nb,
+												slice3d(slc_src, slc_perp_src)))
+					continue
+
+				# Coarse neighbor: interpolate the ghost cells from the coarse cells that contain 
+				# them, given as pairs of fine cells along the sweep and their parent coarse cells
+				if side == -1:
+					g_along = np.arange(nf * b0 - ng, nf * b0)
+				else:
+					g_along = np.arange(nf * b1, nf * b1 + ng)
+				g_along = g_along % (2 * n_cells)
+				g_perp = np.arange(nf * p, nf * (p + 1))
+				if idir == 0:
+					gi, gj = np.meshgrid(g_along, g_perp, indexing = 'ij')
+					shape = (self.nq, ng, nf)
+				else:
+					gi, gj = np.meshgrid(g_perp, g_along, indexing = 'ij')
+					shape = (self.nq, nf, ng)
+				gi = gi.flatten()
+				gj = gj.flatten()
+				self.ghost_prolong[idir].append((key, slice3d(slc_dst, slc_perp), shape, len(gi), gi, gj))
+
+				# The coarse cell across the side is corrected with the fine fluxes through the 
+				# side. Its interface with the patch has the same index as the patch's fine 
+				# interface.
+				c_perp = slice(bs * p, bs * (p + 1))
+				if side == -1:
+					c_along = (bs * b0 - 1) % n_cells
+					f_coarse = c_along + 1
+				else:
+					c_along = (bs * b1) % n_cells
+					f_coarse = c_along
+				c_perp_dom = slice(c_perp.start + ng, c_perp.stop + ng)
+				f_perp = slice(nf * (p - p0), nf * (p - p0 + 1))
+				if idir == 0:
+					slc_Ff = (slice(None), f_fine, f_perp)
+					slc_Fc = (slice(None), f_coarse, c_perp)
+					slc_U = (slice(None), c_along + ng, c_perp_dom)
+				else:
+					slc_Ff = (slice(None), f_perp, f_fine)
+					slc_Fc = (slice(None), c_perp, f_coarse)
+					slc_U = (slice(None), c_perp_dom, c_along + ng)
+				self.reflux[idir].append((key, side, slc_Ff, slc_Fc, slc_U))
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def prolongationIndices(self, ci, cj, pairs = False):
+		"""
+		Indices for the interpolation from the coarse grid
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		ci: array_like
+			Indices of coarse cells in x (physical, i.e., without ghost cells); if ``pairs`` is
+			``False``, each cell is interpolated onto its four fine cells; otherwise, the indices of
+			the fine cells in the global fine grid
+		cj: array_like
+			Indices of coarse cells (or fine cells) in y
+		pairs: bool
+			See above
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		idx: dict
+			Dictionary with the indices of the parent cells and their neighbors in the coarse
+			arrays and the offsets of the fine cells from their parents (in coarse cells)
+		"""
+
+		if pairs:
+			fi = ci
+			fj = cj
+		else:
+			fi, fj = np.meshgrid(np.arange(2 * ci[0], 2 * ci[-1] + 2),
+								np.arange(2 * cj[0], 2 * cj[-1] + 2), indexing = 'ij')
+			fi = fi.flatten()
+			fj = fj.flatten()
+
+		# The neighbors of the parent cells are mapped into the physical domain according to
+		# the boundary conditions, meaning that the coarse ghost cells are never read.
+		def neighbor(c, n):
+			if self.bc_type == 'periodic':
+				return np.mod(c, n)
+			else:
+				return np.clip(c, 0, n - 1)
+
+		ng = self.nghost
+		pi = fi // 2
+		pj = fj // 2
+		idx = {}
+		idx['i'] = pi + ng
+		idx['j'] = pj + ng
+		idx['iL'] = neighbor(pi - 1, self.nx) + ng
+		idx['iR'] = neighbor(pi + 1, self.nx) + ng
+		idx['jL'] = neighbor(pj - 1, self.ny) + ng
+		idx['jR'] = neighbor(pj + 1, self.ny) + ng
+		idx['ox'] = ((fi % 2) - 0.5) * 0.5
+		idx['oy'] = ((fj % 2) - 0.5) * 0.5
+
+		return idx
+
+	# ---------------------------------------------------------------------------------------------
+
+	def prolongate(self, Q, idx):
+		"""
+		Interpolate coarse cells onto fine cells
+
+		The fine cells are set to a linear interpolation within their parent cell, where the
+		slopes are limited with the minmod limiter. Since the offsets of the four fine cells from
+		the center of their parent cancel, their average is equal to the coarse value, meaning that
+		the interpolation of conserved variables is conservative. The limiter ensures that no new
+		extrema are created, meaning that the interpolation of positive quantities (such as the
+		density and pressure) remains positive.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		Q: array_like
+			Coarse array of fluid variables (primitive or conserved)
+		idx: dict
+			Indices computed by :func:`prolongationIndices`
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		q: array_like
+			Fine values with dimensions [nq, n_fine]
+		"""
+
+		q_c = Q[:, idx['i'], idx['j']]
+		s_x = minmod(q_c - Q[:, idx['iL'], idx['j']], Q[:, idx['iR'], idx['j']] - q_c)
+		s_y = minmod(q_c - Q[:, idx['i'], idx['jL']], Q[:, idx['i'], idx['jR']] - q_c)
+		q = q_c + s_x * idx['ox'] + s_y * idx['oy']
+
+		return q.astype(self.dtype, copy = False)
+
+	# ---------------------------------------------------------------------------------------------
+
+	def fillGhostCells(self, idir, V_ghost = None):
+		"""
+		Fill the ghost cells of the patches that the next sweep reads
+
+		The sweeps read the ghost cells along the sweep direction of the physical pencils. Those
+		are copied from the neighboring patches, if any, or interpolated from the primitive
+		variables of the coarse grid, whose physical cells must be up to date. The conserved
+		variables of the ghost cells are not read by the sweeps but converted into primitive
+		variables, so they are set as well.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		idir: int
+			Direction of the next sweep (0 = x, 1 = y)
+		V_ghost: array_like
+			Primitive variables of the ghost cells that are interpolated from the coarse grid, in 
+			the order of ``prolong_idx[idir]``; if ``None``, they are computed from the current 
+			coarse grid.
+		"""
+
+		for key, slc_dst, key_src, slc_src in self.ghost_copies[idir]:
+			patch = self.patches[key]
+			patch_src = self.patches[key_src]
+			patch.V[slc_dst] = patch_src.V[slc_src]
+			patch.U[slc_dst] = patch_src.U[slc_src]
+
+		if self.prolong_idx[idir] is not None:
+			if V_ghost is None:
+				V = self.prolongate(self.V, self.prolong_idx[idir])
+			else:
+				V = V_ghost
+			U = np.empty_like(V)
+			self.primitiveToConserved(V, U, ws = self.ws_ghost)
+			k = 0
+			for key, slc_dst, shape, n, _, _ in self.ghost_prolong[idir]:
+				patch = self.patches[key]
+				patch.V[slc_dst] = V[:, k:k + n].reshape(shape)
+				patch.U[slc_dst] = U[:, k:k + n].reshape(shape)
+				k += n
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def correctCoarseGrid(self, idir, dt, max_speed = False):
+		"""
+		Apply the fine fluxes and the fine state to the coarse grid after a sweep
+
+		The coarse cells that border a patch have been updated with a coarse flux across the
+		boundary, whereas the patch has been updated with the fine fluxes. We replace the former by
+		the average of the latter, such that the coarse grid gains exactly what the patch loses.
+		The coarse cells covered by the patches are replaced by the average of the fine cells. 
+		Finally, the coarse grid is converted to primitive variables. Converting only the corrected
+		cells would mean one small conversion per patch, which takes longer than one conversion of
+		the entire coarse grid unless there are very few patches.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		idir: int
+			Direction of the sweep (0 = x, 1 = y)
+		dt: float
+			Timestep
+		max_speed: bool
+			If ``True``, compute the largest signal speed on the coarse grid
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		c_max: float
+			Largest signal speed on the coarse grid if ``max_speed`` is ``True``, otherwise 
+			``None``.
+		"""
+
+		fac = dt / self.dx
+		F_c = self.flux_store[idir]
+		for key, side, slc_Ff, slc_Fc, slc_U in self.reflux[idir]:
+			F_f = self.patches[key].flux_store[idir][slc_Ff]
+			dF = 0.5 * (F_f[:, 0::2] + F_f[:, 1::2])
+			dF -= F_c[slc_Fc]
+			dF *= side * fac
+			self.U[slc_U] += dF
+
+		self.restrictPatches()
+		c_max = self.conservedToPrimitiveDomain(max_speed = max_speed)
+
+		return c_max
+
+	# ---------------------------------------------------------------------------------------------
+
+	def restrictPatches(self):
+		"""
+		Replace the conserved variables of the coarse cells covered by patches by the fine average
+		"""
+
+		bs = self.block_size
+		ng = self.nghost
+		for key, patch in self.patches.items():
+			slc = (slice(None), slice(ng + bs * key[0], ng + bs * key[1]),
+				slice(ng + bs * key[2], ng + bs * key[3]))
+			self.U[slc] = restrict(patch.U[patch.slc3dom])
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def maxSpeedInDomain(self):
+		"""
+		Largest signal speed on both levels, in units of the coarse cell size
+
+		The CFL timestep is inversely proportional to the signal speed divided by the cell size.
+		Thus, the signal speeds on the patches count twice, which makes the timestep computed by
+		the coarse grid the smaller of the timesteps allowed on the two levels.
+		"""
+
+		c_max = ulula_sim.Simulation.maxSpeedInDomain(self)
+		for patch in self.patches.values():
+			c_max = max(c_max, 2.0 * patch.maxSpeed(patch.V[patch.slc3dom]))
+
+		return c_max
+
+	# ---------------------------------------------------------------------------------------------
+
+	def timestep(self, dt = None):
+		"""
+		Advance both levels by one timestep
+
+		See :func:`~ulula.simulation.Simulation.timestep`. Before each sweep, the coarse ghost
+		cells are set by the boundary conditions and the patch ghost cells are filled (see
+		:func:`fillGhostCells`). After the coarse grid and all patches have been swept, the coarse
+		grid is corrected (see :func:`correctCoarseGrid`). After the timestep, the grid is
+		adapted if the step counter reaches a multiple of ``regrid_interval``.
+		"""
+
+		if dt is None:
+			dt = self.cflCondition()
+		self.dt_cfl = None
+
+		if self.last_dir == 0:
+			dirs = [0, 1]
+		else:
+			dirs = [1, 0]
+
+		patches = list(self.patches.values())
+		for idir in dirs:
+			max_speed = (idir == dirs[-1])
+			self.enforceBoundaryConditions(idir)
+			self.fillGhostCells(idir)
+			self.sweep(idir, dt)
+			c_max_patches = self.runParallel(sweepPatch, [(p, idir, dt, max_speed) for p in patches])
+			self.bc_stale = set(['x', 'y', 'corners'])
+			c_max = self.correctCoarseGrid(idir, dt, max_speed = max_speed)
+
+		for c in c_max_patches:
+			c_max = max(c_max, 2.0 * c)
+		self.dt_cfl = self.cflTimestep(c_max)
+
+		if (self.hs.checks == 'every_n_steps') and ((self.step + 1) % self.hs.check_interval == 0):
+			self.checkFluidState()
+			for patch in patches:
+				patch.checkFluidState()
+
+		self.n_cell_updates += self.nx * self.ny + sum([p.nx * p.ny for p in patches])
+		self.t += dt
+		self.step += 1
+		self.last_dir = idir
+		for patch in patches:
+			patch.t = self.t
+			patch.step = self.step
+
+		# New patches are interpolated from the coarse grid, whose signal speeds do not limit
+		# the timestep at the fine resolution
+		if self.step % self.regrid_interval == 0:
+			if self.regrid() > 0:
+				self.dt_cfl = None
+
+		return dt
+
+	# ---------------------------------------------------------------------------------------------
+
+	def uniformSimulation(self):
+		"""
+		Composite state of both levels at the fine resolution
+
+		The coarse grid is interpolated onto the fine grid (see :func:`prolongate`), and the
+		patches are copied into it.
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		sim: Simulation
+			Simulation with twice the resolution of the coarse grid
+		"""
+
+		sim = ulula_sim.Simulation(self.hs)
+		with contextlib.redirect_stdout(io.StringIO()):
+			sim.setDomain(2 * self.nx, 2 * self.ny, xmin = self.xmin, xmax = self.xmax,
+						ymin = self.ymin, bc_type = self.bc_type)
+		sim.setFluidProperties(self.gamma)
+		sim.t = self.t
+		sim.step = self.step
+		sim.last_dir = self.last_dir
+
+		U = self.prolongate(self.U, self.prolongationIndices(np.arange(self.nx), np.arange(self.ny)))
+		sim.U[sim.slc3dom] = U.reshape((self.nq, sim.nx, sim.ny))
+		sim.conservedToPrimitive(sim.U[sim.slc3dom], sim.V[sim.slc3dom])
+
+		nf = 2 * self.block_size
+		ng = sim.nghost
+		for key, patch in self.patches.items():
+			slc = (slice(None), slice(ng + nf * key[0], ng + nf * key[1]),
+				slice(ng + nf * key[2], ng + nf * key[3]))
+			sim.U[slc] = patch.U[patch.slc3dom]
+			sim.V[slc] = patch.V[patch.slc3dom]
+		sim.enforceBoundaryConditions()
+
+		return sim
+
+	# ---------------------------------------------------------------------------------------------
+
+	def save(self, filename = None, writer = None, fmt = None):
+		"""
+		Save the composite state at the fine resolution
+
+		The file is a normal snapshot (see :func:`uniformSimulation`), which can be loaded and
+		refined again. See :func:`~ulula.simulation.Simulation.save` for the parameters.
+		"""
+
+		self.uniformSimulation().save(filename = filename, writer = writer, fmt = fmt)
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def saveCheckpoint(self, filename = None, run_state = None):
+		"""
+		Checkpoints are not supported
+
+		A checkpoint would need to contain the state of all patches and of the refinement. 
+		Snapshots (see :func:`save`) can be used to restart, but not exactly.
+		"""
+
+		raise Exception('Checkpoints are not supported for simulations with refined grids.')
+
+###################################################################################################
+
+class NestedSimulation(AMRSimulation):
+	"""
+	Simulation with static nested grids and time subcycling
+
+	This class uses the patches of :class:`AMRSimulation`, but they are declared by the user 
+	instead of being adapted to the flow: each of the given boxes is covered by one patch, 
+	aligned with the blocks, for the entire simulation. Moreover, the nested grids are not forced to take the 
+	timestep of the coarse grid. Within each coarse step, the nested grids take as many 
+	substeps as their own CFL condition demands, which is two unless the coarse timestep is 
+	shortened. The coarse grid is thus limited by its own CFL condition or twice the timestep 
+	of the nested grids, whereas a uniform grid at the fine resolution would be limited by the 
+	timestep of the nested grids everywhere.
+	
+	A timestep proceeds as follows. First, the coarse grid is advanced by the entire step. Then,
+	the nested grids take their substeps; their ghost cells along the nest boundary are 
+	interpolated from the coarse grid at the middle of each substep, i.e., linearly in time 
+	between the coarse states before and after the coarse step. The fluxes across the nest 
+	boundary, multiplied by the respective timesteps, are added up in flux registers for both 
+	levels. Finally, the coarse cells next to the nest boundary are corrected by the difference 
+	of the registers, and the covered coarse cells are restricted. The sum of the conserved 
+	quantities over both levels is thus conserved exactly. Since both levels are synchronized 
+	after each timestep, a timestep of any size can be taken, e.g., to arrive at an output time.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	sim: Simulation
+		Simulation object with initial conditions at the resolution of the nested grids; its 
+		number of cells in x and y must be divisible by twice the block size.
+	boxes: array_like
+		List of regions to refine, each given as a tuple (xmin, xmax, ymin, ymax) in code units
+	block_size: int
+		Size of the blocks in coarse cells; the nested grids cover the boxes in units of blocks
+	"""
+
+	def __init__(self, sim, boxes, block_size = 8):
+
+		self.boxes = boxes
+		self.last_dir_fine = sim.last_dir
+		AMRSimulation.__init__(self, sim, block_size = block_size)
+		
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def patchBoxes(self):
+		"""
+		Find the ranges of blocks that cover the user-defined boxes
+
+		Each box is covered by a single patch, namely the smallest range of blocks that contains 
+		it. Patches may touch but not overlap.
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		boxes: list
+			List of block ranges (bx_min, bx_max, by_min, by_max), where the upper limits are 
+			exclusive
+		"""
+
+		w = self.block_size * self.dx
+		bx0 = self.xmin + np.arange(self.n_blocks_x) * w
+		by0 = self.ymin + np.arange(self.n_blocks_y) * w
+
+		boxes = []
+		covered = np.zeros((self.n_blocks_x, self.n_blocks_y), bool)
+		for xmin, xmax, ymin, ymax in self.boxes:
+			in_x = np.nonzero((bx0 < xmax) & (bx0 + w > xmin))[0]
+			in_y = np.nonzero((by0 < ymax) & (by0 + w > ymin))[0]
+			if (len(in_x) == 0) or (len(in_y) == 0):
+				raise Exception('Nested box (%.2e, %.2e, %.2e, %.2e) lies outside the domain.' \
+							% (xmin, xmax, ymin, ymax))
+			box = (int(in_x[0]), int(in_x[-1]) + 1, int(in_y[0]), int(in_y[-1]) + 1)
+			if np.any(covered[box[0]:box[1], box[2]:box[3]]):
+				raise Exception('Nested box (%.2e, %.2e, %.2e, %.2e) overlaps another box at a block size of %d.' \
+							% (xmin, xmax, ymin, ymax, self.block_size))
+			covered[box[0]:box[1], box[2]:box[3]] = True
+			boxes.append(box)
+
+		return boxes
+
+	# ---------------------------------------------------------------------------------------------
+
+	def maxSpeedInDomain(self):
+		"""
+		Largest signal speed on both levels
+
+		Since the nested grids take two substeps per coarse step, their signal speeds count the 
+		same as on the coarse grid (see :func:`AMRSimulation.maxSpeedInDomain`).
+		"""
+
+		c_max = ulula_sim.Simulation.maxSpeedInDomain(self)
+		for patch in self.patches.values():
+			c_max = max(c_max, patch.maxSpeed(patch.V[patch.slc3dom]))
+
+		return c_max
+
+	# ---------------------------------------------------------------------------------------------
+
+	def timestep(self, dt = None):
+		"""
+		Advance the coarse grid by one timestep and the nested grids by as many substeps as needed
+
+		See the class description and :func:`~ulula.simulation.Simulation.timestep`. The coarse 
+		grid and the nested grids alternate their sweep directions independently.
+		"""
+
+		if dt is None:
+			dt = self.cflCondition()
+		self.dt_cfl = None
+
+		patches = list(self.patches.values())
+		
+		# Flux registers for each side of the nest boundary in each direction, and the ghost cells
+		# interpolated from the coarse grid at the beginning of the step
+		registers = [[np.zeros((self.nq, self.block_size)) for r in self.reflux[idir]] for idir in range(2)]
+		V_ghost_old = [None, None]
+		for idir in range(2):
+			if self.prolong_idx[idir] is not None:
+				V_ghost_old[idir] = self.prolongate(self.V, self.prolong_idx[idir])
+
+		# Coarse step
+		if self.last_dir == 0:
+			dirs = [0, 1]
+		else:
+			dirs = [1, 0]
+		for idir in dirs:
+			self.enforceBoundaryConditions(idir)
+			self.sweep(idir, dt)
+			self.bc_stale = set(['x', 'y', 'corners'])
+			F_c = self.flux_store[idir]
+			for reg, (key, side, slc_Ff, slc_Fc, slc_U) in zip(registers[idir], self.reflux[idir]):
+				reg -= F_c[slc_Fc] * dt
+		self.last_dir = dirs[-1]
+		
+		V_ghost_new = [None, None]
+		for idir in range(2):
+			if self.prolong_idx[idir] is not None:
+				V_ghost_new[idir] = self.prolongate(self.V, self.prolong_idx[idir])
+
+		# Substeps of the nested grids. The number of substeps is set by the CFL timestep of the
+		# previous substep.
+		c_max_patches = []
+		if len(patches) > 0:
+			dt_fine = min([patch.cflCondition() for patch in patches])
+			n_sub = max(1, math.ceil(dt / dt_fine))
+			dt_sub = dt / n_sub
+		else:
+			n_sub = 0
+		for i in range(n_sub):
+			if self.last_dir_fine == 0:
+				dirs = [0, 1]
+			else:
+				dirs = [1, 0]
+			w = (i + 0.5) / n_sub
+			for idir in dirs:
+				V_ghost = None
+				if V_ghost_old[idir] is not None:
+					V_ghost = (1.0 - w) * V_ghost_old[idir] + w * V_ghost_new[idir]
+				self.fillGhostCells(idir, V_ghost = V_ghost)
+				max_speed = (idir == dirs[-1])
+				c_max_patches = self.runParallel(sweepPatch, [(p, idir, dt_sub, max_speed) for p in patches])
+				for reg, (key, side, slc_Ff, slc_Fc, slc_U) in zip(registers[idir], self.reflux[idir]):
+					F_f = self.patches[key].flux_store[idir][slc_Ff]
+					reg += 0.5 * (F_f[:, 0::2] + F_f[:, 1::2]) * dt_sub
+			for patch, c in zip(patches, c_max_patches):
+				patch.dt_cfl = patch.cflTimestep(c)
+			self.last_dir_fine = dirs[-1]
+		
+		# Correct the coarse grid with the difference between the fine and coarse fluxes across 
+		# the nest boundary
+		for idir in range(2):
+			for reg, (key, side, slc_Ff, slc_Fc, slc_U) in zip(registers[idir], self.reflux[idir]):
+				self.U[slc_U] += reg * (side / self.dx)
+		self.restrictPatches()
+		c_max = self.conservedToPrimitiveDomain(max_speed = True)
+		self.dt_cfl = self.cflTimestep(max([c_max] + c_max_patches))
+
+		if (self.hs.checks == 'every_n_steps') and ((self.step + 1) % self.hs.check_interval == 0):
+			self.checkFluidState()
+			for patch in patches:
+				patch.checkFluidState()
+
+		self.n_cell_updates += self.nx * self.ny + n_sub * sum([p.nx * p.ny for p in patches])
+		self.t += dt
+		self.step += 1
+		for patch in patches:
+			patch.t = self.t
+			patch.step = self.step
+
+		return dt
+
+###################################################################################################
+
+def restrict(U):
+	"""
+	Average blocks of 2 by 2 fine cells into coarse cells
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	U: array_like
+		Fine array of conserved variables with dimensions [nq, 2 n_x, 2 n_y]
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	U_c: array_like
+		Coarse array with dimensions [nq, n_x, n_y]
+	"""
+
+	U_c = U[:, 0::2, 0::2] + U[:, 1::2, 0::2]
+	U_c += U[:, 0::2, 1::2]
+	U_c += U[:, 1::2, 1::2]
+	U_c *= 0.25
+
+	return U_c
+
+###################################################################################################
+
+def minmod(a, b):
+	"""
+	Minmod of two arrays of slopes
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	a: array_like
+		Left slopes
+	b: array_like
+		Right slopes
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	s: array_like
+		The slope with the smaller absolute value if both have the same sign, otherwise zero
+	"""
+
+	s = np.minimum(np.abs(a), np.abs(b))
+	s *= (a * b > 0.0)
+	np.copysign(s, a, out = s)
+
+	return s
+
+###################################################################################################
+
+def sweepPatch(patch, idir, dt, max_speed):
+	"""
+	Sweep a patch, to be executed by the threads of the coarse grid
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	patch: Simulation
+		Patch to advance
+	idir: int
+		Direction of sweep (0 = x, 1 = y)
+	dt: float
+		Timestep
+	max_speed: bool
+		If ``True``, compute the largest signal speed in the patch
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	c_max: float
+		Largest signal speed if ``max_speed`` is ``True``, otherwise ``None``.
+	"""
+
+	return patch.sweep(idir, dt, max_speed = max_speed)
+
+###################################################################################################
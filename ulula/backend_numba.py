@@ -0,0 +1,435 @@
+###################################################################################################
+#
+# Ulula -- backend_numba.py
+#
+# Fused, JIT-compiled implementation of a directional sweep
+#
+# by Benedikt Diemer
+#
+###################################################################################################
+
+import numpy as np
+import numba
+
+###################################################################################################
+
+# Integer codes for the algorithmic choices that are passed to the kernels. Numba cannot branch on
+# strings efficiently, so the Simulation class translates the HydroScheme settings into these.
+LIM_NONE = 0
+LIM_MINMOD = 1
+LIM_VANLEER = 2
+LIM_MC = 3
+
+limiter_codes = {'none': LIM_NONE, 'minmod': LIM_MINMOD, 'vanleer': LIM_VANLEER, 'mc': LIM_MC}
+
+TI_EULER = 0
+TI_HANCOCK = 1
+TI_HANCOCK_CONS = 2
+
+time_integration_codes = {'euler': TI_EULER, 'hancock': TI_HANCOCK, 'hancock_cons': TI_HANCOCK_CONS}
+
+RS_HLL = 0
+RS_HLLC = 1
+
+riemann_codes = {'hll': RS_HLL, 'hllc': RS_HLLC}
+
+# Error codes returned by the sweep kernel
+ERR_NONE = 0
+ERR_PRESSURE = 1
+ERR_SOUND_SPEED = 2
+
+###################################################################################################
+
+# The kernels below reproduce the operations of the NumPy implementation in the Simulation class
+# in exactly the same order, so that the results agree to round-off (in practice, bit by bit).
+# The variable indices are the same as in the simulation module, but are repeated here to avoid a
+# circular import.
+
+DN = 0
+VX = 1
+VY = 2
+PR = 3
+
+###################################################################################################
+
+@numba.njit(cache = True, error_model = 'numpy')
+def limitSlope(sL, sR, limiter):
+	"""
+	Limited slope from the left and right slopes of one fluid variable in one cell
+	"""
+
+	if limiter == LIM_NONE:
+		return (sL + sR) * 0.5
+
+	if sL * sR > 0.0:
+		if limiter == LIM_MINMOD:
+			if abs(sL) <= abs(sR):
+				return sL
+			else:
+				return sR
+		elif limiter == LIM_VANLEER:
+			return sL * 2.0 * sR / (sL + sR)
+		else:
+			if abs(sL) <= abs(sR):
+				slim = sL * 2.0
+			else:
+				slim = sR * 2.0
+	else:
+		slim = 0.0
+
+	# Only the MC limiter gets here
+	sC = (sL + sR) * 0.5
+	if abs(slim) > abs(sC):
+		slim = sC
+
+	return slim
+
+# -------------------------------------------------------------------------------------------------
+
+@numba.njit(cache = True, error_model = 'numpy')
+def hancockPrimitive(Ve, slim, i_start, i_end, i1, i2, gamma, fac):
+	"""
+	Primitive Hancock step for the edge states Ve in cells i_start to i_end - 1
+	"""
+
+	for i in range(i_start, i_end):
+		rho = Ve[DN, i]
+		u1 = Ve[i1, i]
+		prs = Ve[PR, i]
+		d_rho = -(u1 * slim[DN, i] + slim[i1, i] * rho)
+		d_u1 = -(u1 * slim[i1, i] + slim[PR, i] / rho)
+		d_u2 = -(u1 * slim[i2, i])
+		d_prs = -(u1 * slim[PR, i] + slim[i1, i] * prs * gamma)
+		Ve[DN, i] = rho + d_rho * fac
+		Ve[i1, i] = u1 + d_u1 * fac
+		Ve[i2, i] += d_u2 * fac
+		Ve[PR, i] = prs + d_prs * fac
+
+	return
+
+# -------------------------------------------------------------------------------------------------
+
+@numba.njit(cache = True, error_model = 'numpy')
+def hancockConservative(Vm, Vp, i_start, i_end, i1, i2, gm1, gm1_inv, fac):
+	"""
+	Conservative Hancock step for the edge states Vm and Vp in cells i_start to i_end - 1; returns
+	the lowest resulting pressure
+	"""
+
+	p_min = np.inf
+	for i in range(i_start, i_end):
+
+		# Conserved states and fluxes of the left and right edge states
+		rho_m = Vm[DN, i]
+		u1_m = Vm[i1, i]
+		u2_m = Vm[i2, i]
+		prs_m = Vm[PR, i]
+		ekin_m = (u1_m * u1_m + u2_m * u2_m) * 0.5 * rho_m
+		etot_m = (u1_m * u1_m + u2_m * u2_m) * (rho_m * 0.5) + prs_m * gm1_inv + prs_m
+		rho_u1_m = rho_m * u1_m
+
+		rho_p = Vp[DN, i]
+		u1_p = Vp[i1, i]
+		u2_p = Vp[i2, i]
+		prs_p = Vp[PR, i]
+		ekin_p = (u1_p * u1_p + u2_p * u2_p) * 0.5 * rho_p
+		etot_p = (u1_p * u1_p + u2_p * u2_p) * (rho_p * 0.5) + prs_p * gm1_inv + prs_p
+		rho_u1_p = rho_p * u1_p
+
+		# Flux differences
+		dF_rho = (rho_u1_m - rho_u1_p) * fac
+		dF_m1 = ((rho_u1_m * u1_m + prs_m) - (rho_u1_p * u1_p + prs_p)) * fac
+		dF_m2 = (rho_u1_m * u2_m - rho_u1_p * u2_p) * fac
+		dF_et = (etot_m * u1_m - etot_p * u1_p) * fac
+
+		# Update conserved states and convert back
+		p_min = min(p_min, conservedToPrimitive(Vm, i, i1, i2, rho_m + dF_rho, u1_m * rho_m + dF_m1,
+								u2_m * rho_m + dF_m2, ekin_m + prs_m * gm1_inv + dF_et, gm1))
+		p_min = min(p_min, conservedToPrimitive(Vp, i, i1, i2, rho_p + dF_rho, u1_p * rho_p + dF_m1,
+								u2_p * rho_p + dF_m2, ekin_p + prs_p * gm1_inv + dF_et, gm1))
+
+	return p_min
+
+# -------------------------------------------------------------------------------------------------
+
+@numba.njit(cache = True, error_model = 'numpy')
+def conservedToPrimitive(V, i, i1, i2, rho, m1, m2, etot, gm1):
+	"""
+	Convert a conserved state to primitive variables in column i of V; returns the pressure
+	"""
+
+	u1 = m1 / rho
+	u2 = m2 / rho
+	prs = (etot - (u1 * u1 + u2 * u2) * (rho * 0.5)) * gm1
+
+	V[DN, i] = rho
+	V[i1, i] = u1
+	V[i2, i] = u2
+	V[PR, i] = prs
+
+	return prs
+
+# -------------------------------------------------------------------------------------------------
+
+@numba.njit(cache = True, error_model = 'numpy')
+def hllcFlux(flux, i, i1, i2, rho_L, u1_L, u2_L, prs_L, rho_R, u1_R, u2_R, prs_R, cs_L, cs_R, 
+			F_rho_L, F_m1_L, F_m2_L, F_et_L, F_rho_R, F_m1_R, F_m2_R, F_et_R, gm1_inv):
+	"""
+	HLLC flux across one interface
+	
+	See ``riemannSolverHLLC()`` in the Simulation class, whose branch-free formulation and order 
+	of operations this function follows.
+	"""
+
+	# Wave speed estimates of Davis (1988) and contact speed (Toro 2009, Eq. 10.37)
+	SL = min(u1_L - cs_L, u1_R - cs_R)
+	SR = max(u1_R + cs_R, u1_L + cs_L)
+	m_L = (SL - u1_L) * rho_L
+	m_R = (SR - u1_R) * rho_R
+	sstar = (m_L * u1_L - m_R * u1_R + prs_R - prs_L) / (m_L - m_R)
+	
+	if sstar < 0.0:
+		rho_K = rho_R
+		u1_K = u1_R
+		u2_K = u2_R
+		prs_K = prs_R
+		S_K = SR
+		s_K = max(SR, 0.0)
+		F_rho_K = F_rho_R
+		F_m1_K = F_m1_R
+		F_m2_K = F_m2_R
+		F_et_K = F_et_R
+	else:
+		rho_K = rho_L
+		u1_K = u1_L
+		u2_K = u2_L
+		prs_K = prs_L
+		S_K = SL
+		s_K = min(SL, 0.0)
+		F_rho_K = F_rho_L
+		F_m1_K = F_m1_L
+		F_m2_K = F_m2_L
+		F_et_K = F_et_L
+	et_K = (u1_K * u1_K + u2_K * u2_K) * 0.5 * rho_K + prs_K * gm1_inv
+	
+	m = (S_K - u1_K) * rho_K
+	d = S_K - sstar
+	if s_K == 0.0:
+		d = 1.0
+	ratio = s_K / d
+	etot = (m * sstar + prs_K) * (sstar - u1_K) * ratio
+	ratio = ratio * m
+	etot += et_K / rho_K * ratio
+	
+	flux[DN, i] = F_rho_K - rho_K * s_K + ratio
+	flux[i1, i] = F_m1_K - u1_K * rho_K * s_K + ratio * sstar
+	flux[i2, i] = F_m2_K - u2_K * rho_K * s_K + ratio * u2_K
+	flux[PR, i] = F_et_K - et_K * s_K + etot
+
+	return
+
+###################################################################################################
+
+@numba.njit(cache = True, error_model = 'numpy', nogil = True)
+def sweep(V, U, F, i1, i2, lo, hi, linear, limiter, time_integration, riemann, dt, dx, gamma, gm1, 
+		gm1_inv, max_speed):
+	"""
+	Fused directional sweep
+
+	This kernel performs the entire sweep (reconstruction, limiting, Hancock predictor, HLL or 
+	HLLC Riemann solver, flux difference, and conversion to primitive variables) one pencil at a time.
+	Each pencil is copied into small local buffers, so that all intermediate states stay in cache,
+	and each stage is a single loop over the pencil that keeps the fluid state in registers. The
+	kernel releases the GIL, so that strips of pencils can be processed by concurrent threads. The
+	local buffers are always double precision; single-precision fluid arrays are converted when 
+	they are copied in and rounded when the results are written back. If requested, the largest
+	signal speed of the new fluid state is computed from the written values, in the precision of
+	the fluid arrays, as in the NumPy implementation.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	V: array_like
+		Primitive variables with dimensions [nq, n_pencils, n_cells], where the sweep runs along
+		the last dimension; may be a strided view. Updated in the physical cells.
+	U: array_like
+		Conserved variables with the same dimensions as ``V``; updated in the physical cells.
+	F: array_like
+		Array with dimensions [nq, n_pencils, hi - lo + 2] into which the fluxes across the 
+		physical interfaces are written; ignored if it contains no pencils.
+	i1: int
+		Index of the velocity component along the sweep
+	i2: int
+		Index of the velocity component perpendicular to the sweep
+	lo: int
+		First physical cell along the sweep
+	hi: int
+		Last physical cell along the sweep
+	linear: bool
+		If ``True``, use piecewise-linear reconstruction; otherwise, piecewise-constant
+	limiter: int
+		Limiter code (see ``LIM_*``)
+	time_integration: int
+		Time integration code (see ``TI_*``)
+	riemann: int
+		Riemann solver code (see ``RS_*``)
+	dt: float
+		Timestep
+	dx: float
+		Cell size
+	gamma: float
+		Adiabatic index
+	gm1: float
+		gamma - 1
+	gm1_inv: float
+		1 / (gamma - 1)
+	max_speed: bool
+		If ``True``, compute the largest signal speed in the updated cells
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	err: int
+		Error code (see ``ERR_*``); zero if the sweep succeeded.
+	c_max: float
+		Largest signal speed in the updated cells if ``max_speed`` is ``True``, otherwise zero.
+	"""
+
+	nq = V.shape[0]
+	n_pencils = V.shape[1]
+	n_cells = V.shape[2]
+	fac = 0.5 * dt / dx
+	dtdx = dt / dx
+	store_flux = (F.shape[1] > 0)
+
+	Vc = np.empty((nq, n_cells))
+	Uc = np.empty((nq, n_cells))
+	Vm = np.empty((nq, n_cells))
+	Vp = np.empty((nq, n_cells))
+	slim = np.empty((nq, n_cells))
+	flux = np.empty((nq, n_cells + 1))
+	
+	# The adiabatic index in the precision of the fluid arrays, for the signal speed
+	gamma_v = np.empty(1, V.dtype)
+	gamma_v[0] = gamma
+	c_max = 0.0
+	
+	# Cells that border a physical interface
+	i_start = lo - 1
+	i_end = hi + 2
+
+	for j in range(n_pencils):
+
+		for q in range(nq):
+			for i in range(n_cells):
+				Vc[q, i] = V[q, j, i]
+				Uc[q, i] = U[q, j, i]
+
+		# Cell-edge states
+		if linear:
+			for q in range(nq):
+				for i in range(i_start, i_end):
+					sL = Vc[q, i] - Vc[q, i - 1]
+					sR = Vc[q, i + 1] - Vc[q, i]
+					slim[q, i] = limitSlope(sL, sR, limiter)
+					half_slope = slim[q, i] * 0.5
+					Vm[q, i] = Vc[q, i] - half_slope
+					Vp[q, i] = Vc[q, i] + half_slope
+
+			if time_integration == TI_HANCOCK:
+				hancockPrimitive(Vm, slim, i_start, i_end, i1, i2, gamma, fac)
+				hancockPrimitive(Vp, slim, i_start, i_end, i1, i2, gamma, fac)
+			elif time_integration == TI_HANCOCK_CONS:
+				if hancockConservative(Vm, Vp, i_start, i_end, i1, i2, gm1, gm1_inv, fac) <= 0.0:
+					return ERR_PRESSURE, c_max
+		else:
+			for q in range(nq):
+				for i in range(i_start, i_end):
+					Vm[q, i] = Vc[q, i]
+					Vp[q, i] = Vc[q, i]
+
+		# HLL(C) fluxes across the interfaces; interface i lies between cells i - 1 and i
+		cs_isnan = False
+		for i in range(lo, hi + 2):
+
+			rho_L = Vp[DN, i - 1]
+			u1_L = Vp[i1, i - 1]
+			u2_L = Vp[i2, i - 1]
+			prs_L = Vp[PR, i - 1]
+			rho_R = Vm[DN, i]
+			u1_R = Vm[i1, i]
+			u2_R = Vm[i2, i]
+			prs_R = Vm[PR, i]
+
+			cs_L = np.sqrt(prs_L * gamma / rho_L)
+			cs_R = np.sqrt(prs_R * gamma / rho_R)
+			cs_isnan = cs_isnan or np.isnan(cs_L) or np.isnan(cs_R)
+			SL = u1_L - cs_L
+			SR = u1_R + cs_R
+
+			# Fluxes on the left and right
+			F_rho_L = rho_L * u1_L
+			F_m1_L = F_rho_L * u1_L + prs_L
+			F_m2_L = F_rho_L * u2_L
+			F_et_L = ((u1_L * u1_L + u2_L * u2_L) * (rho_L * 0.5) + prs_L * gm1_inv + prs_L) * u1_L
+			F_rho_R = rho_R * u1_R
+			F_m1_R = F_rho_R * u1_R + prs_R
+			F_m2_R = F_rho_R * u2_R
+			F_et_R = ((u1_R * u1_R + u2_R * u2_R) * (rho_R * 0.5) + prs_R * gm1_inv + prs_R) * u1_R
+
+			if riemann == RS_HLLC:
+				hllcFlux(flux, i, i1, i2, rho_L, u1_L, u2_L, prs_L, rho_R, u1_R, u2_R, prs_R, cs_L, cs_R, 
+						F_rho_L, F_m1_L, F_m2_L, F_et_L, F_rho_R, F_m1_R, F_m2_R, F_et_R, gm1_inv)
+			elif SR <= 0.0:
+				flux[DN, i] = F_rho_R
+				flux[i1, i] = F_m1_R
+				flux[i2, i] = F_m2_R
+				flux[PR, i] = F_et_R
+			elif SL >= 0.0:
+				flux[DN, i] = F_rho_L
+				flux[i1, i] = F_m1_L
+				flux[i2, i] = F_m2_L
+				flux[PR, i] = F_et_L
+			else:
+				et_L = (u1_L * u1_L + u2_L * u2_L) * 0.5 * rho_L + prs_L * gm1_inv
+				et_R = (u1_R * u1_R + u2_R * u2_R) * 0.5 * rho_R + prs_R * gm1_inv
+				SLSR = SL * SR
+				dS = SR - SL
+				flux[DN, i] = (SR * F_rho_L - SL * F_rho_R + (rho_R - rho_L) * SLSR) / dS
+				flux[i1, i] = (SR * F_m1_L - SL * F_m1_R + (u1_R * rho_R - u1_L * rho_L) * SLSR) / dS
+				flux[i2, i] = (SR * F_m2_L - SL * F_m2_R + (u2_R * rho_R - u2_L * rho_L) * SLSR) / dS
+				flux[PR, i] = (SR * F_et_L - SL * F_et_R + (et_R - et_L) * SLSR) / dS
+		
+		if cs_isnan:
+			return ERR_SOUND_SPEED, c_max
+		
+		if store_flux:
+			for q in range(nq):
+				for i in range(lo, hi + 2):
+					F[q, j, i - lo] = flux[q, i]
+
+		# Godunov update and conversion back to primitive variables
+		p_min = np.inf
+		for i in range(lo, hi + 1):
+			for q in range(nq):
+				Uc[q, i] += (flux[q, i] - flux[q, i + 1]) * dtdx
+			p_min = min(p_min, conservedToPrimitive(Vc, i, i1, i2, Uc[DN, i], Uc[i1, i], Uc[i2, i], 
+												Uc[PR, i], gm1))
+		# The results are written back even if the pressure is invalid, so that the offending 
+		# cells can be found in the domain.
+		for q in range(nq):
+			for i in range(lo, hi + 1):
+				U[q, j, i] = Uc[q, i]
+				V[q, j, i] = Vc[q, i]
+
+		if p_min <= 0.0:
+			return ERR_PRESSURE, c_max
+
+		if max_speed:
+			for i in range(lo, hi + 1):
+				cs = np.sqrt(V[PR, j, i] * gamma_v[0] / V[DN, j, i])
+				if np.isnan(cs):
+					return ERR_SOUND_SPEED, c_max
+				c_max = max(c_max, max(abs(V[VX, j, i]), abs(V[VY, j, i])) + cs)
+
+	return ERR_NONE, c_max
+
+###################################################################################################
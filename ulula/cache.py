@@ -0,0 +1,447 @@
+###################################################################################################
+#
+# Ulula -- cache.py
+#
+# On-disk cache of simulation results
+#
+# by Benedikt Diemer
+#
+###################################################################################################
+
+import os
+import glob
+import json
+import copy
+import shutil
+import pickle
+import hashlib
+import tempfile
+import numpy as np
+
+import ulula.simulation as ulula_sim
+import ulula.decomposition as ulula_decomp
+
+###################################################################################################
+
+# Digest of the source code of the Ulula package, which is part of each cache key so that results
+# computed with a different version of the code are never returned
+code_digest = None
+
+###################################################################################################
+
+class ResultCache():
+	"""
+	Content-addressed cache of simulation runs
+
+	Each entry holds the final state of a run and the states at which the run produced output
+	files, plots, or movie frames (the "events" of the run), so that :func:`~ulula.run.run` can
+	re-create those outputs without re-computing the simulation. An entry is identified by a hash
+	of all parameters that determine the simulation and its events: the setup class and its
+	attributes, the hydro scheme, the resolution, the final time or number of steps, nested grids,
+	the output and plotting schedule, the snapshot file version, and the source code of Ulula
+	itself. Parameters that affect only the appearance of plots, or that do not change the result
+	(such as the number of processes), are not part of the key.
+
+	The states are stored as pickled simulation objects, which means that they are restored bit
+	by bit, including the conserved variables. Thus, a run that is continued from a cached state
+	is identical to a run that was not interrupted. Each entry also records a "lineage" hash that
+	excludes the final time, which allows :func:`~ulula.run.run` to find an earlier state of the
+	same run and continue it when only ``tmax`` has increased.
+
+	The total size of the cache is limited by evicting the least recently used entries.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	cache_dir: str
+		Directory where the entries are stored; it is created if necessary
+	max_size: float
+		Maximum total size of the cache in bytes; if ``None``, the size is not limited. The most
+		recent entry is never evicted, even if it is larger than the limit.
+	"""
+
+	def __init__(self, cache_dir, max_size = None):
+
+		self.cache_dir = os.path.abspath(cache_dir)
+		self.max_size = max_size
+		if not os.path.exists(self.cache_dir):
+			os.makedirs(self.cache_dir)
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def key(self, pars):
+		"""
+		Hash of a dictionary of parameters
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		pars: dict
+			Parameters of a run; must be convertible to JSON by :func:`canonicalParameters`
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		key: str
+			Hexadecimal SHA-256 hash
+		"""
+
+		s = json.dumps(canonicalParameters(pars), sort_keys = True)
+		key = hashlib.sha256(s.encode('utf-8')).hexdigest()
+
+		return key
+
+	# ---------------------------------------------------------------------------------------------
+
+	def entryDir(self, key):
+		"""
+		Directory of the entry with a given key
+		"""
+
+		return os.path.join(self.cache_dir, key)
+
+	# ---------------------------------------------------------------------------------------------
+
+	def lookup(self, key):
+		"""
+		Find the entry with a given key
+
+		A successful lookup counts as a use of the entry for the purpose of eviction.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		key: str
+			Key of the entry
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		entry: dict
+			Description of the entry, or ``None`` if there is no such entry
+		"""
+
+		fn = os.path.join(self.entryDir(key), 'entry.json')
+		if not os.path.exists(fn):
+			return None
+		with open(fn, 'r') as f:
+			entry = json.load(f)
+		os.utime(fn)
+
+		return entry
+
+	# ---------------------------------------------------------------------------------------------
+
+	def lookupResumable(self, lineage, tmax):
+		"""
+		Find the latest cached state of a run that can be continued to a given time
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		lineage: str
+			Hash of the parameters of the run excluding the final time
+		tmax: float
+			Time to which the run is to be continued
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		entry: dict
+			The entry with the same lineage that reached the latest time before ``tmax``, or
+			``None`` if there is no such entry
+		"""
+
+		best = None
+		for fn in glob.glob(os.path.join(self.cache_dir, '*', 'entry.json')):
+			try:
+				with open(fn, 'r') as f:
+					entry = json.load(f)
+			except Exception:
+				continue
+			if os.path.basename(os.path.dirname(fn)) != entry['key']:
+				continue
+			if (entry['lineage'] != lineage) or (entry['t'] >= tmax):
+				continue
+			if (best is None) or (entry['t'] > best['t']):
+				best = entry
+		if best is not None:
+			os.utime(os.path.join(self.entryDir(best['key']), 'entry.json'))
+
+		return best
+
+	# ---------------------------------------------------------------------------------------------
+
+	def loadState(self, entry, filename):
+		"""
+		Load a simulation state from an entry
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		entry: dict
+			Cache entry
+		filename: str
+			File of the state within the entry
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		sim: Simulation
+			Object of type :data:`~ulula.simulation.Simulation`
+		"""
+
+		with open(os.path.join(self.entryDir(entry['key']), filename), 'rb') as f:
+			sim = pickle.load(f)
+
+		return sim
+
+	# ---------------------------------------------------------------------------------------------
+
+	def beginEntry(self, key, lineage, pars, events = None, from_entry = None):
+		"""
+		Start recording a new entry
+
+		The entry is written to a temporary directory that becomes visible only in
+		:func:`commitEntry`, so that an interrupted run never leaves an incomplete entry.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		key: str
+			Key of the new entry
+		lineage: str
+			Hash of the parameters excluding the final time
+		pars: dict
+			Parameters of the run, stored for reference
+		events: array_like
+			Events of ``from_entry`` that the new entry inherits (if a run is continued)
+		from_entry: dict
+			Entry whose event states are copied into the new entry
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		entry: dict
+			Description of the new entry
+		"""
+
+		entry = {}
+		entry['key'] = key
+		entry['lineage'] = lineage
+		entry['pars'] = canonicalParameters(pars)
+		entry['events'] = []
+		entry['tmp_dir'] = tempfile.mkdtemp(prefix = 'tmp_', dir = self.cache_dir)
+
+		if events is not None:
+			for ev in events:
+				shutil.copyfile(os.path.join(self.entryDir(from_entry['key']), ev['file']),
+							os.path.join(entry['tmp_dir'], ev['file']))
+				entry['events'].append(copy.copy(ev))
+
+		return entry
+
+	# ---------------------------------------------------------------------------------------------
+
+	def recordEvent(self, entry, kind, sim, final_step = False):
+		"""
+		Store the state of a simulation at which an output, plot, or movie frame was produced
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		entry: dict
+			Entry returned by :func:`beginEntry`
+		kind: str
+			Type of the event (see :func:`~ulula.run.run`)
+		sim: Simulation
+			Simulation at the time of the event
+		final_step: bool
+			Whether the event happened after the end of the main loop
+		"""
+
+		fn = 'event_%05d.pkl' % (len(entry['events']))
+		dumpState(sim, os.path.join(entry['tmp_dir'], fn))
+		entry['events'].append(dict(kind = kind, file = fn, final_step = final_step))
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def commitEntry(self, entry, sim, schedule):
+		"""
+		Store the final state and make an entry visible
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		entry: dict
+			Entry returned by :func:`beginEntry`
+		sim: Simulation
+			Final state of the run
+		schedule: dict
+			State of the output schedule of the run, needed to continue it
+		"""
+
+		tmp_dir = entry.pop('tmp_dir')
+		dumpState(sim, os.path.join(tmp_dir, 'final.pkl'))
+		entry['t'] = float(sim.t)
+		entry['step'] = int(sim.step)
+		entry['schedule'] = schedule
+		entry['size'] = sum([os.path.getsize(fn) for fn in glob.glob(os.path.join(tmp_dir, '*'))])
+		with open(os.path.join(tmp_dir, 'entry.json'), 'w') as f:
+			json.dump(entry, f, indent = 1)
+
+		# If an entry with the same key exists (e.g., written by a concurrent run), we replace it
+		entry_dir = self.entryDir(entry['key'])
+		if os.path.exists(entry_dir):
+			shutil.rmtree(entry_dir, ignore_errors = True)
+		os.rename(tmp_dir, entry_dir)
+		self.evict(keep = entry['key'])
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def abortEntry(self, entry):
+		"""
+		Discard an entry that was not committed
+		"""
+
+		if 'tmp_dir' in entry:
+			shutil.rmtree(entry.pop('tmp_dir'), ignore_errors = True)
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def evict(self, keep = None):
+		"""
+		Remove the least recently used entries until the cache is within its size limit
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		keep: str
+			Key of an entry that must not be removed
+		"""
+
+		if self.max_size is None:
+			return
+
+		entries = []
+		for fn in glob.glob(os.path.join(self.cache_dir, '*', 'entry.json')):
+			try:
+				with open(fn, 'r') as f:
+					entry = json.load(f)
+				if os.path.basename(os.path.dirname(fn)) != entry['key']:
+					continue
+				entries.append((os.path.getmtime(fn), entry['key'], entry['size']))
+			except Exception:
+				continue
+		entries.sort()
+
+		total = sum([e[2] for e in entries])
+		for _, key, size in entries:
+			if total <= self.max_size:
+				break
+			if key == keep:
+				continue
+			shutil.rmtree(self.entryDir(key), ignore_errors = True)
+			total -= size
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def clear(self):
+		"""
+		Remove all entries from the cache
+		"""
+
+		for d in glob.glob(os.path.join(self.cache_dir, '*')):
+			if os.path.isdir(d):
+				shutil.rmtree(d, ignore_errors = True)
+
+		return
+
+###################################################################################################
+
+def canonicalParameters(pars):
+	"""
+	Convert parameters to types that can be written to JSON in a unique way
+
+	Numpy scalars and arrays are converted to Python numbers and lists, tuples to lists, and other
+	objects to their class name and attributes (or their representation if they have none).
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	pars: any
+		Parameter or (nested) dictionary or list of parameters
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	pars_canonical: any
+		Converted parameters
+	"""
+
+	if isinstance(pars, dict):
+		return {str(k): canonicalParameters(v) for k, v in pars.items()}
+	if isinstance(pars, (list, tuple)):
+		return [canonicalParameters(v) for v in pars]
+	if isinstance(pars, np.ndarray):
+		return canonicalParameters(pars.tolist())
+	if isinstance(pars, np.generic):
+		return pars.item()
+	if (pars is None) or isinstance(pars, (bool, int, float, str)):
+		return pars
+	if hasattr(pars, '__dict__'):
+		return dict(cls = '%s.%s' % (type(pars).__module__, type(pars).__qualname__),
+				attrs = canonicalParameters(vars(pars)))
+
+	return repr(pars)
+
+###################################################################################################
+
+def codeVersion():
+	"""
+	Identifier of the version of the Ulula code
+
+	Since changes to the code can change the results of a simulation, the identifier combines the
+	snapshot file version with a hash of all source files of the package. The hash is computed
+	only once per process.
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	version: str
+		Identifier of the code version
+	"""
+
+	global code_digest
+
+	if code_digest is None:
+		pkg_dir = os.path.dirname(os.path.abspath(__file__))
+		h = hashlib.sha256()
+		for fn in sorted(glob.glob(os.path.join(pkg_dir, '*.py')) + glob.glob(os.path.join(pkg_dir, 'setups', '*.py'))):
+			h.update(os.path.relpath(fn, pkg_dir).encode('utf-8'))
+			with open(fn, 'rb') as f:
+				h.update(f.read())
+		code_digest = h.hexdigest()
+
+	version = '%s_%s' % (ulula_sim.file_version_current, code_digest)
+
+	return version
+
+###################################################################################################
+
+def dumpState(sim, filename):
+	"""
+	Pickle a simulation state
+
+	A decomposed simulation is stored as a serial copy because its worker processes cannot be
+	pickled.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	sim: Simulation
+		Simulation object
+	filename: str
+		Output filename
+	"""
+
+	if isinstance(sim, ulula_decomp.DecomposedSimulation):
+		sim = copy.deepcopy(sim)
+	with open(filename, 'wb') as f:
+		pickle.dump(sim, f, protocol = pickle.HIGHEST_PROTOCOL)
+
+	return
+
+###################################################################################################
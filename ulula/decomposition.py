@@ -0,0 +1,582 @@
+###################################################################################################
+#
+# Ulula -- decomposition.py
+#
+# Domain decomposition of a simulation across multiple processes
+#
+# by Benedikt Diemer
+#
+###################################################################################################
+
+import numpy as np
+import io
+import contextlib
+import multiprocessing
+import multiprocessing.shared_memory
+import threading
+import weakref
+
+import ulula.simulation as ulula_sim
+
+###################################################################################################
+
+class DecomposedSimulation(ulula_sim.Simulation):
+	"""
+	Simulation that is advanced by multiple processes
+
+	The domain is divided into rectangular tiles, each of which is owned by a worker process. The
+	fluid variables of each tile, including its ghost cells, live in shared memory. A worker
+	advances its tile with the usual sweeps but, instead of enforcing the boundary conditions
+	itself, fills its ghost cells from the physical cells of the neighboring tiles (or from its own
+	edge for outflow boundaries). The global timestep is computed from the maximum signal speed in
+	all tiles, or, after a timestep, as the smallest of the CFL timesteps that the tiles computed
+	during their sweeps.
+
+	Since each cell is updated with exactly the same operations as in a serial simulation, the
+	results are identical bit by bit. After each timestep, the tiles are gathered into the arrays
+	of this object, which can thus be plotted and saved like any other simulation. A copy of a
+	decomposed simulation is a serial simulation, since the worker processes cannot be copied.
+
+	The workers must be stopped with :func:`shutdown` when the simulation is no longer advanced;
+	this also happens automatically when the object is deleted.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	sim: Simulation
+		Simulation object with initial conditions (or loaded from a file)
+	n_procs: int
+		Number of worker processes (and tiles)
+	"""
+
+	def __init__(self, sim, n_procs):
+
+		ulula_sim.Simulation.__init__(self, sim.hs)
+		copySimulationState(sim, self)
+
+		# The ghost cells are copied into the tiles, so they must be up to date. They are stale if
+		# the simulation has already been advanced, e.g., if it was loaded from a checkpoint.
+		if len(sim.bc_stale) > 0:
+			ulula_sim.Simulation.enforceBoundaryConditions(self)
+			self.dt_cfl = sim.dt_cfl
+
+		# The parent process never runs the hydro kernels
+		self.ws = None
+		self.ws_strips = []
+
+		# Choose the tiling and create the tiles
+		self.n_procs = n_procs
+		self.n_tiles_x, self.n_tiles_y = tileLayout(self.nx, self.ny, self.nghost, n_procs)
+		x_edges = np.linspace(0, self.nx, self.n_tiles_x + 1).astype(int)
+		y_edges = np.linspace(0, self.ny, self.n_tiles_y + 1).astype(int)
+
+		ng = self.nghost
+		self.tiles = []
+		for ix in range(self.n_tiles_x):
+			for iy in range(self.n_tiles_y):
+				tile = {}
+				tile['x0'] = x_edges[ix]
+				tile['x1'] = x_edges[ix + 1]
+				tile['y0'] = y_edges[iy]
+				tile['y1'] = y_edges[iy + 1]
+				tile['shape'] = (self.nq, tile['x1'] - tile['x0'] + 2 * ng, tile['y1'] - tile['y0'] + 2 * ng)
+				self.tiles.append(tile)
+
+		# Create shared memory for each tile and copy the initial state, including the ghost
+		# cells, into it.
+		self.shm = []
+		self.tile_arrays = []
+		for tile in self.tiles:
+			slc = self.tileSlice(tile)
+			arrays = {}
+			for name, arr in [('V', self.V), ('U', self.U)]:
+				shm = multiprocessing.shared_memory.SharedMemory(create = True,
+								size = int(np.prod(tile['shape'])) * np.dtype(self.dtype).itemsize)
+				arrays[name] = np.ndarray(tile['shape'], dtype = self.dtype, buffer = shm.buf)
+				arrays[name][...] = arr[slc]
+				tile['shm_%s' % name] = shm.name
+				self.shm.append(shm)
+			self.tile_arrays.append(arrays)
+
+		for i in range(len(self.tiles)):
+			self.tiles[i]['halo'] = self.haloCopies(i)
+
+		# Start the workers. Each worker gets a pipe for commands and results; the barrier
+		# synchronizes the halo exchanges between sweeps. We keep a reference to the barrier
+		# because, with the spawn start method, the workers attach to its semaphore only after
+		# they have started.
+		self.barrier_workers = multiprocessing.Barrier(len(self.tiles))
+		self.conns = []
+		self.procs = []
+		for i in range(len(self.tiles)):
+			conn_parent, conn_worker = multiprocessing.Pipe()
+			proc = multiprocessing.Process(target = workerMain, daemon = True,
+							args = (i, self.tiles, self.hs, self.bc_type, self.gamma, self.dx,
+									self.x, self.y, self.last_dir, self.barrier_workers, conn_worker))
+			proc.start()
+			self.conns.append(conn_parent)
+			self.procs.append(proc)
+
+		# Make sure workers and shared memory are cleaned up even if shutdown() is never called
+		self.finalizer = weakref.finalize(self, shutdownWorkers, self.conns, self.procs, self.shm)
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def __deepcopy__(self, memo):
+
+		sim = ulula_sim.Simulation(self.hs)
+		copySimulationState(self, sim)
+
+		return sim
+
+	# ---------------------------------------------------------------------------------------------
+
+	def tileSlice(self, tile):
+		"""
+		Slice of the global arrays that corresponds to a tile including its ghost cells
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		tile: dict
+			Tile dictionary
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		slc: tuple
+			3D slice into the global arrays
+		"""
+
+		ng = self.nghost
+
+		return (slice(None), slice(tile['x0'], tile['x1'] + 2 * ng), slice(tile['y0'], tile['y1'] + 2 * ng))
+
+	# ---------------------------------------------------------------------------------------------
+
+	def haloCopies(self, i_tile):
+		"""
+		Compute the copy operations that fill the ghost cells of a tile
+
+		Each ghost cell is filled from the physical cell it would be filled from in a serial
+		simulation: the periodic image or the closest edge cell for outflow boundaries. Along each
+		dimension, the ghost cells are split into the left ghost region, the physical cells, and
+		the right ghost region, giving eight ghost blocks. Since tiles are at least ``nghost`` cells
+		wide, each block is filled from exactly one source tile.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		i_tile: int
+			Index of the tile
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		copies: array_like
+			List of tuples (ghost region, destination slice, source tile index, source index array),
+			where the region is ``x``, ``y``, or ``corners`` as in the ``bc_stale`` set of the 
+			simulation
+		"""
+
+		ng = self.nghost
+		tile = self.tiles[i_tile]
+
+		# Map a global cell index to a physical cell index according to the boundary conditions
+		def physicalIndex(g, n):
+			if self.bc_type == 'periodic':
+				return np.mod(g, n)
+			elif self.bc_type == 'outflow':
+				return np.clip(g, 0, n - 1)
+			else:
+				raise Exception('Unknown type of boundary condition, %s.' % (self.bc_type))
+
+		# Blocks along each dimension as (local slice, global cell indices)
+		blocks = []
+		for d, n in [('x', self.nx), ('y', self.ny)]:
+			lo = tile['%s0' % d]
+			hi = tile['%s1' % d]
+			n_loc = hi - lo
+			blocks.append([(slice(0, ng), np.arange(lo - ng, lo)),
+						(slice(ng, ng + n_loc), np.arange(lo, hi)),
+						(slice(ng + n_loc, n_loc + 2 * ng), np.arange(hi, hi + ng))])
+
+		copies = []
+		for bx in range(3):
+			for by in range(3):
+				if (bx == 1) and (by == 1):
+					continue
+				slc_x, gx = blocks[0][bx]
+				slc_y, gy = blocks[1][by]
+				gx = physicalIndex(gx, self.nx)
+				gy = physicalIndex(gy, self.ny)
+
+				# Find source tile and convert to its local indices
+				for j in range(len(self.tiles)):
+					src = self.tiles[j]
+					if (src['x0'] <= gx[0] < src['x1']) and (src['y0'] <= gy[0] < src['y1']):
+						break
+				idx = (slice(None), (gx - src['x0'] + ng)[:, None], (gy - src['y0'] + ng)[None, :])
+				if by == 1:
+					region = 'x'
+				elif bx == 1:
+					region = 'y'
+				else:
+					region = 'corners'
+				copies.append((region, (slice(None), slc_x, slc_y), j, idx))
+
+		return copies
+
+	# ---------------------------------------------------------------------------------------------
+
+	def command(self, cmd, arg = None):
+		"""
+		Send a command to all workers and collect the results
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		cmd: str
+			Command (see :func:`workerMain`)
+		arg: any
+			Argument to the command
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		results: array_like
+			List of return values from the workers
+		"""
+
+		if self.conns is None:
+			raise Exception('The workers of this decomposed simulation have been shut down.')
+
+		for conn in self.conns:
+			conn.send((cmd, arg))
+		results = []
+		errors = []
+		for conn in self.conns:
+			status, res = conn.recv()
+			if status == 'error':
+				errors.append(res)
+			results.append(res)
+		if len(errors) > 0:
+			raise Exception('Error in worker process: %s' % (errors[0]))
+
+		return results
+
+	# ---------------------------------------------------------------------------------------------
+
+	def maxSpeedInDomain(self):
+		"""
+		Largest signal speed in domain
+
+		The maximum is taken over the maxima in the tiles (including their ghost cells), which
+		together cover the same cells as a serial simulation.
+		"""
+
+		return max(self.command('max_speed'))
+
+	# ---------------------------------------------------------------------------------------------
+
+	def timestep(self, dt = None):
+		"""
+		Advance all tiles by one timestep
+
+		See :func:`~ulula.simulation.Simulation.timestep`. After the workers have taken the
+		timestep, the physical cells of the tiles are gathered into the global arrays, and the
+		global ghost cells are set by the boundary conditions. The next timestep is the smallest of
+		the CFL timesteps of the tiles, which is the same as the timestep for the largest signal
+		speed in all tiles.
+		"""
+
+		if dt is None:
+			dt = self.cflCondition()
+
+		dt_cfl_tiles = self.command('timestep', dt)
+
+		ng = self.nghost
+		for i in range(len(self.tiles)):
+			tile = self.tiles[i]
+			slc_glb = (slice(None), slice(tile['x0'] + ng, tile['x1'] + ng), slice(tile['y0'] + ng, tile['y1'] + ng))
+			slc_loc = (slice(None), slice(ng, -ng), slice(ng, -ng))
+			self.V[slc_glb] = self.tile_arrays[i]['V'][slc_loc]
+			self.U[slc_glb] = self.tile_arrays[i]['U'][slc_loc]
+		self.enforceBoundaryConditions()
+		self.dt_cfl = min(dt_cfl_tiles)
+
+		# The workers alternate the sweep order in the same way as the serial timestep function
+		if self.last_dir == 0:
+			self.last_dir = 1
+		else:
+			self.last_dir = 0
+		self.t += dt
+		self.step += 1
+
+		return dt
+
+	# ---------------------------------------------------------------------------------------------
+
+	def shutdown(self):
+		"""
+		Stop the worker processes and release the shared memory
+		"""
+
+		self.tile_arrays = None
+		self.finalizer()
+		self.conns = None
+
+		return
+
+###################################################################################################
+
+class TileSimulation(ulula_sim.Simulation):
+	"""
+	Simulation of one tile in a worker process
+
+	This class differs from a normal simulation only in how the ghost cells are filled. Instead of
+	boundary conditions, they are copied from the shared memory of the tiles that own the
+	corresponding cells. The barriers ensure that all tiles have finished their sweep before any
+	of them reads its neighbors, and that all tiles have filled their ghost cells before the next
+	sweep modifies the physical cells. As in a serial simulation, only the stale ghost regions 
+	that the next sweep reads are exchanged; since all workers execute the same sequence of sweeps,
+	they agree on which regions are stale.
+	"""
+
+	def enforceBoundaryConditions(self, idir = None, corners = False):
+
+		if idir is None:
+			names = ['V', 'U']
+			regions = ['x', 'y', 'corners']
+		else:
+			names = ['V']
+			regions = [['x', 'y'][idir]]
+			if corners:
+				regions.append('corners')
+			regions = [r for r in regions if r in self.bc_stale]
+			if len(regions) == 0:
+				return
+		
+		self.barrier.wait()
+		for region, slc_dst, j, idx in self.halo:
+			if region in regions:
+				for name in names:
+					getattr(self, name)[slc_dst] = self.tile_arrays[j][name][idx]
+		self.barrier.wait()
+
+		if idir is None:
+			self.bc_stale = set()
+		else:
+			self.bc_stale.difference_update(regions)
+
+		return
+
+###################################################################################################
+
+def copySimulationState(sim_from, sim_to):
+	"""
+	Copy the domain, fluid properties, and fluid state between simulations
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	sim_from: Simulation
+		Simulation to copy from
+	sim_to: Simulation
+		Simulation to copy to; must have been created with the same hydro scheme
+	"""
+
+	# The domain was already announced when the original simulation was set up
+	with contextlib.redirect_stdout(io.StringIO()):
+		sim_to.setDomain(sim_from.nx, sim_from.ny, xmin = sim_from.xmin, xmax = sim_from.xmax,
+					ymin = sim_from.ymin, bc_type = sim_from.bc_type)
+	sim_to.setFluidProperties(sim_from.gamma)
+	sim_to.U[...] = sim_from.U
+	sim_to.V[...] = sim_from.V
+	sim_to.t = sim_from.t
+	sim_to.step = sim_from.step
+	sim_to.last_dir = sim_from.last_dir
+	sim_to.dt_cfl = sim_from.dt_cfl
+
+	return
+
+###################################################################################################
+
+def tileLayout(nx, ny, nghost, n_procs):
+	"""
+	Choose the number of tiles in x and y
+
+	Among all factorizations of the number of processes, we choose the one with the shortest total
+	length of tile boundaries, which minimizes the number of ghost cells that need to be exchanged.
+	Each tile must be at least ``nghost`` cells wide.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx: int
+		Number of cells in x
+	ny: int
+		Number of cells in y
+	nghost: int
+		Number of ghost cells
+	n_procs: int
+		Number of processes
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	n_tiles_x: int
+		Number of tiles in x
+	n_tiles_y: int
+		Number of tiles in y
+	"""
+
+	best = None
+	for n_tiles_x in range(1, n_procs + 1):
+		if n_procs % n_tiles_x != 0:
+			continue
+		n_tiles_y = n_procs // n_tiles_x
+		if (nx // n_tiles_x < nghost) or (ny // n_tiles_y < nghost):
+			continue
+		cut_length = (n_tiles_x - 1) * ny + (n_tiles_y - 1) * nx
+		if (best is None) or (cut_length < best[0]):
+			best = (cut_length, n_tiles_x, n_tiles_y)
+
+	if best is None:
+		raise Exception('Cannot divide domain of %d x %d cells into %d tiles of at least %d cells.' \
+					% (nx, ny, n_procs, nghost))
+
+	return best[1], best[2]
+
+###################################################################################################
+
+def shutdownWorkers(conns, procs, shm_list):
+	"""
+	Stop worker processes and release shared memory
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	conns: array_like
+		Pipes to the workers
+	procs: array_like
+		Worker processes
+	shm_list: array_like
+		Shared memory blocks to release
+	"""
+
+	for conn in conns:
+		try:
+			conn.send(('stop', None))
+		except Exception:
+			pass
+	for proc in procs:
+		proc.join(timeout = 10.0)
+		if proc.is_alive():
+			proc.terminate()
+	for shm in shm_list:
+		shm.close()
+		shm.unlink()
+
+	return
+
+###################################################################################################
+
+def workerMain(i_tile, tiles, hs, bc_type, gamma, dx, x, y, last_dir, barrier, conn):
+	"""
+	Main loop of a worker process
+
+	The worker creates a simulation for its tile whose fluid arrays live in shared memory, and
+	then executes commands received through the pipe: ``max_speed`` returns the largest signal
+	speed in the tile, ``timestep`` advances the tile by a given timestep and returns the CFL 
+	timestep of the new state of the tile, and ``stop`` ends the loop. Each command is answered with a tuple of a status (``ok`` or ``error``) and a result.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	i_tile: int
+		Index of the tile owned by this worker
+	tiles: array_like
+		List of all tile dictionaries
+	hs: HydroScheme
+		Hydro scheme
+	bc_type: str
+		Type of boundary conditions of the global domain
+	gamma: float
+		Adiabatic index
+	dx: float
+		Cell size
+	x: array_like
+		Cell centers in x of the global domain including ghost cells
+	y: array_like
+		Cell centers in y of the global domain including ghost cells
+	last_dir: int
+		Direction of the last sweep
+	barrier: Barrier
+		Barrier shared by all workers
+	conn: Connection
+		Pipe to the parent process
+	"""
+
+	# Attach to the shared memory of all tiles. The workers share the resource tracker of the
+	# parent, which owns the memory and releases it in shutdown().
+	shm_list = []
+	tile_arrays = []
+	for tile in tiles:
+		arrays = {}
+		for name in ['V', 'U']:
+			shm = multiprocessing.shared_memory.SharedMemory(name = tile['shm_%s' % name])
+			arrays[name] = np.ndarray(tile['shape'], dtype = hs.precision, buffer = shm.buf)
+			shm_list.append(shm)
+		tile_arrays.append(arrays)
+
+	# Create the simulation for this tile. We overwrite the grid variables with those of the global
+	# domain to make sure they are identical bit by bit.
+	tile = tiles[i_tile]
+	ng = (tile['shape'][1] - (tile['x1'] - tile['x0'])) // 2
+	sim = TileSimulation(hs)
+	with contextlib.redirect_stdout(io.StringIO()):
+		sim.setDomain(tile['x1'] - tile['x0'], tile['y1'] - tile['y0'], xmin = x[tile['x0'] + ng] - 0.5 * dx,
+					xmax = x[tile['x1'] + ng - 1] + 0.5 * dx, ymin = y[tile['y0'] + ng] - 0.5 * dx,
+					bc_type = bc_type)
+	sim.setFluidProperties(gamma)
+	sim.dx = dx
+	sim.x = x[tile['x0']:tile['x1'] + 2 * ng]
+	sim.y = y[tile['y0']:tile['y1'] + 2 * ng]
+	sim.last_dir = last_dir
+	sim.V = tile_arrays[i_tile]['V']
+	sim.U = tile_arrays[i_tile]['U']
+	if hs.reconstruction == 'const':
+		sim.V_im12 = sim.V
+		sim.V_ip12 = sim.V
+		if sim.V_jm12 is not None:
+			sim.V_jm12 = sim.V
+			sim.V_jp12 = sim.V
+	sim.tile_arrays = tile_arrays
+	sim.halo = tile['halo']
+	sim.barrier = barrier
+
+	while True:
+		cmd, arg = conn.recv()
+		if cmd == 'stop':
+			break
+		try:
+			if cmd == 'max_speed':
+				res = sim.maxSpeedInDomain()
+			elif cmd == 'timestep':
+				sim.timestep(dt = arg)
+				res = sim.dt_cfl
+			else:
+				raise Exception('Unknown command, %s.' % (cmd))
+			conn.send(('ok', res))
+		except threading.BrokenBarrierError:
+			conn.send(('error', 'Halo exchange aborted because another worker failed.'))
+		except Exception as e:
+			# Release the other workers if they are waiting for this one at a barrier
+			barrier.abort()
+			conn.send(('error', str(e)))
+
+	sim.tile_arrays = None
+	sim.V = None
+	sim.U = None
+	sim.V_im12 = None
+	sim.V_ip12 = None
+	sim.V_jm12 = None
+	sim.V_jp12 = None
+	tile_arrays = None
+	for shm in shm_list:
+		shm.close()
+
+	return
+
+###################################################################################################
@@ -0,0 +1,264 @@
+###################################################################################################
+#
+# Ulula -- ensemble.py
+#
+# Ensembles of simulations that are advanced together
+#
+# by Benedikt Diemer
+#
+###################################################################################################
+
+import numpy as np
+import io
+import contextlib
+
+import ulula.simulation as ulula_sim
+
+###################################################################################################
+
+class EnsembleSimulation(ulula_sim.Simulation):
+	"""
+	Several similar simulations that are advanced together
+
+	On small grids, the time per step of a simulation is dominated by the overhead of the many
+	vectorized operations in a sweep, each of which costs a few microseconds regardless of the
+	number of cells. An ensemble of simulations that differ only in their initial conditions (e.g.,
+	the density contrast or the number of waves in a Kelvin-Helmholtz setup) can share this
+	overhead. The members are stacked along the x-dimension, each including its ghost cells, and
+	the ensemble is advanced as a single simulation. The physical domain of the ensemble thus
+	includes the ghost cells between the members. The sweeps update those cells as well, but 
+	their conserved variables are reset to the boundary values of each member before they are 
+	converted to primitive variables (see :func:`conservedToPrimitiveDomain`). Each physical cell
+	of a member is updated with exactly the same operations as in a separate simulation.
+
+	All members take the same timestep, namely the smallest of their CFL timesteps. The hydro 
+	scheme, including the CFL number, as well as the domain, boundary conditions, and fluid 
+	properties must be the same for all members. Ensembles are meant for small grids and support
+	only the numpy backend without tiling.
+
+	The fluid variables of the members can be accessed as ``U_members`` and ``V_members``, which
+	are views with dimensions [n_members, nq, nx + 2 ng, ny + 2 ng] into the arrays of the
+	ensemble. The simulation objects passed to the constructor are not copied; instead, their
+	fluid arrays are replaced by views of their part of the ensemble, and their time and step
+	are updated with each timestep. Thus, they can be plotted and saved like any other simulation
+	(e.g., with :func:`~ulula.plots.plot2d` and :func:`~ulula.simulation.Simulation.save`), but
+	they cannot be advanced on their own; their ``timestep`` and ``cflCondition`` functions 
+	raise an exception.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	sims: array_like
+		List of simulation objects with initial conditions; all must be at the same time and step
+	"""
+
+	def __init__(self, sims):
+
+		if len(sims) == 0:
+			raise Exception('An ensemble needs at least one member.')
+		sim0 = sims[0]
+		for sim in sims:
+			if type(sim) is not ulula_sim.Simulation:
+				raise Exception('Ensemble members must be plain simulations, found %s.' % (type(sim).__name__))
+			if vars(sim.hs) != vars(sim0.hs):
+				raise Exception('All ensemble members must have the same hydro scheme.')
+			for attr in ['nx', 'ny', 'xmin', 'xmax', 'ymin', 'bc_type', 'gamma', 't', 'step', 'last_dir']:
+				if getattr(sim, attr) != getattr(sim0, attr):
+					raise Exception('All ensemble members must have the same %s (found %s and %s).' \
+								% (attr, str(getattr(sim0, attr)), str(getattr(sim, attr))))
+
+		if (sim0.hs.backend != 'numpy') or (sim0.hs.tile_size is not None):
+			raise Exception('Ensembles support only the numpy backend without tiling.')
+
+		ulula_sim.Simulation.__init__(self, sim0.hs)
+
+		# The stacked domain contains the ghost cells of all members except the outer ones. We
+		# overwrite the cell size and positions with those of the members to make sure they are
+		# identical bit by bit.
+		self.n_members = len(sims)
+		ng = self.nghost
+		nx_tot = sim0.nx + 2 * ng
+		nx_ens = self.n_members * nx_tot - 2 * ng
+		with contextlib.redirect_stdout(io.StringIO()):
+			self.setDomain(nx_ens, sim0.ny, xmin = sim0.xmin, xmax = sim0.xmin + nx_ens * sim0.dx,
+						ymin = sim0.ymin, bc_type = sim0.bc_type)
+		self.setFluidProperties(sim0.gamma)
+		self.dx = sim0.dx
+		self.x = np.tile(sim0.x, self.n_members)
+		self.y = sim0.y
+		self.t = sim0.t
+		self.step = sim0.step
+		self.last_dir = sim0.last_dir
+
+		self.members = list(sims)
+		self.bindMembers(copy_state = True)
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def __setstate__(self, state):
+
+		ulula_sim.Simulation.__setstate__(self, state)
+		self.bindMembers()
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def bindMembers(self, copy_state = False):
+		"""
+		Replace the fluid arrays of the members by views into the ensemble arrays
+
+		This function creates the ``U_members`` and ``V_members`` views and points the members
+		to them. The members' own scratch memory is released, and they are marked as members so
+		that they cannot be advanced on their own. It is called by the constructor and whenever an
+		ensemble is copied.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		copy_state: bool
+			If ``True``, the current fluid state of the members is first copied into the ensemble.
+		"""
+
+		shape = (self.nq, self.n_members, self.U.shape[1] // self.n_members, self.U.shape[2])
+		self.U_members = self.U.reshape(shape).transpose(1, 0, 2, 3)
+		self.V_members = self.V.reshape(shape).transpose(1, 0, 2, 3)
+
+		for i in range(self.n_members):
+			sim = self.members[i]
+			if copy_state:
+				self.U_members[i] = sim.U
+				self.V_members[i] = sim.V
+			sim.U = self.U_members[i]
+			sim.V = self.V_members[i]
+			if self.hs.reconstruction == 'const':
+				sim.V_im12 = sim.V
+				sim.V_ip12 = sim.V
+			else:
+				sim.V_im12 = None
+				sim.V_ip12 = None
+			sim.V_jm12 = None
+			sim.V_jp12 = None
+			sim.U_rk = None
+			sim.ws = None
+			sim.ws_strips = []
+			sim.in_ensemble = True
+		self.syncMembers()
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def syncMembers(self):
+		"""
+		Set the time, step, and stale ghost regions of the members to those of the ensemble
+		"""
+
+		for sim in self.members:
+			sim.t = self.t
+			sim.step = self.step
+			sim.last_dir = self.last_dir
+			sim.bc_stale = set(self.bc_stale)
+			sim.dt_cfl = None
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def enforceBoundaryConditionsArray(self, v, regions = ['x', 'y', 'corners']):
+		"""
+		Fill the ghost cells of each member
+
+		The members are filled independently, each according to the boundary conditions of a
+		separate simulation, which means that the ghost cells between members do not see the
+		neighboring members. See
+		:func:`~ulula.simulation.Simulation.enforceBoundaryConditionsArray` for the parameters.
+		"""
+
+		# The array is contiguous, so that the member dimension can be merged into the variable
+		# dimension without copying
+		nv = v.shape[0]
+		v_members = v.reshape(nv * self.n_members, v.shape[1] // self.n_members, v.shape[2])
+		self.members[0].enforceBoundaryConditionsArray(v_members, regions = regions)
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def conservedToPrimitiveDomain(self, max_speed = False):
+		"""
+		Convert the conserved to the primitive variables in all members
+
+		The sweeps update the ghost cells between the members as if they were physical cells, 
+		using the ghost cells of the neighboring members. The resulting states are meaningless and
+		could even be invalid. Before the conversion, the conserved variables in those cells are 
+		thus reset to the boundary values of the members, which means that they hold valid states 
+		and do not affect the largest signal speed. See 
+		:func:`~ulula.simulation.Simulation.conservedToPrimitiveDomain` for the parameters.
+		"""
+
+		self.enforceBoundaryConditionsArray(self.U, regions = ['x'])
+		c_max = ulula_sim.Simulation.conservedToPrimitiveDomain(self, max_speed = max_speed)
+
+		return c_max
+
+	# ---------------------------------------------------------------------------------------------
+
+	def timestep(self, dt = None):
+		"""
+		Advance all members by one timestep
+
+		See :func:`~ulula.simulation.Simulation.timestep`. The ensemble is advanced like a single
+		simulation, and the time and step of the members are updated afterwards.
+		"""
+
+		dt = ulula_sim.Simulation.timestep(self, dt = dt)
+		self.syncMembers()
+
+		return dt
+
+	# ---------------------------------------------------------------------------------------------
+
+	def save(self, filename = None, writer = None, fmt = None):
+		"""
+		Save the state of each member
+
+		Each member is written to a separate file, whose name is the given filename (or the
+		default filename of :func:`~ulula.simulation.Simulation.save`) with the index of the
+		member inserted before the extension.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		filename: str
+			Output filename; auto-generated if ``None``
+		writer: SnapshotWriter
+			Background writer (see :func:`~ulula.simulation.Simulation.save`)
+		fmt: object
+			Snapshot format (see :func:`~ulula.simulation.Simulation.save`)
+		"""
+
+		if filename is None:
+			filename = 'ulula_%04d%s' % (self.step, '.hdf5' if fmt is None else fmt.extension)
+		if '.' in filename:
+			base, ext = filename.rsplit('.', 1)
+			ext = '.' + ext
+		else:
+			base = filename
+			ext = ''
+		for i in range(self.n_members):
+			self.members[i].save(filename = '%s_m%03d%s' % (base, i, ext), writer = writer, fmt = fmt)
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def saveCheckpoint(self, filename = None, run_state = None):
+		"""
+		Checkpoints are not supported
+
+		A checkpoint of the ensemble would be loaded as a single simulation of the stacked domain.
+		"""
+
+		raise Exception('Checkpoints are not supported for ensembles.')
+
+###################################################################################################
@@ -1 +1 @@
-__all__ = ['examples']
+__all__ = ['examples', 'benchmarks']
@@ -0,0 +1,1575 @@
+###################################################################################################
+#
+# Ulula -- benchmarks.py
+#
+# Performance benchmarks for the Ulula code
+#
+# by Benedikt Diemer
+#
+###################################################################################################
+
+import os
+import gc
+import time
+import copy
+import io
+import tempfile
+import contextlib
+import tracemalloc
+import numpy as np
+import h5py
+
+import ulula.simulation as ulula_sim
+import ulula.amr as ulula_amr
+import ulula.ensemble as ulula_ensemble
+import ulula.sweep as ulula_sweep
+import ulula.run as ulula_run
+import ulula.output as ulula_output
+import ulula.setups.advection as setup_advect
+import ulula.setups.kelvin_helmholtz as setup_kh
+import ulula.setups.shocktube as setup_shocktube
+import ulula.setups.sedov_taylor as setup_sedov
+
+###################################################################################################
+
+def main():
+
+	#threadScalingBenchmark()
+	#precisionBenchmark()
+	#tilingBenchmark()
+	#boundaryConditionBenchmark()
+	#cflBenchmark()
+	#checksBenchmark()
+	#allocationBenchmark()
+	#kernelBenchmark()
+	#amrBenchmark()
+	#nestedGridBenchmark()
+	#riemannBenchmark()
+	#reconstructionBenchmark()
+	#timeIntegrationBenchmark()
+	#unsplitBenchmark()
+	#ensembleBenchmark()
+	#sweepBenchmark()
+	#asyncOutputBenchmark()
+	#seriesBenchmark()
+	#snapshotViewBenchmark()
+	#formatBenchmark()
+	#checkpointBenchmark()
+
+	return
+
+###################################################################################################
+
+def timeSteps(sim, n_steps):
+	"""
+	Measure the wall-clock time per timestep
+
+	One timestep is taken before the measurement starts so that one-time costs (such as the
+	compilation of numba kernels or the creation of threads) are not counted. We measure wall time
+	rather than CPU time because the latter adds up the time spent in all threads.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	sim: Simulation
+		Simulation object with initial conditions
+	n_steps: int
+		Number of timesteps to average over
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	t_step: float
+		Wall-clock time per timestep in seconds
+	"""
+
+	sim.timestep()
+	t0 = time.perf_counter()
+	for i in range(n_steps):
+		sim.timestep()
+	t_step = (time.perf_counter() - t0) / n_steps
+
+	return t_step
+
+###################################################################################################
+
+def threadScalingBenchmark(nx_list = [256, 512, 1024, 2048], n_threads_list = [1, 2, 4, 8, 16, 32],
+						backend = 'numba', n_steps = 10):
+	"""
+	Strong scaling of the multi-threaded sweeps
+
+	This function runs the Kelvin-Helmholtz setup at several resolutions and with different
+	numbers of threads, and prints the time per step and the speedup with respect to the first
+	entry in ``n_threads_list``. Thread counts beyond the number of available cores will not
+	yield any further speedup.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	n_threads_list: array_like
+		Numbers of threads to test
+	backend: str
+		Backend of the hydro scheme (the numpy backend parallelizes only the conversions and
+		boundary conditions)
+	n_steps: int
+		Number of timesteps to average over
+	"""
+
+	setup = setup_kh.SetupKelvinHelmholtz()
+
+	print('%6s  %9s  %10s  %8s  %10s' % ('nx', 'n_threads', 's/step', 'speedup', 'efficiency'))
+	for nx in nx_list:
+		t_ref = None
+		for n_threads in n_threads_list:
+			hs = ulula_sim.HydroScheme(reconstruction = 'linear', limiter = 'mc',
+							time_integration = 'hancock', cfl = 0.8, backend = backend,
+							n_threads = n_threads)
+			sim = ulula_sim.Simulation(hs)
+			setup.initialConditions(sim, nx)
+			t_step = timeSteps(sim, n_steps)
+			if t_ref is None:
+				t_ref = t_step
+			speedup = t_ref / t_step
+			efficiency = speedup * n_threads_list[0] / n_threads
+			print('%6d  %9d  %10.4f  %8.2f  %10.2f' % (nx, n_threads, t_step, speedup, efficiency))
+
+	return
+
+def runToTime(sim, tmax):
+	"""
+	Run a simulation to a given time and measure the wall-clock time per timestep
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	sim: Simulation
+		Simulation object with initial conditions
+	tmax: float
+		Time to which the simulation is run (the last timestep is shortened to hit it exactly)
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	t_step: float
+		Wall-clock time per timestep in seconds
+	"""
+
+	t0 = time.perf_counter()
+	n_steps = 0
+	while sim.t < tmax:
+		dt = min(sim.cflCondition(), tmax - sim.t)
+		sim.timestep(dt = dt)
+		n_steps += 1
+	t_step = (time.perf_counter() - t0) / n_steps
+
+	return t_step
+
+###################################################################################################
+
+def precisionBenchmark(nx_list = [64, 128, 256], nx_timing = 1024, backend = 'numpy', n_steps = 10,
+					tmax_sod = 0.2, tmax_sedov = 0.02):
+	"""
+	Accuracy and speed of single versus double precision
+
+	For the Sod shocktube (along x), we compute the mean absolute error of density, velocity, 
+	and pressure with respect to the analytical solution. For the Sedov-Taylor explosion, we 
+	compare the density in each cell to the analytical radial profile at the cell's radius. The
+	errors are printed for both precisions along with their relative difference; the latter 
+	should be much smaller than the truncation error of the scheme, which is what the 
+	comparison to the true solutions measures. Finally, we print the time per step of the 
+	Kelvin-Helmholtz setup at resolution ``nx_timing``, where the cost is dominated by memory 
+	traffic.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions at which the errors are computed
+	nx_timing: int
+		Resolution of the timing test
+	backend: str
+		Backend of the hydro scheme
+	n_steps: int
+		Number of timesteps to average over in the timing test
+	tmax_sod: float
+		Time at which the shocktube is compared to the true solution
+	tmax_sedov: float
+		Time at which the blastwave is compared to the true solution
+	"""
+
+	precisions = ['float64', 'float32']
+
+	def hydroScheme(precision):
+		return ulula_sim.HydroScheme(reconstruction = 'linear', limiter = 'mc', 
+						time_integration = 'hancock', cfl = 0.8, backend = backend, 
+						precision = precision)
+
+	print('%-6s  %6s  %-8s  %10s  %10s  %10s  %10s' \
+		% ('Setup', 'nx', 'Prec.', 'L1(DN)', 'L1(VX)', 'L1(PR)', 's/step'))
+	for nx in nx_list:
+		errs = {}
+		for precision in precisions:
+
+			# Shocktube: 1D cut through the center of the domain
+			setup = setup_shocktube.SetupSodX()
+			sim = ulula_sim.Simulation(hydroScheme(precision))
+			setup.initialConditions(sim, nx)
+			t_step = runToTime(sim, tmax_sod)
+			slc = (slice(sim.xlo, sim.xhi + 1), sim.ylo + sim.ny // 2)
+			q_plot = ['DN', 'VX', 'PR']
+			V_true = setup.trueSolution(sim, sim.x[slc[0]], q_plot)
+			V_sim = np.array([sim.V[(sim.q_prim[q],) + slc] for q in q_plot], np.float64)
+			errs[('sod', precision)] = np.mean(np.abs(V_sim - V_true), axis = 1)
+			print('%-6s  %6d  %-8s  %10.3e  %10.3e  %10.3e  %10.2e' % (('sod', nx, precision) \
+				+ tuple(errs[('sod', precision)]) + (t_step,)))
+
+			# Sedov: density in each cell versus the true profile at the same radius
+			setup = setup_sedov.SetupSedov()
+			sim = ulula_sim.Simulation(hydroScheme(precision))
+			setup.initialConditions(sim, nx)
+			t_step = runToTime(sim, tmax_sedov)
+			x, y = sim.xyGrid()
+			slc = (slice(sim.xlo, sim.xhi + 1), slice(sim.ylo, sim.yhi + 1))
+			r = np.sqrt((x[slc] - 0.5)**2 + (y[slc] - 0.5)**2).flatten()
+			V_true = setup.trueSolution(sim, r, ['DN'])[0]
+			V_sim = sim.V[(sim.q_prim['DN'],) + slc].flatten().astype(np.float64)
+			errs[('sedov', precision)] = np.array([np.mean(np.abs(V_sim - V_true))])
+			print('%-6s  %6d  %-8s  %10.3e  %10s  %10s  %10.2e' \
+				% ('sedov', nx, precision, errs[('sedov', precision)][0], '', '', t_step))
+		
+		for s in ['sod', 'sedov']:
+			diff = np.abs(errs[(s, 'float32')] / errs[(s, 'float64')] - 1.0)
+			print('%-6s  %6d  %-8s  %s' % (s, nx, 'rel.diff', '  '.join(['%10.1e' % d for d in diff])))
+
+	print()
+	print('%-8s  %6s  %10s  %8s' % ('Prec.', 'nx', 's/step', 'speedup'))
+	setup = setup_kh.SetupKelvinHelmholtz()
+	t_ref = None
+	for precision in precisions:
+		sim = ulula_sim.Simulation(hydroScheme(precision))
+		setup.initialConditions(sim, nx_timing)
+		t_step = timeSteps(sim, n_steps)
+		if t_ref is None:
+			t_ref = t_step
+		print('%-8s  %6d  %10.4f  %8.2f' % (precision, nx_timing, t_step, t_ref / t_step))
+
+	return
+
+def tilingBenchmark(nx_list = [128, 256, 512, 1024, 2048], tile_sizes = [None, 'auto', 4096, 65536],
+					n_steps = 3):
+	"""
+	Throughput of the numpy backend with and without cache blocking
+	
+	This function runs the Kelvin-Helmholtz setup at several resolutions and prints the number of 
+	cells updated per second for each tile size. Without tiling, the throughput drops once the 
+	domain no longer fits into the cache; with tiling, it should be roughly independent of the 
+	grid size.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	tile_sizes: array_like
+		Tile sizes to test (see the ``tile_size`` parameter of the hydro scheme)
+	n_steps: int
+		Number of timesteps to average over
+	"""
+
+	setup = setup_kh.SetupKelvinHelmholtz()
+
+	print('%6s' % ('nx') + ''.join(['  %10s' % (str(ts)) for ts in tile_sizes]) + '   (Mcells/s)')
+	for nx in nx_list:
+		line = '%6d' % (nx)
+		for tile_size in tile_sizes:
+			hs = ulula_sim.HydroScheme(reconstruction = 'linear', limiter = 'mc', 
+							time_integration = 'hancock', cfl = 0.8, tile_size = tile_size)
+			sim = ulula_sim.Simulation(hs)
+			setup.initialConditions(sim, nx)
+			t_step = timeSteps(sim, n_steps)
+			line += '  %10.2f' % (sim.nx * sim.ny / t_step * 1E-6)
+		print(line)
+
+	return
+
+def boundaryConditionBenchmark(nx_list = [64, 256, 1024], n_rep = 20):
+	"""
+	Memory traffic and time spent on boundary conditions and primitive conversion
+	
+	Per timestep, the ghost cells are filled before each of the two sweeps, and the primitive 
+	variables are recomputed after each sweep. We compare the old scheme, where all ghost cells of 
+	both the primitive and conserved variables were filled before each sweep and the whole array
+	(including ghost cells) was converted, to the current scheme, where only the ghost cells of the 
+	primitive variables along the sweep direction are filled and the ghost cells along x are not
+	converted (see :func:`~ulula.simulation.Simulation.conservedToPrimitiveDomain`). For both, we print the number of bytes read and written per step according to a 
+	simple model (each ghost cell is read from the domain and written once; each converted cell 
+	reads the conserved and writes the primitive variables) as well as the measured time.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	n_rep: int
+		Number of repetitions over which the timing is averaged
+	"""
+
+	def timeCall(func, *args):
+		t0 = time.perf_counter()
+		for i in range(n_rep):
+			func(*args)
+		return (time.perf_counter() - t0) / n_rep
+
+	setup = setup_kh.SetupKelvinHelmholtz()
+
+	print('%6s  %-4s  %10s  %10s  %10s  %10s  %10s' \
+		% ('nx', '', 'MB(BC)', 'MB(C2P)', 's(BC)', 's(C2P)', 's(total)'))
+	for nx in nx_list:
+		hs = ulula_sim.HydroScheme(reconstruction = 'linear', limiter = 'mc', 
+								time_integration = 'hancock', cfl = 0.8)
+		sim = ulula_sim.Simulation(hs)
+		setup.initialConditions(sim, nx)
+		sim.timestep()
+		
+		ng = sim.nghost
+		n_phys = sim.nx * sim.ny
+		n_all = (sim.nx + 2 * ng) * (sim.ny + 2 * ng)
+		b_cell = sim.nq * np.dtype(sim.dtype).itemsize
+		
+		# Old: all ghosts of V and U before each sweep, conversion of the entire array after 
+		# each sweep
+		mb_bc_old = 2 * 2 * (n_all - n_phys) * 2 * b_cell * 1E-6
+		mb_c2p_old = 2 * n_all * 2 * b_cell * 1E-6
+		t_bc_old = 2 * timeCall(sim.enforceBoundaryConditions)
+		t_c2p_old = 2 * timeCall(sim.conservedToPrimitive, sim.U, sim.V)
+
+		# New: only the x-ghosts of V before the x-sweep and the y-ghosts before the y-sweep, 
+		# conversion of the physical range in x
+		mb_bc_new = 2 * ng * (sim.nx + sim.ny) * 2 * b_cell * 1E-6
+		mb_c2p_new = 2 * sim.nx * (sim.ny + 2 * ng) * 2 * b_cell * 1E-6
+		def bcDirectional():
+			for idir in [0, 1]:
+				sim.bc_stale.add(['x', 'y'][idir])
+				sim.enforceBoundaryConditions(idir)
+		t_bc_new = timeCall(bcDirectional)
+		t_c2p_new = 2 * timeCall(sim.conservedToPrimitiveDomain)
+		
+		print('%6d  %-4s  %10.3f  %10.3f  %10.2e  %10.2e  %10.2e' \
+			% (nx, 'old', mb_bc_old, mb_c2p_old, t_bc_old, t_c2p_old, t_bc_old + t_c2p_old))
+		print('%6d  %-4s  %10.3f  %10.3f  %10.2e  %10.2e  %10.2e' \
+			% (nx, 'new', mb_bc_new, mb_c2p_new, t_bc_new, t_c2p_new, t_bc_new + t_c2p_new))
+
+	return
+
+def cflBenchmark(nx_list = [64, 256, 1024], backends = ['numpy', 'numba'], n_steps = 20):
+	"""
+	Timestep sequence and cost of the CFL condition with and without the stored timestep
+	
+	During a timestep, the largest signal speed of the new fluid state is computed along with the 
+	final conversion to primitive variables, and :func:`~ulula.simulation.Simulation.cflCondition` 
+	returns the resulting timestep without another pass over the domain. This function runs the 
+	Sedov-Taylor setup twice, once as usual and once with the stored timestep discarded before 
+	each step so that the speed is computed separately. The sequences of timesteps must be 
+	identical; we print the time per step for both runs.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	backends: array_like
+		Backends to test
+	n_steps: int
+		Number of timesteps to take
+	"""
+
+	setup = setup_sedov.SetupSedov()
+
+	print('%6s  %-7s  %13s  %13s  %8s' % ('nx', 'Backend', 's/step(sep.)', 's/step(fused)', 'speedup'))
+	for nx in nx_list:
+		for backend in backends:
+			t_step = {}
+			dt_list = {}
+			for fused in [False, True]:
+				hs = ulula_sim.HydroScheme(reconstruction = 'linear', limiter = 'mc', 
+									time_integration = 'hancock', cfl = 0.8, backend = backend)
+				sim = ulula_sim.Simulation(hs)
+				setup.initialConditions(sim, nx)
+				sim.timestep()
+				dt_list[fused] = []
+				t0 = time.perf_counter()
+				for i in range(n_steps):
+					if not fused:
+						sim.dt_cfl = None
+					dt = sim.cflCondition()
+					sim.timestep(dt = dt)
+					dt_list[fused].append(dt)
+				t_step[fused] = (time.perf_counter() - t0) / n_steps
+			if dt_list[False] != dt_list[True]:
+				raise Exception('Timestep sequences differ.')
+			print('%6d  %-7s  %13.2e  %13.2e  %8.2f' % (nx, backend, t_step[False], t_step[True], 
+												t_step[False] / t_step[True]))
+
+	return
+
+def checksBenchmark(nx_list = [128, 512, 1024], checks_list = ['always', 'every_n_steps', 'off'],
+					time_integration = 'hancock_cons', n_steps = 5):
+	"""
+	Cost of the validity checks of the fluid state
+	
+	This function runs the Kelvin-Helmholtz setup with the numpy backend and each setting of the
+	``checks`` parameter of the hydro scheme, and prints the time per step. The conservative 
+	Hancock scheme converts the cell-edge states and thus performs the largest number of checks.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	checks_list: array_like
+		Check settings to test
+	time_integration: str
+		Time integration scheme
+	n_steps: int
+		Number of timesteps to average over
+	"""
+
+	setup = setup_kh.SetupKelvinHelmholtz()
+
+	print('%6s' % ('nx') + ''.join(['  %14s' % (c) for c in checks_list]) + '   (s/step)')
+	for nx in nx_list:
+		line = '%6d' % (nx)
+		for checks in checks_list:
+			hs = ulula_sim.HydroScheme(reconstruction = 'linear', limiter = 'mc', 
+								time_integration = time_integration, cfl = 0.8, checks = checks)
+			sim = ulula_sim.Simulation(hs)
+			setup.initialConditions(sim, nx)
+			t_step = timeSteps(sim, n_steps)
+			line += '  %14.4e' % (t_step)
+		print(line)
+
+	return
+
+def allocationBenchmark(nx_list = [512], reconstruction_list = ['const', 'linear', 'ppm', 'weno5'],
+					time_integration_list = ['euler', 'hancock', 'hancock_cons', 'rk2', 'rk3'],
+					riemann_list = ['hll', 'hllc'], n_warmup = 3, max_fraction = 0.1):
+	"""
+	Memory allocated during a steady-state timestep
+
+	All kernels of the numpy backend write into the preallocated workspace of the simulation,
+	which is filled during the first timesteps. This function runs the Kelvin-Helmholtz setup with
+	each combination of reconstruction, time integration, and Riemann solver, takes ``n_warmup``
+	timesteps, and traces the memory allocated during one more timestep with the ``tracemalloc``
+	module. An exception is raised if the peak exceeds ``max_fraction`` times the size of one
+	field (i.e., of one primitive variable including the ghost cells). The remaining peak is about
+	0.13 MB regardless of the resolution and scheme; it consists of the internal buffers of numpy
+	(see ``np.setbufsize``), which is why the check is not meaningful on small grids. The exact
+	Riemann solver is not tested by default because it works on temporary arrays (see
+	:func:`~ulula.simulation.Simulation.riemannSolverExact`).
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	reconstruction_list: array_like
+		Reconstruction schemes to test
+	time_integration_list: array_like
+		Time integration schemes to test
+	riemann_list: array_like
+		Riemann solvers to test
+	n_warmup: int
+		Number of timesteps before the traced timestep
+	max_fraction: float
+		Largest allowed peak allocation in units of the size of one field
+	"""
+
+	setup = setup_kh.SetupKelvinHelmholtz()
+
+	print('%6s  %-7s  %-13s  %-6s  %10s  %10s  %8s' % ('nx', 'Recon.', 'Time int.', 'Riem.',
+		'Peak (MB)', 'Field (MB)', 'Fraction'))
+	for nx in nx_list:
+		for reconstruction in reconstruction_list:
+			for time_integration in time_integration_list:
+				for riemann in riemann_list:
+					hs = ulula_sim.HydroScheme(reconstruction = reconstruction, limiter = 'mc',
+								time_integration = time_integration, riemann = riemann, cfl = 0.8)
+					sim = ulula_sim.Simulation(hs)
+					with contextlib.redirect_stdout(io.StringIO()):
+						setup.initialConditions(sim, nx)
+					for i in range(n_warmup):
+						sim.timestep()
+
+					tracemalloc.start()
+					sim.timestep()
+					mem_peak = tracemalloc.get_traced_memory()[1]
+					tracemalloc.stop()
+
+					mem_field = sim.V[0].nbytes
+					print('%6d  %-7s  %-13s  %-6s  %10.3f  %10.3f  %8.3f' % (nx, reconstruction,
+						time_integration, riemann, mem_peak / 1E6, mem_field / 1E6, mem_peak / mem_field))
+					if mem_peak > max_fraction * mem_field:
+						raise Exception('Timestep with %s, %s, %s allocated %.3f MB, more than %.2f of a field (nx %d).' \
+							% (reconstruction, time_integration, riemann, mem_peak / 1E6, max_fraction, nx))
+
+	return
+
+def kernelBenchmark(nx_list = [64, 256, 1024], precisions = ['float64', 'float32'], n_rep = 10, 
+					seed = 1):
+	"""
+	Throughput of the individual kernels of the numpy backend
+	
+	This function times the slope limiters and the Riemann solvers on arrays of the size of a 
+	domain with ``nx`` by ``nx`` cells and prints the number of cells processed per second. The 
+	slopes are random numbers with random signs, which is the worst case for any code that 
+	branches on their signs. The Riemann solver is fed with the Kelvin-Helmholtz initial 
+	conditions, shifted by one cell.
+	
+	The minmod, van Leer, and MC limiters used to be written with boolean masks and conditional 
+	copies. Those versions are kept here as a reference, and the limited slopes must be identical
+	to theirs bit by bit, including the signs of zeros; an exception is raised otherwise.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	precisions: array_like
+		Floating-point precisions to test
+	n_rep: int
+		Number of repetitions over which the timing is averaged
+	seed: int
+		Seed for the random slopes
+	"""
+
+	def timeCall(func, *args):
+		t0 = time.perf_counter()
+		for i in range(n_rep):
+			func(*args)
+		return (time.perf_counter() - t0) / n_rep
+
+	def maskedMasks(sL, sR):
+		mask_same = (sL * sR > 0.0)
+		mask_L = (np.abs(sL) <= np.abs(sR)) & mask_same
+		return mask_same, mask_L
+
+	def maskedMinMod(sL, sR, slim):
+		slim.fill(0.0)
+		mask_same, mask_L = maskedMasks(sL, sR)
+		np.copyto(slim, sL, where = mask_L)
+		np.logical_xor(mask_same, mask_L, out = mask_same)
+		np.copyto(slim, sR, where = mask_same)
+		return
+
+	def maskedVanLeer(sL, sR, slim):
+		slim.fill(0.0)
+		mask = (sL * sR > 0.0)
+		prod = sL * 2.0
+		prod *= sR
+		np.divide(prod, sL + sR, out = slim, where = mask)
+		return
+
+	def maskedMC(sL, sR, slim):
+		slim.fill(0.0)
+		mask_same, mask_L = maskedMasks(sL, sR)
+		np.multiply(sL, 2.0, out = slim, where = mask_L)
+		np.logical_xor(mask_same, mask_L, out = mask_same)
+		np.multiply(sR, 2.0, out = slim, where = mask_same)
+		sC = sL + sR
+		sC *= 0.5
+		np.copyto(slim, sC, where = (np.abs(slim) > np.abs(sC)))
+		return
+
+	reference = {}
+	reference['limiterMinMod'] = maskedMinMod
+	reference['limiterVanLeer'] = maskedVanLeer
+	reference['limiterMC'] = maskedMC
+
+	setup = setup_kh.SetupKelvinHelmholtz()
+	rng = np.random.default_rng(seed)
+	kernels = ['limiterNone', 'limiterMinMod', 'limiterVanLeer', 'limiterMC', 'riemannSolverHLL', 
+			'riemannSolverHLLC']
+
+	print('%6s  %-9s' % ('nx', 'Precision') + ''.join(['  %16s' % (k) for k in kernels]) + '   (Mcells/s)')
+	for nx in nx_list:
+		for precision in precisions:
+			hs = ulula_sim.HydroScheme(reconstruction = 'linear', precision = precision)
+			sim = ulula_sim.Simulation(hs)
+			setup.initialConditions(sim, nx)
+			
+			shape = (sim.nq, sim.nx + 2, sim.ny)
+			sL = rng.normal(size = shape).astype(sim.dtype)
+			sR = rng.normal(size = shape).astype(sim.dtype)
+			slim = sim.ws.get('slim', shape)
+			slim_ref = np.empty_like(slim)
+			VL = sim.V[:, :-1, :]
+			VR = sim.V[:, 1:, :]
+			flux = sim.ws.get('flux', VL.shape)
+			
+			line = '%6d  %-9s' % (nx, precision)
+			for k in kernels:
+				if k.startswith('riemannSolver'):
+					t = timeCall(getattr(sim, k), 0, VL, VR, flux)
+					n_cells = VL[0].size
+				else:
+					t = timeCall(getattr(sim, k), sL, sR, slim)
+					n_cells = slim[0].size
+					if k in reference:
+						reference[k](sL, sR, slim_ref)
+						if (not np.array_equal(slim, slim_ref)) \
+							or (not np.array_equal(np.signbit(slim), np.signbit(slim_ref))):
+							raise Exception('Limiter %s differs from the masked version (nx %d, %s).' \
+										% (k, nx, precision))
+				line += '  %16.2f' % (n_cells / t * 1E-6)
+			print(line)
+
+	return
+
+def riemannBenchmark(nx_list = [64, 128, 256, 512, 1024], riemann_list = ['hll', 'hllc', 'exact'], 
+					reconstruction_list = ['const', 'linear'], backend = 'numpy', tmax = 0.2, 
+					target_err = 2E-3):
+	"""
+	Accuracy versus cost of the Riemann solvers
+	
+	This function runs the Sod shocktube with each Riemann solver and reconstruction scheme at 
+	each resolution and compares the density, velocity, and pressure along the center of the 
+	domain to the true solution. The L1 errors are printed along with the wall-clock time of the
+	entire run. The HLLC solver resolves the contact discontinuity more sharply, which lowers the
+	density error at a given resolution at a somewhat higher cost per cell; the gain is largest
+	for the more diffusive piecewise-constant reconstruction. Finally, we print the cheapest run 
+	for each combination whose density error is below ``target_err``.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	riemann_list: array_like
+		Riemann solvers to compare (the numba backend does not support the exact solver)
+	reconstruction_list: array_like
+		Reconstruction schemes to compare; the linear reconstruction uses the MC limiter and
+		Hancock time integration
+	backend: str
+		Backend of the hydro scheme
+	tmax: float
+		Time at which the shocktube is compared to the true solution
+	target_err: float
+		L1 error in density that the runs should reach
+	"""
+
+	setup = setup_shocktube.SetupSodX()
+	q_plot = ['DN', 'VX', 'PR']
+	
+	print('%-6s  %-6s  %6s  %10s  %10s  %10s  %10s  %8s' \
+		% ('Rec.', 'Solver', 'nx', 'L1(DN)', 'L1(VX)', 'L1(PR)', 'Time (s)', 'Steps'))
+	schemes = [(rec, riemann) for rec in reconstruction_list for riemann in riemann_list]
+	cheapest = {}
+	for rec, riemann in schemes:
+		for nx in nx_list:
+			if rec == 'linear':
+				ti = 'hancock'
+			else:
+				ti = 'euler'
+			hs = ulula_sim.HydroScheme(reconstruction = rec, limiter = 'mc', riemann = riemann,
+						time_integration = ti, cfl = 0.8, backend = backend)
+			sim = ulula_sim.Simulation(hs)
+			setup.initialConditions(sim, nx)
+			
+			# Compile the numba kernels outside of the timing
+			if backend == 'numba':
+				sim_tmp = copy.deepcopy(sim)
+				sim_tmp.timestep()
+			
+			t0 = time.perf_counter()
+			runToTime(sim, tmax)
+			t_run = time.perf_counter() - t0
+			
+			slc = (slice(sim.xlo, sim.xhi + 1), sim.ylo + sim.ny // 2)
+			V_true = setup.trueSolution(sim, sim.x[slc[0]], q_plot)
+			V_sim = np.array([sim.V[(sim.q_prim[q],) + slc] for q in q_plot], np.float64)
+			err = np.mean(np.abs(V_sim - V_true), axis = 1)
+			print('%-6s  %-6s  %6d  %10.3e  %10.3e  %10.3e  %10.3f  %8d' \
+				% ((rec, riemann, nx) + tuple(err) + (t_run, sim.step)))
+			
+			key = (rec, riemann)
+			if (err[0] <= target_err) and ((not key in cheapest) or (t_run < cheapest[key][1])):
+				cheapest[key] = (nx, t_run)
+
+	print()
+	print('Cheapest runs with L1(DN) <= %.1e:' % (target_err))
+	for key in schemes:
+		if key in cheapest:
+			print('%-6s  %-6s  nx = %6d, %.3f s' % (key + cheapest[key]))
+		else:
+			print('%-6s  %-6s  not reached' % key)
+
+	return
+
+def reconstructionBenchmark(nx_list = [32, 64, 128, 256], reconstruction_list = ['linear', 'ppm', 'weno5'],
+							tmax_advect = 1.0, tmax_kh = 0.5, nx_ref_kh = 512):
+	"""
+	Accuracy versus CPU time of the reconstruction schemes
+	
+	This function runs three setups with each reconstruction scheme at each resolution: the 
+	advection of a smooth sine wave and of a tophat (see :class:`~ulula.setups.advection.SetupAdvect`),
+	which are compared to the analytically advected density, and the Kelvin-Helmholtz 
+	instability, which is compared to a run with linear reconstruction at a resolution of 
+	``nx_ref_kh`` cells (averaged over the coarser cells). All runs use the MC limiter (which 
+	affects only the linear and PPM schemes) and Hancock time integration. We print the L1 error 
+	in density and the CPU time of each run. On the smooth wave, WENO reconstruction reaches a 
+	given error with far fewer cells, whereas PPM flattens the extrema of the wave; PPM keeps the 
+	edges of the tophat sharpest. Finally, we print the cheapest run of each scheme whose error is at most that of the linear 
+	scheme at the highest resolution.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	reconstruction_list: array_like
+		Reconstruction schemes to compare; the first scheme sets the target error
+	tmax_advect: float
+		Time at which the advection runs are compared
+	tmax_kh: float
+		Time at which the Kelvin-Helmholtz runs are compared
+	nx_ref_kh: int
+		Resolution of the Kelvin-Helmholtz reference run; must be a multiple of all resolutions
+	"""
+
+	setups = []
+	setups.append(('sine', setup_advect.SetupAdvect(profile = 'sine'), tmax_advect))
+	setups.append(('tophat', setup_advect.SetupAdvect(profile = 'tophat'), tmax_advect))
+	setups.append(('kh', setup_kh.SetupKelvinHelmholtz(), tmax_kh))
+	
+	def runSetup(setup, rec, nx, tmax):
+		hs = ulula_sim.HydroScheme(reconstruction = rec, limiter = 'mc', time_integration = 'hancock',
+								cfl = 0.8)
+		sim = ulula_sim.Simulation(hs)
+		setup.initialConditions(sim, nx)
+		t0 = time.process_time()
+		while sim.t < tmax:
+			dt = min(sim.cflCondition(), tmax - sim.t)
+			sim.timestep(dt = dt)
+		t_run = time.process_time() - t0
+		return sim, t_run
+	
+	sim_ref, _ = runSetup(setups[2][1], 'linear', nx_ref_kh, tmax_kh)
+	rho_ref = sim_ref.V[sim_ref.q_prim['DN']][sim_ref.slc3dom[1:]]
+
+	print('%-6s  %-6s  %6s  %10s  %10s  %8s' % ('Setup', 'Rec.', 'nx', 'L1(DN)', 'CPU (s)', 'Steps'))
+	res = {}
+	for name, setup, tmax in setups:
+		for rec in reconstruction_list:
+			for nx in nx_list:
+				sim, t_run = runSetup(setup, rec, nx, tmax)
+				rho = sim.V[sim.q_prim['DN']][sim.slc3dom[1:]]
+				if name == 'kh':
+					f = nx_ref_kh // nx
+					rho_true = rho_ref.reshape(nx, f, nx, f).mean(axis = (1, 3))
+				else:
+					rho_true = setup.trueDensity(sim, sim.t)[sim.slc3dom[1:]]
+				err = np.mean(np.abs(rho - rho_true))
+				res[(name, rec, nx)] = (err, t_run)
+				print('%-6s  %-6s  %6d  %10.3e  %10.3f  %8d' % (name, rec, nx, err, t_run, sim.step))
+
+	print()
+	print('Cheapest runs with L1(DN) <= L1(DN) of %s at nx = %d:' % (reconstruction_list[0], nx_list[-1]))
+	for name, _, _ in setups:
+		target_err = res[(name, reconstruction_list[0], nx_list[-1])][0]
+		for rec in reconstruction_list:
+			runs = [(res[(name, rec, nx)][1], nx) for nx in nx_list if res[(name, rec, nx)][0] <= target_err]
+			if len(runs) > 0:
+				t_run, nx = min(runs)
+				print('%-6s  %-6s  nx = %6d, %.3f s' % (name, rec, nx, t_run))
+			else:
+				print('%-6s  %-6s  not reached' % (name, rec))
+
+	return
+
+def timeIntegrationBenchmark(nx_list = [64, 128, 256], tmax_sod = 0.2, tmax_sedov = 0.02,
+							schemes = [('linear', 'hancock', False, 0.8), ('linear', 'rk2', False, 0.8), 
+									('linear', 'rk2', True, 0.4), ('weno5', 'hancock', False, 0.8), 
+									('weno5', 'rk3', False, 0.8), ('weno5', 'rk3', True, 0.4)]):
+	"""
+	Speed and accuracy of the Runge-Kutta integrators
+	
+	This function runs the Sod shocktube and the Sedov-Taylor explosion with each combination of
+	reconstruction and time integration scheme at each resolution. We print the L1 error in 
+	density with respect to the true solution (along the center of the shocktube and as a 
+	function of radius for the Sedov-Taylor setup), the number of timesteps, the timesteps per 
+	second, and the wall-clock time of the run. A Runge-Kutta step costs two or three Hancock 
+	steps, and the unsplit variant needs a smaller CFL number, but it converts the fluid 
+	state only once per stage.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	tmax_sod: float
+		Time at which the shocktube is compared to the true solution
+	tmax_sedov: float
+		Time at which the Sedov-Taylor setup is compared to the true solution
+	schemes: array_like
+		List of tuples with the reconstruction scheme, time integration scheme, whether the 
+		Runge-Kutta integration is unsplit, and the CFL number
+	"""
+
+	setup_sod = setup_shocktube.SetupSodX()
+	setup_sed = setup_sedov.SetupSedov()
+	
+	def densityErrorSod(sim):
+		slc = (slice(sim.xlo, sim.xhi + 1), sim.ylo + sim.ny // 2)
+		V_true = setup_sod.trueSolution(sim, sim.x[slc[0]], ['DN'])[0]
+		V_sim = sim.V[(sim.q_prim['DN'],) + slc]
+		return np.mean(np.abs(V_sim - V_true))
+
+	def densityErrorSedov(sim):
+		x, y = sim.xyGrid()
+		slc = (slice(sim.xlo, sim.xhi + 1), slice(sim.ylo, sim.yhi + 1))
+		r = np.sqrt((x[slc] - 0.5)**2 + (y[slc] - 0.5)**2).flatten()
+		V_true = setup_sed.trueSolution(sim, r, ['DN'])[0]
+		V_sim = sim.V[(sim.q_prim['DN'],) + slc].flatten()
+		return np.mean(np.abs(V_sim - V_true))
+
+	print('%-6s  %-6s  %-8s  %-7s  %6s  %10s  %8s  %10s  %10s' % ('Setup', 'Rec.', 'Int.', 'Split', 'nx', 
+		'L1(DN)', 'Steps', 'Steps/s', 'Time (s)'))
+	for name, setup, tmax, densityError in [('sod', setup_sod, tmax_sod, densityErrorSod), 
+										('sedov', setup_sed, tmax_sedov, densityErrorSedov)]:
+		for rec, ti, unsplit, cfl in schemes:
+			if unsplit:
+				split_str = 'unsplit'
+			else:
+				split_str = 'split'
+			for nx in nx_list:
+				hs = ulula_sim.HydroScheme(reconstruction = rec, limiter = 'mc', time_integration = ti, 
+										unsplit = unsplit, cfl = cfl)
+				sim = ulula_sim.Simulation(hs)
+				setup.initialConditions(sim, nx)
+				t_step = runToTime(sim, tmax)
+				print('%-6s  %-6s  %-8s  %-7s  %6d  %10.3e  %8d  %10.1f  %10.2f' % (name, rec, ti, split_str, 
+					nx, densityError(sim), sim.step, 1.0 / t_step, t_step * sim.step))
+
+	return
+
+def unsplitBenchmark(nx_list = [64, 128, 256], tmax = 0.5, profiles = ['sine', 'tophat'],
+					schemes = [('const', 'euler', 0.8), ('linear', 'hancock', 0.8), ('ppm', 'hancock', 0.8)]):
+	"""
+	Speed and accuracy of the unsplit CTU scheme
+	
+	This function runs the advection test (see :class:`~ulula.setups.advection.SetupAdvect`) with
+	each scheme, once with the default Strang-split timestep and once with the unsplit corner 
+	transport upwind update (see :func:`~ulula.simulation.Simulation.unsplitStep`). The flow is 
+	diagonal to the grid, which is where the two methods differ most. We print the L1 error in 
+	density with respect to the analytically advected profile, the number of timesteps, and the 
+	wall-clock time per timestep and of the run. The unsplit update converts the fluid state and 
+	fills the ghost cells only once per timestep, but it solves twice as many Riemann problems 
+	and converts the corrected edge states.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	tmax: float
+		Time at which the density is compared to the advected profile
+	profiles: array_like
+		Density profiles of the advection setup to run
+	schemes: array_like
+		List of tuples with the reconstruction scheme, time integration scheme, and CFL number
+	"""
+
+	print('%-6s  %-6s  %-8s  %-7s  %6s  %10s  %8s  %10s  %10s' % ('Setup', 'Rec.', 'Int.', 'Split', 'nx', 
+		'L1(DN)', 'Steps', 'ms/step', 'Time (s)'))
+	for profile in profiles:
+		setup = setup_advect.SetupAdvect(profile = profile)
+		for rec, ti, cfl in schemes:
+			for unsplit in [False, True]:
+				if unsplit:
+					split_str = 'unsplit'
+				else:
+					split_str = 'split'
+				for nx in nx_list:
+					hs = ulula_sim.HydroScheme(reconstruction = rec, limiter = 'mc', time_integration = ti, 
+											unsplit = unsplit, cfl = cfl)
+					sim = ulula_sim.Simulation(hs)
+					setup.initialConditions(sim, nx)
+					t_step = runToTime(sim, tmax)
+					rho = sim.V[sim.q_prim['DN']][sim.slc3dom[1:]]
+					rho_true = setup.trueDensity(sim, sim.t)[sim.slc3dom[1:]]
+					err = np.mean(np.abs(rho - rho_true))
+					print('%-6s  %-6s  %-8s  %-7s  %6d  %10.3e  %8d  %10.2f  %10.2f' % (profile, rec, ti, 
+						split_str, nx, err, sim.step, t_step * 1000.0, t_step * sim.step))
+
+	return
+
+def ensembleBenchmark(nx_list = [32, 64, 128], n_members_list = [1, 4, 16, 32], n_steps = 20,
+					reconstruction = 'linear', time_integration = 'hancock'):
+	"""
+	Time per member and timestep of ensembles of simulations
+	
+	This function creates Kelvin-Helmholtz setups that differ in their density contrast, velocity 
+	difference, and number of waves, and advances them either one after the other as separate 
+	simulations or together as an ensemble (see :class:`~ulula.ensemble.EnsembleSimulation`). For 
+	the separate simulations, we time each member with the same number of steps. We print the 
+	wall-clock time per member and timestep and the speedup of the ensemble. On small grids, 
+	where the overhead of each operation dominates, the ensemble shares that overhead among its
+	members.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	n_members_list: array_like
+		Numbers of ensemble members to test
+	n_steps: int
+		Number of timesteps to average over
+	reconstruction: str
+		Reconstruction scheme
+	time_integration: str
+		Time integration scheme
+	"""
+
+	def createMembers(nx, n_members):
+		sims = []
+		for i in range(n_members):
+			setup = setup_kh.SetupKelvinHelmholtz(rho1 = 1.5 + 0.1 * i, velocity_difference = 0.5 + 0.05 * i,
+											n_waves = 1 + i % 4)
+			hs = ulula_sim.HydroScheme(reconstruction = reconstruction, limiter = 'mc', 
+									time_integration = time_integration)
+			sim = ulula_sim.Simulation(hs)
+			setup.initialConditions(sim, nx)
+			sims.append(sim)
+		return sims
+
+	res = []
+	for nx in nx_list:
+		for n_members in n_members_list:
+			t_sep = 0.0
+			for sim in createMembers(nx, n_members):
+				t_sep += timeSteps(sim, n_steps)
+			t_sep /= n_members
+			ens = ulula_ensemble.EnsembleSimulation(createMembers(nx, n_members))
+			t_ens = timeSteps(ens, n_steps) / n_members
+			res.append((nx, n_members, t_sep, t_ens))
+
+	print('%6s  %8s  %14s  %14s  %8s' % ('nx', 'Members', 'Separate (ms)', 'Ensemble (ms)', 'Speedup'))
+	for nx, n_members, t_sep, t_ens in res:
+		print('%6d  %8d  %14.3f  %14.3f  %8.2f' % (nx, n_members, t_sep * 1000.0, t_ens * 1000.0, 
+											t_sep / t_ens))
+
+	return
+
+###################################################################################################
+
+def sweepBenchmark(nx_list = [64, 128], n_workers_list = [1, 2, 4, 8, 16, 32], tmax = 1.0):
+	"""
+	Wall time of a parameter sweep executed in parallel processes
+	
+	This function runs the combinations of two advection profiles, the four hydro schemes of the
+	advection example, and the given resolutions, first one after the other in this process and
+	then with :func:`~ulula.sweep.run_sweep` for different numbers of worker processes. We print
+	the total wall-clock time and the speedup with respect to the serial loop. The speedup is
+	limited by the number of cores and by the longest run in the sweep.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to include in the sweep
+	n_workers_list: array_like
+		Numbers of worker processes to test
+	tmax: float
+		Final time of each run
+	"""
+
+	grid_of_params = dict(profile = ['tophat', 'sine'])
+	hydro_schemes = []
+	hydro_schemes.append(ulula_sim.HydroScheme(reconstruction = 'const', cfl = 0.8))
+	for limiter, time_integration in [('minmod', 'euler'), ('mc', 'euler'), ('mc', 'hancock')]:
+		hydro_schemes.append(ulula_sim.HydroScheme(reconstruction = 'linear', limiter = limiter, 
+								time_integration = time_integration, cfl = 0.8))
+	run_kwargs = dict(tmax = tmax, print_step = 1000000)
+
+	t0 = time.perf_counter()
+	with contextlib.redirect_stdout(io.StringIO()):
+		for task in ulula_sweep.sweepTasks(grid_of_params, hydro_schemes, nx_list):
+			setup = setup_advect.SetupAdvect(**task['params'])
+			ulula_run.run(setup, hydro_scheme = task['hydro_scheme'], nx = task['nx'], **run_kwargs)
+	t_serial = time.perf_counter() - t0
+
+	res = []
+	for n_workers in n_workers_list:
+		t0 = time.perf_counter()
+		ulula_sweep.run_sweep(setup_advect.SetupAdvect, grid_of_params, hydro_schemes, nx_list, 
+							n_workers = n_workers, run_kwargs = run_kwargs, manifest_file = None,
+							return_sims = False, verbose = False)
+		res.append((n_workers, time.perf_counter() - t0))
+
+	print('%8s  %10s  %8s' % ('Workers', 'Wall (s)', 'Speedup'))
+	print('%8s  %10.2f  %8.2f' % ('serial', t_serial, 1.0))
+	for n_workers, t_sweep in res:
+		print('%8d  %10.2f  %8.2f' % (n_workers, t_sweep, t_serial / t_sweep))
+
+	return
+
+###################################################################################################
+
+def asyncOutputBenchmark(nx_list = [256, 1024], n_steps = 10, output_step = 1, 
+						reconstruction = 'const', time_integration = 'euler'):
+	"""
+	Wall time of runs with frequent snapshot outputs written synchronously or in the background
+	
+	This function runs a Kelvin-Helmholtz setup for a fixed number of steps with a snapshot file
+	every ``output_step`` steps, once without outputs, once with synchronous outputs, and once
+	with the background writer (see :class:`~ulula.output.SnapshotWriter`). The files are written
+	to a temporary directory. We print the total wall-clock time of each run and the fraction of
+	the output cost that the background writer hides. The gain depends on the number of cores and
+	the speed of the file system; with a single core, only the time the writer waits for the disk 
+	can overlap with the computation.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	n_steps: int
+		Number of timesteps per run
+	output_step: int
+		Interval between snapshot files in steps
+	reconstruction: str
+		Reconstruction scheme
+	time_integration: str
+		Time integration scheme
+	"""
+
+	setup = setup_kh.SetupKelvinHelmholtz()
+	hs = ulula_sim.HydroScheme(reconstruction = reconstruction, time_integration = time_integration)
+
+	res = []
+	cwd = os.getcwd()
+	for nx in nx_list:
+		t_run = {}
+		for mode in ['none', 'sync', 'async']:
+			with tempfile.TemporaryDirectory() as tmp_dir:
+				os.chdir(tmp_dir)
+				try:
+					t0 = time.perf_counter()
+					with contextlib.redirect_stdout(io.StringIO()):
+						ulula_run.run(setup, hydro_scheme = hs, nx = nx, tmax = 1E10, max_steps = n_steps,
+									output_step = None if (mode == 'none') else output_step,
+									output_async = (mode == 'async'))
+					t_run[mode] = time.perf_counter() - t0
+				finally:
+					os.chdir(cwd)
+		res.append((nx, t_run))
+
+	print('%6s  %10s  %10s  %10s  %8s' % ('nx', 'None (s)', 'Sync (s)', 'Async (s)', 'Hidden'))
+	for nx, t_run in res:
+		t_out = t_run['sync'] - t_run['none']
+		print('%6d  %10.2f  %10.2f  %10.2f  %7.0f%%' % (nx, t_run['none'], t_run['sync'], t_run['async'], 
+										100.0 * (t_run['sync'] - t_run['async']) / t_out))
+
+	return
+
+###################################################################################################
+
+def seriesBenchmark(nx = 64, n_snapshots = 1000):
+	"""
+	Write and read times of separate snapshot files and series files
+	
+	This function writes the same evolved Kelvin-Helmholtz snapshot ``n_snapshots`` times (with 
+	increasing times) to separate files, to a series file (see 
+	:class:`~ulula.output.SnapshotSeriesWriter`), and to a compressed single-precision series 
+	file. We then read one row of the density at all times, as a post-processing script would
+	when plotting the evolution of a profile. We print the wall-clock times of writing and reading
+	and the total size of the files.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx: int
+		Resolution
+	n_snapshots: int
+		Number of snapshots to write
+	"""
+
+	# We evolve the simulation for a while so that the fields are not as easily compressible as
+	# the initial conditions. Each snapshot is compressed separately, so writing the same state
+	# repeatedly does not flatter the compression.
+	setup = setup_kh.SetupKelvinHelmholtz()
+	sim = ulula_sim.Simulation(ulula_sim.HydroScheme(reconstruction = 'linear', time_integration = 'hancock'))
+	setup.initialConditions(sim, nx)
+	runToTime(sim, 1.0)
+	modes = [('files', None), ('series', {}), ('series_f32_gzip', dict(precision = 'float32', 
+							compression = 'gzip', shuffle = True))]
+
+	res = []
+	cwd = os.getcwd()
+	for name, kwargs in modes:
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			os.chdir(tmp_dir)
+			try:
+				t0 = time.perf_counter()
+				with contextlib.redirect_stdout(io.StringIO()):
+					if kwargs is None:
+						for i in range(n_snapshots):
+							sim.t = 0.001 * i
+							sim.save(filename = 'ulula_%05d.hdf5' % (i))
+					else:
+						writer = ulula_output.SnapshotSeriesWriter('series.hdf5', **kwargs)
+						for i in range(n_snapshots):
+							sim.t = 0.001 * i
+							sim.save(writer = writer)
+						writer.close()
+				t_write = time.perf_counter() - t0
+				size = sum([os.path.getsize(fn) for fn in os.listdir('.')])
+				
+				t0 = time.perf_counter()
+				if kwargs is None:
+					row = []
+					for i in range(n_snapshots):
+						with h5py.File('ulula_%05d.hdf5' % (i), 'r') as f:
+							row.append(f['grid']['DN'][:, nx // 2])
+					row = np.array(row)
+				else:
+					with ulula_output.SnapshotSeries('series.hdf5') as series:
+						row = series['DN'][:, :, nx // 2]
+				t_read = time.perf_counter() - t0
+			finally:
+				os.chdir(cwd)
+		res.append((name, t_write, t_read, size))
+
+	print('%-16s  %10s  %10s  %10s' % ('Format', 'Write (s)', 'Read (s)', 'Size (MB)'))
+	for name, t_write, t_read, size in res:
+		print('%-16s  %10.2f  %10.3f  %10.2f' % (name, t_write, t_read, size / 1024**2))
+
+	return
+
+###################################################################################################
+
+def snapshotViewBenchmark(nx_list = [256, 1024], n_snapshots = 20, box = (0.4, 0.6, 0.4, 0.6)):
+	"""
+	Time and memory needed to analyze a region of many snapshots
+	
+	This function writes ``n_snapshots`` Kelvin-Helmholtz snapshot files and computes the mean
+	density in a box, once by loading each file with :func:`~ulula.simulation.load` and once via
+	a :class:`~ulula.output.SnapshotView` (with a memory map and with HDF5 hyperslabs). We print 
+	the wall-clock time and the peak memory allocated during the analysis, as measured by the
+	``tracemalloc`` module. Memory-mapped pages belong to the operating system's page cache and
+	are not counted.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	n_snapshots: int
+		Number of snapshot files
+	box: array_like
+		Region to analyze, given as (xmin, xmax, ymin, ymax) in code units
+	"""
+
+	def meanLoad(fn):
+		with contextlib.redirect_stdout(io.StringIO()):
+			sim = ulula_sim.load(fn)
+		x, y = sim.xyGrid()
+		mask = (x >= box[0]) & (x <= box[1]) & (y >= box[2]) & (y <= box[3])
+		mean = np.mean(sim.V[sim.q_prim['DN']][mask])
+		# The simulation object contains reference cycles, so that it would otherwise only be 
+		# freed by the next garbage collection
+		del sim
+		gc.collect()
+		return mean
+
+	def meanView(fn, memmap):
+		with ulula_output.SnapshotView(fn, memmap = memmap) as view:
+			return np.mean(view.read('DN', box = box))
+
+	modes = [('load', meanLoad), ('view_memmap', lambda fn: meanView(fn, True)), 
+			('view_hdf5', lambda fn: meanView(fn, False))]
+
+	res = []
+	cwd = os.getcwd()
+	for nx in nx_list:
+		setup = setup_kh.SetupKelvinHelmholtz()
+		sim = ulula_sim.Simulation(ulula_sim.HydroScheme())
+		setup.initialConditions(sim, nx)
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			os.chdir(tmp_dir)
+			try:
+				fns = []
+				with contextlib.redirect_stdout(io.StringIO()):
+					for i in range(n_snapshots):
+						sim.t = 0.01 * i
+						fns.append('ulula_%04d.hdf5' % (i))
+						sim.save(filename = fns[-1])
+				for name, func in modes:
+					tracemalloc.start()
+					t0 = time.perf_counter()
+					means = [func(fn) for fn in fns]
+					t_ana = time.perf_counter() - t0
+					mem = tracemalloc.get_traced_memory()[1]
+					tracemalloc.stop()
+					res.append((nx, name, t_ana, mem, means[0]))
+			finally:
+				os.chdir(cwd)
+
+	print('%6s  %-12s  %10s  %14s  %12s' % ('nx', 'Method', 'Time (s)', 'Peak mem (MB)', 'Mean DN'))
+	for nx, name, t_ana, mem, mean in res:
+		print('%6d  %-12s  %10.3f  %14.2f  %12.6f' % (nx, name, t_ana, mem / 1024**2, mean))
+
+	return
+
+###################################################################################################
+
+def formatBenchmark(nx_list = [256, 1024], n_snapshots = 10, n_steps = 20):
+	"""
+	Write and read throughput and file size of the snapshot formats
+	
+	This function advances a Kelvin-Helmholtz simulation by ``n_steps`` timesteps (so that the 
+	fields are not trivially compressible) and writes ``n_snapshots`` copies of the state in each
+	format: uncompressed HDF5, HDF5 with ``gzip`` or ``lzf`` compression (both with shuffling),
+	chunked HDF5, and the raw :class:`~ulula.output.NpyFormat`. The snapshots are then read in 
+	full via a :class:`~ulula.output.SnapshotView`. We print the throughput in MB of field data 
+	per second and the size of a snapshot on disk. The files are read right after being 
+	written, which means that they are likely in the page cache.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	n_snapshots: int
+		Number of snapshots written and read in each format
+	n_steps: int
+		Number of timesteps taken before writing
+	"""
+
+	def diskSize(fn):
+		if os.path.isdir(fn):
+			return sum([os.path.getsize(os.path.join(fn, f)) for f in os.listdir(fn)])
+		return os.path.getsize(fn)
+
+	def readAll(fn):
+		with ulula_output.SnapshotView(fn) as view:
+			for q in view.q_list:
+				np.array(view[q])
+		return
+
+	formats = [('hdf5', ulula_output.HDF5Format()), 
+			('hdf5_gzip', ulula_output.HDF5Format(compression = 'gzip', shuffle = True)), 
+			('hdf5_lzf', ulula_output.HDF5Format(compression = 'lzf', shuffle = True)),
+			('hdf5_chunked', ulula_output.HDF5Format(chunks = (128, 128))), 
+			('npy', ulula_output.NpyFormat())]
+
+	res = []
+	cwd = os.getcwd()
+	for nx in nx_list:
+		setup = setup_kh.SetupKelvinHelmholtz()
+		sim = ulula_sim.Simulation(ulula_sim.HydroScheme())
+		setup.initialConditions(sim, nx)
+		timeSteps(sim, n_steps)
+		mb = sim.nq * sim.nx * sim.ny * sim.V.itemsize / 1024**2
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			os.chdir(tmp_dir)
+			try:
+				for name, fmt in formats:
+					fns = ['ulula_%s_%04d%s' % (name, i, fmt.extension) for i in range(n_snapshots)]
+					with contextlib.redirect_stdout(io.StringIO()):
+						t0 = time.perf_counter()
+						for fn in fns:
+							sim.save(filename = fn, fmt = fmt)
+						t_write = time.perf_counter() - t0
+					t0 = time.perf_counter()
+					for fn in fns:
+						readAll(fn)
+					t_read = time.perf_counter() - t0
+					res.append((nx, name, n_snapshots * mb / t_write, n_snapshots * mb / t_read, 
+							diskSize(fns[0]) / 1024**2))
+			finally:
+				os.chdir(cwd)
+
+	print('%6s  %-12s  %12s  %12s  %10s' % ('nx', 'Format', 'Write (MB/s)', 'Read (MB/s)', 'Size (MB)'))
+	for nx, name, r_write, r_read, size in res:
+		print('%6d  %-12s  %12.1f  %12.1f  %10.2f' % (nx, name, r_write, r_read, size))
+
+	return
+
+###################################################################################################
+
+def checkpointBenchmark(nx_list = [64, 256], precisions = ['float64', 'float32'], tmax = 0.5, 
+					kill_step = 37, checkpoint_step = 10, output_time = 0.05):
+	"""
+	Exactness of restarts from checkpoints and from snapshots
+	
+	This function runs the Kelvin-Helmholtz setup to ``tmax`` three times: without interruption,
+	stopped after ``kill_step`` steps (with ``max_steps``) and restarted from the checkpoint 
+	written at that point, and restarted from a plain snapshot of the same state. All runs write
+	snapshots at the times given by ``output_time``. The final ``U``, ``V``, time, and step as 
+	well as the time-targeted snapshots of the checkpoint restart must be identical to those of 
+	the uninterrupted run bit by bit; an exception is raised otherwise. We print the largest
+	difference in the physical domain after a restart from the snapshot, the time needed to 
+	write the checkpoint, and its size.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions to test
+	precisions: array_like
+		Floating-point precisions to test
+	tmax: float
+		Final time of the runs
+	kill_step: int
+		Step after which the interrupted run is stopped
+	checkpoint_step: int
+		Interval of the checkpoints in the interrupted run
+	output_time: float
+		Time interval of the snapshots
+	"""
+
+	def timeSnapshots():
+		snaps = {}
+		for fn in sorted(os.listdir('.')):
+			if fn.startswith('ulula_time_'):
+				with h5py.File(fn, 'r') as f:
+					snaps[fn] = {q: f['grid'][q][...] for q in f['grid']}
+		return snaps
+
+	setup = setup_kh.SetupKelvinHelmholtz()
+	run_kwargs = dict(tmax = tmax, output_time = output_time, plot_ics = False, print_step = 100000)
+
+	res = []
+	cwd = os.getcwd()
+	for nx in nx_list:
+		for precision in precisions:
+			sims = {}
+			snaps = {}
+			with tempfile.TemporaryDirectory() as tmp_dir:
+				try:
+					for mode in ['full', 'checkpoint', 'snapshot']:
+						os.makedirs(os.path.join(tmp_dir, mode))
+						os.chdir(os.path.join(tmp_dir, mode))
+						hs = ulula_sim.HydroScheme(precision = precision)
+						with contextlib.redirect_stdout(io.StringIO()):
+							if mode == 'full':
+								sims[mode] = ulula_run.run(setup, hydro_scheme = hs, nx = nx, **run_kwargs)
+							else:
+								ulula_run.run(setup, hydro_scheme = hs, nx = nx, max_steps = kill_step, 
+											checkpoint_step = checkpoint_step, **run_kwargs)
+								restart_file = 'ulula_checkpoint.hdf5'
+								if mode == 'checkpoint':
+									sim = ulula_sim.loadCheckpoint(restart_file)[0]
+									t0 = time.perf_counter()
+									sim.saveCheckpoint('timing.hdf5')
+									t_ckpt = time.perf_counter() - t0
+									size = os.path.getsize('timing.hdf5')
+									os.remove('timing.hdf5')
+								else:
+									restart_file = 'ulula_snapshot.hdf5'
+									ulula_sim.load('ulula_checkpoint.hdf5').save(restart_file)
+								sims[mode] = ulula_run.run(setup, nx = nx, restart_file = restart_file, 
+														**run_kwargs)
+						snaps[mode] = timeSnapshots()
+				finally:
+					os.chdir(cwd)
+
+			full = sims['full']
+			ckpt = sims['checkpoint']
+			for q in ['U', 'V', 't', 'step']:
+				if not np.array_equal(getattr(full, q), getattr(ckpt, q)):
+					raise Exception('Restart from checkpoint differs in %s (nx %d, %s).' % (q, nx, precision))
+			if sorted(snaps['full'].keys()) != sorted(snaps['checkpoint'].keys()):
+				raise Exception('Restart from checkpoint wrote different snapshot files (nx %d, %s).' \
+							% (nx, precision))
+			for fn in snaps['full']:
+				for q in snaps['full'][fn]:
+					if not np.array_equal(snaps['full'][fn][q], snaps['checkpoint'][fn][q]):
+						raise Exception('Restart from checkpoint differs in snapshot %s, field %s (nx %d, %s).' \
+									% (fn, q, nx, precision))
+			snap = sims['snapshot']
+			diff = np.max(np.abs(full.U[full.slc3dom] - snap.U[snap.slc3dom]))
+			res.append((nx, precision, len(snaps['full']), diff, t_ckpt, size))
+
+	print('%6s  %-8s  %10s  %16s  %14s  %10s' % ('nx', 'Prec.', 'Snapshots', 'Snapshot diff(U)', 
+											'Ckpt write (s)', 'Size (MB)'))
+	for nx, precision, n_snaps, diff, t_ckpt, size in res:
+		print('%6d  %-8s  %10d  %16.2e  %14.3f  %10.2f' % (nx, precision, n_snaps, diff, t_ckpt, 
+														size / 1024**2))
+
+	return
+
+###################################################################################################
+
+def amrBenchmark(nx_list = [256, 512], block_size = 16, backend = 'numpy', tmax_kh = 0.1,
+				tmax_sedov = 0.004):
+	"""
+	Cell updates, wall time, and accuracy of adaptive mesh refinement
+	
+	This function runs two setups on a uniform grid with ``nx`` cells, on a uniform grid with half
+	the resolution, and with adaptive mesh refinement at an effective resolution of ``nx`` cells 
+	(i.e., with a coarse grid of ``nx / 2`` cells): the Kelvin-Helmholtz instability, where the 
+	shear layers must be refined, and the Sedov-Taylor explosion, where the shock front must be 
+	refined. For each run, we print the number of cell updates (cells times timesteps, counting 
+	the coarse cells covered by patches), the wall time, the speedup with respect to the uniform 
+	fine grid, and the mean absolute difference in density to the uniform fine grid, which should 
+	be much smaller for the adaptive run than for the coarse run. For the Sedov setup, we also 
+	print the mean absolute error with respect to the analytical radial profile. For the adaptive 
+	runs, we print the fraction of the domain covered by patches at the end.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Effective resolutions to test
+	block_size: int
+		Size of the refinement blocks in coarse cells
+	backend: str
+		Backend of the hydro scheme
+	tmax_kh: float
+		Time at which the Kelvin-Helmholtz runs are compared
+	tmax_sedov: float
+		Time at which the Sedov-Taylor runs are compared
+	"""
+
+	setups = []
+	setups.append(('kh', setup_kh.SetupKelvinHelmholtz(), tmax_kh))
+	setups.append(('sedov', setup_sedov.SetupSedov(), tmax_sedov))
+	
+	def densityError(setup, sim):
+		x, y = sim.xyGrid()
+		slc = (slice(sim.xlo, sim.xhi + 1), slice(sim.ylo, sim.yhi + 1))
+		r = np.sqrt((x[slc] - 0.5)**2 + (y[slc] - 0.5)**2).flatten()
+		V_true = setup.trueSolution(sim, r, ['DN'])[0]
+		V_sim = sim.V[(sim.q_prim['DN'],) + slc].flatten()
+		return np.mean(np.abs(V_sim - V_true))
+
+	print('%-6s  %6s  %-7s  %12s  %10s  %8s  %10s  %10s  %8s' % ('Setup', 'nx', 'Grid', 'Cell upd.', 
+		'Time (s)', 'Speedup', 'L1(diff)', 'L1(true)', 'Refined'))
+	for name, setup, tmax in setups:
+		for nx in nx_list:
+			res = {}
+			for grid in ['fine', 'coarse', 'amr']:
+				hs = ulula_sim.HydroScheme(reconstruction = 'linear', limiter = 'mc', 
+									time_integration = 'hancock', cfl = 0.8, backend = backend)
+				sim = ulula_sim.Simulation(hs)
+				if grid == 'coarse':
+					setup.initialConditions(sim, nx // 2)
+				else:
+					setup.initialConditions(sim, nx)
+				if grid == 'amr':
+					sim = ulula_amr.AMRSimulation(sim, block_size = block_size)
+	
+				# Compile the numba kernels outside of the timing
+				if backend == 'numba':
+					sim_copy = copy.deepcopy(sim)
+					sim_copy.timestep()
+	
+				t0 = time.perf_counter()
+				n_steps = 0
+				while sim.t < tmax:
+					dt = min(sim.cflCondition(), tmax - sim.t)
+					sim.timestep(dt = dt)
+					n_steps += 1
+				t_run = time.perf_counter() - t0
+				
+				if grid == 'amr':
+					n_upd = sim.n_cell_updates
+					refined = len(sim.patches) / (sim.n_blocks_x * sim.n_blocks_y)
+					sim = sim.uniformSimulation()
+				else:
+					n_upd = n_steps * sim.nx * sim.ny
+				res[grid] = (t_run, sim)
+				
+				# Compare at the coarse resolution if necessary
+				DN = sim.q_prim['DN']
+				rho_fine = res['fine'][1].V[DN][res['fine'][1].slc3dom[1:]]
+				rho = sim.V[DN][sim.slc3dom[1:]]
+				if grid == 'coarse':
+					rho_fine = 0.25 * (rho_fine[0::2, 0::2] + rho_fine[1::2, 0::2] \
+									+ rho_fine[0::2, 1::2] + rho_fine[1::2, 1::2])
+				line = '%-6s  %6d  %-7s  %12d  %10.2f  %8.2f  %10.3e' % (name, nx, grid, n_upd, t_run, 
+											res['fine'][0] / t_run, np.mean(np.abs(rho - rho_fine)))
+				if name == 'sedov':
+					line += '  %10.3e' % (densityError(setup, sim))
+				else:
+					line += '  %10s' % ('')
+				if grid == 'amr':
+					line += '  %8.2f' % (refined)
+				print(line)
+
+	return
+
+def nestedGridBenchmark(nx_list = [128, 256], block_size = 8, backend = 'numpy', tmax_kh = 0.5,
+						tmax_sedov = 0.002):
+	"""
+	Wall time and accuracy of static nested grids with subcycling
+	
+	This function runs two setups with static nested grids at a resolution of ``nx`` cells and 
+	compares them to uniform grids with ``nx`` and ``nx / 2`` cells: the Kelvin-Helmholtz 
+	instability with nested grids over the two shear layers at y = 0.25 and 0.75, and the 
+	Sedov-Taylor explosion with a nested grid over the center that contains the blastwave until 
+	``tmax_sedov``. For each run, we print the number of cell updates (counting each substep of 
+	the nested grids), the wall time, the speedup with respect to the uniform fine grid, and the 
+	mean absolute difference in density to the uniform fine grid. For the Sedov setup, we also 
+	print the mean absolute error with respect to the analytical radial profile.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nx_list: array_like
+		Resolutions of the fine grids to test
+	block_size: int
+		Size of the blocks in coarse cells
+	backend: str
+		Backend of the hydro scheme
+	tmax_kh: float
+		Time at which the Kelvin-Helmholtz runs are compared
+	tmax_sedov: float
+		Time at which the Sedov-Taylor runs are compared
+	"""
+
+	setups = []
+	setups.append(('kh', setup_kh.SetupKelvinHelmholtz(), [(0.0, 1.0, 0.2, 0.3), (0.0, 1.0, 0.7, 0.8)], 
+				tmax_kh))
+	setups.append(('sedov', setup_sedov.SetupSedov(), [(0.35, 0.65, 0.35, 0.65)], tmax_sedov))
+
+	def densityError(setup, sim):
+		x, y = sim.xyGrid()
+		slc = (slice(sim.xlo, sim.xhi + 1), slice(sim.ylo, sim.yhi + 1))
+		r = np.sqrt((x[slc] - 0.5)**2 + (y[slc] - 0.5)**2).flatten()
+		V_true = setup.trueSolution(sim, r, ['DN'])[0]
+		V_sim = sim.V[(sim.q_prim['DN'],) + slc].flatten()
+		return np.mean(np.abs(V_sim - V_true))
+
+	print('%-6s  %6s  %-7s  %12s  %10s  %8s  %10s  %10s' % ('Setup', 'nx', 'Grid', 'Cell upd.', 
+		'Time (s)', 'Speedup', 'L1(diff)', 'L1(true)'))
+	for name, setup, boxes, tmax in setups:
+		for nx in nx_list:
+			res = {}
+			for grid in ['fine', 'coarse', 'nested']:
+				hs = ulula_sim.HydroScheme(reconstruction = 'linear', limiter = 'mc', 
+									time_integration = 'hancock', cfl = 0.8, backend = backend)
+				sim = ulula_sim.Simulation(hs)
+				if grid == 'coarse':
+					setup.initialConditions(sim, nx // 2)
+				else:
+					setup.initialConditions(sim, nx)
+				if grid == 'nested':
+					sim = ulula_amr.NestedSimulation(sim, boxes, block_size = block_size)
+				
+				t0 = time.perf_counter()
+				n_steps = 0
+				while sim.t < tmax:
+					dt = min(sim.cflCondition(), tmax - sim.t)
+					sim.timestep(dt = dt)
+					n_steps += 1
+				t_run = time.perf_counter() - t0
+				
+				if grid == 'nested':
+					n_upd = sim.n_cell_updates
+					sim = sim.uniformSimulation()
+				else:
+					n_upd = n_steps * sim.nx * sim.ny
+				res[grid] = (t_run, sim)
+				
+				# Compare at the coarse resolution if necessary
+				DN = sim.q_prim['DN']
+				rho_fine = res['fine'][1].V[DN][res['fine'][1].slc3dom[1:]]
+				rho = sim.V[DN][sim.slc3dom[1:]]
+				if grid == 'coarse':
+					rho_fine = 0.25 * (rho_fine[0::2, 0::2] + rho_fine[1::2, 0::2] \
+									+ rho_fine[0::2, 1::2] + rho_fine[1::2, 1::2])
+				line = '%-6s  %6d  %-7s  %12d  %10.2f  %8.2f  %10.3e' % (name, nx, grid, n_upd, t_run, 
+											res['fine'][0] / t_run, np.mean(np.abs(rho - rho_fine)))
+				if name == 'sedov':
+					line += '  %10.3e' % (densityError(setup, sim))
+				print(line)
+
+	return
+
+###################################################################################################
+# Trigger
+###################################################################################################
+
+if __name__ == "__main__":
+	main()
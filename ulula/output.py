@@ -0,0 +1,1012 @@
+###################################################################################################
+#
+# Ulula -- output.py
+#
+# Writing and reading of snapshot files and time series of snapshots
+#
+# by Benedikt Diemer
+#
+###################################################################################################
+
+import os
+import json
+import time
+import queue
+import threading
+import numpy as np
+import h5py
+
+import ulula.utils as ulula_utils
+import ulula.simulation as ulula_sim
+
+###################################################################################################
+
+class SnapshotWriter():
+	"""
+	Background writer for snapshot files
+
+	Writing a snapshot file takes time during which the simulation would otherwise be stalled. A
+	writer receives the fields of a snapshot via :func:`submit`, copies them into one of a small
+	number of recycled buffers, and returns immediately. A background thread then writes the
+	buffers to files in the order in which they were submitted. If all buffers are waiting to be
+	written, :func:`submit` blocks until the writer has caught up, which limits the memory that
+	the snapshots can occupy. With the default two buffers, the simulation can proceed while the
+	previous snapshot is being written.
+
+	The fields must be copied because the simulation continues to change its arrays. The copy is
+	much faster than writing the file, but it means that the buffers occupy as much memory as
+	``n_buffers`` snapshots. The buffers are allocated when they are first used and re-allocated
+	if the size of the snapshots changes.
+
+	Errors that occur while writing are raised in the calling thread by the next call to
+	:func:`submit`, :func:`flush`, or :func:`close`. The writer must be closed when it is no
+	longer needed, which waits until all files have been written.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	n_buffers: int
+		Number of buffers, i.e., the number of snapshots that can be in the process of being
+		written
+	write_func: callable
+		Function that writes a file, with the same parameters as
+		:func:`~ulula.simulation.writeSnapshot` (which is the default), e.g., the ``write`` 
+		function of a snapshot format such as :class:`HDF5Format`
+	verbose: bool
+		If ``True``, a line is printed for each submitted file
+	"""
+
+	def __init__(self, n_buffers = 2, write_func = None, verbose = True):
+
+		if n_buffers < 1:
+			raise Exception('A snapshot writer needs at least one buffer (found %d).' % (n_buffers))
+		if write_func is None:
+			write_func = ulula_sim.writeSnapshot
+
+		self.write_func = write_func
+		self.verbose = verbose
+		self.error = None
+		self.closed = False
+
+		# Statistics: the number of files written, the time the submitting thread was blocked
+		# waiting for a free buffer, the time spent copying, and the time spent writing
+		self.n_written = 0
+		self.t_wait = 0.0
+		self.t_copy = 0.0
+		self.t_write = 0.0
+
+		self.free_buffers = queue.Queue()
+		for i in range(n_buffers):
+			self.free_buffers.put({})
+		self.jobs = queue.Queue()
+		self.thread = threading.Thread(target = self.writerLoop, daemon = True)
+		self.thread.start()
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def writerLoop(self):
+		"""
+		Main loop of the background thread
+		"""
+
+		while True:
+			job = self.jobs.get()
+			if job is None:
+				self.jobs.task_done()
+				break
+			filename, attrs, buf = job
+			try:
+				if self.error is None:
+					t0 = time.perf_counter()
+					self.write_func(filename, attrs, buf)
+					self.t_write += time.perf_counter() - t0
+					self.n_written += 1
+			except Exception as e:
+				self.error = e
+			finally:
+				self.free_buffers.put(buf)
+				self.jobs.task_done()
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def checkError(self):
+		"""
+		Raise an exception if writing a previous file failed
+		"""
+
+		if self.error is not None:
+			e = self.error
+			self.error = None
+			raise Exception('Writing a snapshot file failed: %s' % (str(e))) from e
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def submit(self, filename, attrs, fields):
+		"""
+		Copy a snapshot into a buffer and queue it for writing
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		filename: str
+			Output filename
+		attrs: dict
+			Groups of attributes (see :func:`~ulula.simulation.Simulation.snapshotAttributes`);
+			the dictionaries are not copied and must not be changed afterwards
+		fields: dict
+			Arrays to be written; they are copied before this function returns
+		"""
+
+		if self.closed:
+			raise Exception('Cannot submit a snapshot to a closed writer.')
+		self.checkError()
+		if self.verbose:
+			print('Saving to file %s in the background' % (filename))
+
+		t0 = time.perf_counter()
+		buf = self.free_buffers.get()
+		t1 = time.perf_counter()
+
+		for q in list(buf.keys()):
+			if not q in fields:
+				del buf[q]
+		for q in fields:
+			if (not q in buf) or (buf[q].shape != fields[q].shape) or (buf[q].dtype != fields[q].dtype):
+				buf[q] = np.empty(fields[q].shape, dtype = fields[q].dtype)
+			np.copyto(buf[q], fields[q])
+		self.jobs.put((filename, attrs, buf))
+
+		self.t_wait += t1 - t0
+		self.t_copy += time.perf_counter() - t1
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def flush(self):
+		"""
+		Wait until all submitted snapshots have been written
+		"""
+
+		self.jobs.join()
+		self.checkError()
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def close(self):
+		"""
+		Write all submitted snapshots and stop the background thread
+		"""
+
+		if self.closed:
+			return
+		self.closed = True
+		self.jobs.put(None)
+		self.thread.join()
+		self.checkError()
+
+		return
+
+###################################################################################################
+
+class SnapshotSeriesWriter():
+	"""
+	Writer that collects snapshots into a single file with a time axis
+
+	Writing thousands of separate snapshot files is slow, and so is opening them all during the
+	analysis. This writer appends each snapshot to one HDF5 file instead. The file contains the
+	same groups of attributes as a snapshot file (see :func:`~ulula.simulation.writeSnapshot`),
+	except that the time, step, and last sweep direction are stored as one-dimensional datasets
+	in the ``series`` group. Each field is a dataset in the ``grid`` group with dimensions
+	[n_snapshots, nx, ny] that is chunked by snapshot, so that appending and reading a single
+	snapshot touch only one chunk. The chunks can be compressed, and the fields can be stored in
+	a lower precision than that of the simulation. The file is flushed after each snapshot, which
+	means that it remains readable if the simulation is interrupted. The file can be read with
+	:class:`SnapshotSeries`.
+
+	The writer has the same :func:`submit` function as :class:`SnapshotWriter`, which means that 
+	it can be passed to :func:`~ulula.simulation.Simulation.save` (which ignores the filename). If
+	``background == True``, the snapshots are written by a :class:`SnapshotWriter`.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	filename: str
+		Name of the series file
+	append: bool
+		If ``True`` and the file exists, the snapshots are appended to it. Snapshots in the file
+		at or after the time of the first new snapshot are removed, which is appropriate when a
+		simulation is restarted from an earlier time. If ``False``, an existing file is
+		overwritten.
+	compression: str
+		Compression filter of the field datasets; can be ``None``, ``gzip``, or ``lzf``
+	compression_opts: int
+		Compression level for ``gzip`` (0-9)
+	shuffle: bool
+		If ``True``, the bytes of the values are shuffled before compression, which typically
+		improves the compression of floating-point data
+	precision: str
+		If not ``None``, the fields are stored with this precision (e.g., ``float32``) rather than
+		that of the simulation
+	background: bool
+		If ``True``, the snapshots are written in a background thread
+	"""
+
+	def __init__(self, filename, append = False, compression = None, compression_opts = None,
+				shuffle = False, precision = None, background = False):
+
+		if not compression in [None, 'gzip', 'lzf']:
+			raise Exception('Unknown compression filter, %s (must be gzip or lzf).' % (str(compression)))
+
+		self.filename = filename
+		self.append = append
+		self.compression = compression
+		self.compression_opts = compression_opts
+		self.shuffle = shuffle
+		self.precision = precision
+		self.f = None
+		self.n_snapshots = 0
+
+		if background:
+			self.writer = SnapshotWriter(write_func = self.write, verbose = False)
+		else:
+			self.writer = None
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def openFile(self, attrs, fields):
+		"""
+		Create the series file or open an existing one for appending
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		attrs: dict
+			Groups of attributes of the first snapshot to be written
+		fields: dict
+			Fields of the first snapshot to be written
+		"""
+
+		if self.append and os.path.exists(self.filename):
+			self.f = h5py.File(self.filename, 'a')
+			if (not 'series' in self.f) or (sorted(self.f['grid'].keys()) != sorted(fields.keys())):
+				raise Exception('Cannot append to file %s, which is not a series with fields %s.' \
+							% (self.filename, str(list(fields.keys()))))
+			for q in fields:
+				if self.f['grid'][q].shape[1:] != fields[q].shape:
+					raise Exception('Cannot append to file %s, which has grid dimensions %s rather than %s.' \
+								% (self.filename, str(self.f['grid'][q].shape[1:]), str(fields[q].shape)))
+			self.n_snapshots = int(np.count_nonzero(self.f['series']['t'][...] < attrs['run']['t']))
+			self.resize(self.n_snapshots)
+			return
+
+		self.f = h5py.File(self.filename, 'w')
+		for group in attrs:
+			if group == 'run':
+				continue
+			self.f.create_group(group)
+			for k, v in attrs[group].items():
+				self.f[group].attrs[k] = v
+
+		self.f.create_group('series')
+		self.f['series'].create_dataset('t', shape = (0,), maxshape = (None,), dtype = np.float64)
+		self.f['series'].create_dataset('step', shape = (0,), maxshape = (None,), dtype = np.int64)
+		self.f['series'].create_dataset('last_dir', shape = (0,), maxshape = (None,), dtype = np.int64)
+
+		self.f.create_group('grid')
+		for q in fields:
+			if self.precision is None:
+				dtype = fields[q].dtype
+			else:
+				dtype = np.dtype(self.precision)
+			shape = fields[q].shape
+			self.f['grid'].create_dataset(q, shape = (0,) + shape, maxshape = (None,) + shape,
+						chunks = (1,) + shape, dtype = dtype, compression = self.compression,
+						compression_opts = self.compression_opts, shuffle = self.shuffle)
+		self.n_snapshots = 0
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def resize(self, n):
+		"""
+		Set the number of snapshots in all datasets of the file
+		"""
+
+		for k in self.f['series']:
+			self.f['series'][k].resize(n, axis = 0)
+		for q in self.f['grid']:
+			self.f['grid'][q].resize(n, axis = 0)
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def write(self, filename, attrs, fields):
+		"""
+		Append a snapshot to the series file
+
+		This function has the same parameters as :func:`~ulula.simulation.writeSnapshot` so that
+		it can be used by a :class:`SnapshotWriter`; the filename is ignored.
+		"""
+
+		if self.f is None:
+			self.openFile(attrs, fields)
+
+		n = self.n_snapshots
+		self.resize(n + 1)
+		self.f['series']['t'][n] = attrs['run']['t']
+		self.f['series']['step'][n] = attrs['run']['step']
+		self.f['series']['last_dir'][n] = attrs['run']['last_dir']
+		for q in fields:
+			self.f['grid'][q][n] = fields[q]
+		self.n_snapshots += 1
+		self.f.flush()
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def submit(self, filename, attrs, fields):
+		"""
+		Append a snapshot, possibly in the background
+
+		See :func:`SnapshotWriter.submit` for the parameters; the filename is ignored.
+		"""
+
+		print('Appending snapshot at t = %.4f to file %s' % (attrs['run']['t'], self.filename))
+		if self.writer is None:
+			self.write(filename, attrs, fields)
+		else:
+			self.writer.submit(filename, attrs, fields)
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def flush(self):
+		"""
+		Wait until all submitted snapshots have been written
+		"""
+
+		if self.writer is not None:
+			self.writer.flush()
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def close(self):
+		"""
+		Write all submitted snapshots and close the file
+		"""
+
+		try:
+			if self.writer is not None:
+				self.writer.close()
+		finally:
+			if self.f is not None:
+				self.f.close()
+				self.f = None
+
+		return
+
+###################################################################################################
+
+class SnapshotSeries():
+	"""
+	Lazy reader for files written by :class:`SnapshotSeriesWriter`
+
+	Opening a series reads only the attributes and the (small) arrays of times, steps, and sweep
+	directions, which are available as ``t``, ``step``, and ``last_dir``. The fields are accessed
+	as ``series['DN']`` etc., which returns an HDF5 dataset with dimensions 
+	[n_snapshots, nx, ny]. Data are read from disk only when the dataset is sliced, e.g., 
+	``series['DN'][10]`` for the density at the 11th output time, or ``series['PR'][:, :, 5]`` for
+	one row of the pressure at all times. The cell centers of the physical domain are available 
+	as ``x`` and ``y``. A full simulation object at one of the output times can be created with
+	:func:`snapshot`. The series should be closed when it is no longer needed, or used as a 
+	context manager (``with SnapshotSeries(filename) as series:``).
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	filename: str
+		Name of the series file
+	"""
+
+	def __init__(self, filename):
+
+		self.filename = filename
+		self.f = h5py.File(filename, 'r')
+		if not 'series' in self.f:
+			self.f.close()
+			raise Exception('File %s is not a snapshot series.' % (filename))
+
+		file_version = self.f['code'].attrs['file_version']
+		if ulula_utils.versionIsOlder(ulula_sim.file_version_oldest, file_version):
+			self.f.close()
+			raise Exception('Cannot open series file %s because version %s is too old (allowed %s).' \
+						% (filename, file_version, ulula_sim.file_version_oldest))
+
+		self.t = self.f['series']['t'][...]
+		self.step = self.f['series']['step'][...]
+		self.last_dir = self.f['series']['last_dir'][...]
+		self.n_snapshots = len(self.t)
+		self.q_list = list(self.f['grid'].keys())
+
+		domain = self.f['domain'].attrs
+		self.nx = int(domain['nx'])
+		self.ny = int(domain['ny'])
+		self.dx = float(domain['dx'])
+		self.x = float(domain['xmin']) + (np.arange(self.nx) + 0.5) * self.dx
+		self.y = float(domain['ymin']) + (np.arange(self.ny) + 0.5) * self.dx
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def __len__(self):
+
+		return self.n_snapshots
+
+	# ---------------------------------------------------------------------------------------------
+
+	def __getitem__(self, q):
+
+		if not q in self.q_list:
+			raise Exception('Field %s not found in series file %s (available: %s).' \
+						% (q, self.filename, str(self.q_list)))
+
+		return self.f['grid'][q]
+
+	# ---------------------------------------------------------------------------------------------
+
+	def __enter__(self):
+
+		return self
+
+	# ---------------------------------------------------------------------------------------------
+
+	def __exit__(self, exc_type, exc_value, traceback):
+
+		self.close()
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def index(self, t):
+		"""
+		Index of the snapshot closest to a given time
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		t: float
+			Time in code units
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		i: int
+			Index of the snapshot
+		"""
+
+		if self.n_snapshots == 0:
+			raise Exception('Series file %s contains no snapshots.' % (self.filename))
+		i = int(np.argmin(np.abs(self.t - t)))
+
+		return i
+
+	# ---------------------------------------------------------------------------------------------
+
+	def snapshot(self, i):
+		"""
+		Create a simulation object from one snapshot
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		i: int
+			Index of the snapshot
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		sim: Simulation
+			Object of type :data:`~ulula.simulation.Simulation`
+		"""
+
+		attrs = {}
+		for group in ['code', 'hydro_scheme', 'domain', 'physics']:
+			attrs[group] = self.f[group].attrs
+		attrs['run'] = dict(t = self.t[i], step = self.step[i], last_dir = self.last_dir[i])
+		fields = {}
+		for q in self.q_list:
+			fields[q] = self.f['grid'][q][i]
+		sim = ulula_sim.simulationFromSnapshot(attrs, fields, filename = self.filename)
+
+		return sim
+
+	# ---------------------------------------------------------------------------------------------
+
+	def slices(self, box = None):
+		"""
+		Index ranges of the cells within a box
+
+		See :func:`boxSlices` for the parameters and return values.
+		"""
+
+		return boxSlices(self.x, self.y, box)
+
+	# ---------------------------------------------------------------------------------------------
+
+	def read(self, q, box = None, snapshots = slice(None)):
+		"""
+		Read a field within a box for some or all snapshots
+
+		Only the data within the box and for the selected snapshots are read from the file.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		q: str
+			Field name
+		box: array_like
+			Region given as (xmin, xmax, ymin, ymax) in code units (see :func:`boxSlices`)
+		snapshots: int or slice
+			Index or range of the snapshots
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		data: array_like
+			Array with the values of the field in the box, with a leading dimension for the
+			snapshots if ``snapshots`` is a slice
+		"""
+
+		slc_x, slc_y = self.slices(box)
+		data = self[q][snapshots, slc_x, slc_y]
+
+		return data
+
+	# ---------------------------------------------------------------------------------------------
+
+	def close(self):
+		"""
+		Close the file
+		"""
+
+		if self.f is not None:
+			self.f.close()
+			self.f = None
+
+		return
+
+###################################################################################################
+
+class SnapshotView():
+	"""
+	Read-only, lazy access to the fields of a snapshot file
+
+	Loading a snapshot with :func:`~ulula.simulation.load` reads all fields into a simulation
+	object with ghost cells, workspaces, and conserved variables, which is wasteful if an analysis
+	needs only one field or a part of the domain. A view instead opens the file read-only and 
+	reads only the metadata. The format of the file is detected automatically (see 
+	:func:`detectFormat`). The fields are accessed as ``view['DN']`` etc. If a field is stored 
+	contiguously and without compression, as in the HDF5 files written by 
+	:func:`~ulula.simulation.Simulation.save` by default or in the :class:`NpyFormat`, it is 
+	returned as a read-only ``numpy.memmap`` into the file, which behaves like a normal array but
+	whose data are read from disk (or the page cache) only when they are accessed. Otherwise, the
+	HDF5 dataset is returned, of which only the requested hyperslab is read when it is sliced. In 
+	all cases, the array has dimensions [nx, ny] and contains only the physical domain.
+
+	The function :func:`read` returns the part of a field within a box given in code units, and
+	the cell centers of the physical domain are available as ``x`` and ``y``. The time, step, 
+	and domain parameters are available as attributes, and all groups of attributes of the file 
+	as the dictionary ``attrs``. A view should be closed when it is no longer needed, or used as 
+	a context manager (``with SnapshotView(filename) as view:``). Memory-mapped arrays remain 
+	valid after the view is closed.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	filename: str
+		Name of the snapshot file (or directory)
+	memmap: bool
+		If ``True``, contiguous fields are memory-mapped. If ``False``, HDF5 datasets are 
+		returned for HDF5 files, and other formats are read into memory.
+	"""
+
+	def __init__(self, filename, memmap = True):
+
+		self.filename = filename
+		self.memmap = memmap
+		self.fmt = detectFormat(filename)
+		self.attrs, self.fields, self.close_func = self.fmt.open(filename, memmap = memmap)
+
+		file_version = self.attrs['code']['file_version']
+		if ulula_utils.versionIsOlder(ulula_sim.file_version_oldest, file_version):
+			self.close()
+			raise Exception('Cannot open snapshot file %s because version %s is too old (allowed %s).' \
+						% (filename, file_version, ulula_sim.file_version_oldest))
+
+		self.t = float(self.attrs['run']['t'])
+		self.step = int(self.attrs['run']['step'])
+		self.nx = int(self.attrs['domain']['nx'])
+		self.ny = int(self.attrs['domain']['ny'])
+		self.dx = float(self.attrs['domain']['dx'])
+		self.xmin = float(self.attrs['domain']['xmin'])
+		self.ymin = float(self.attrs['domain']['ymin'])
+		self.x = self.xmin + (np.arange(self.nx) + 0.5) * self.dx
+		self.y = self.ymin + (np.arange(self.ny) + 0.5) * self.dx
+		self.q_list = list(self.fields.keys())
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def __getitem__(self, q):
+
+		if not q in self.q_list:
+			raise Exception('Field %s not found in snapshot file %s (available: %s).' \
+						% (q, self.filename, str(self.q_list)))
+		if self.fields is None:
+			raise Exception('Cannot access field %s because the view has been closed.' % (q))
+
+		return self.fields[q]
+
+	# ---------------------------------------------------------------------------------------------
+
+	def __enter__(self):
+
+		return self
+
+	# ---------------------------------------------------------------------------------------------
+
+	def __exit__(self, exc_type, exc_value, traceback):
+
+		self.close()
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def slices(self, box = None):
+		"""
+		Index ranges of the cells within a box
+
+		See :func:`boxSlices` for the parameters and return values.
+		"""
+
+		return boxSlices(self.x, self.y, box)
+
+	# ---------------------------------------------------------------------------------------------
+
+	def read(self, q, box = None):
+		"""
+		Read a field within a box
+
+		Only the data within the box are read from the file.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		q: str
+			Field name
+		box: array_like
+			Region given as (xmin, xmax, ymin, ymax) in code units (see :func:`boxSlices`)
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		data: array_like
+			Array with the values of the field in the box
+		"""
+
+		slc_x, slc_y = self.slices(box)
+		data = np.array(self[q][slc_x, slc_y])
+
+		return data
+
+	# ---------------------------------------------------------------------------------------------
+
+	def close(self):
+		"""
+		Close the file
+		"""
+
+		if self.fields is not None:
+			if self.close_func is not None:
+				self.close_func()
+			self.fields = None
+
+		return
+
+###################################################################################################
+
+def boxSlices(x, y, box = None):
+	"""
+	Index ranges of the cells within a box
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	x: array_like
+		Cell centers of the physical domain in x
+	y: array_like
+		Cell centers of the physical domain in y
+	box: array_like
+		Region given as (xmin, xmax, ymin, ymax) in code units; a cell is included if its center
+		lies within the box. If ``None``, the entire domain is returned.
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	slc_x: slice
+		Slice in the x-dimension of the fields
+	slc_y: slice
+		Slice in the y-dimension of the fields
+	"""
+
+	if box is None:
+		return slice(0, len(x)), slice(0, len(y))
+
+	ix = np.nonzero((x >= box[0]) & (x <= box[1]))[0]
+	iy = np.nonzero((y >= box[2]) & (y <= box[3]))[0]
+	if (len(ix) == 0) or (len(iy) == 0):
+		raise Exception('Box %s contains no cells of the domain.' % (str(box)))
+
+	return slice(ix[0], ix[-1] + 1), slice(iy[0], iy[-1] + 1)
+
+###################################################################################################
+
+class HDF5Format():
+	"""
+	Snapshot format based on HDF5 files
+
+	This is the standard format of Ulula snapshots (see :func:`~ulula.simulation.writeSnapshot`).
+	By default, the fields are stored contiguously and uncompressed, which is the fastest option
+	and allows memory-mapping. Compression reduces the file size at the expense of write speed; 
+	``lzf`` is much faster than ``gzip`` but compresses less. Shuffling typically improves the
+	compression of floating-point data. A chunk size is needed for compression and determines
+	the smallest block of data that is read from a compressed file.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	compression: str
+		Compression filter, ``gzip`` or ``lzf``; if ``None``, the data are not compressed
+	compression_opts: int
+		Compression level for ``gzip`` (0-9)
+	shuffle: bool
+		If ``True``, the bytes of the values are shuffled before compression
+	chunks: tuple
+		Chunk dimensions (in cells) of the fields; if ``None``, the fields are contiguous unless
+		they are compressed, in which case each field is one chunk
+	"""
+
+	name = 'hdf5'
+	extension = '.hdf5'
+
+	def __init__(self, compression = None, compression_opts = None, shuffle = False, chunks = None):
+
+		if not compression in [None, 'gzip', 'lzf']:
+			raise Exception('Unknown compression filter, %s (must be gzip or lzf).' % (str(compression)))
+
+		self.compression = compression
+		self.compression_opts = compression_opts
+		self.shuffle = shuffle
+		self.chunks = chunks
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	@staticmethod
+	def isFormat(filename):
+		"""
+		Whether a file is in this format
+		"""
+
+		return os.path.isfile(filename) and h5py.is_hdf5(filename)
+
+	# ---------------------------------------------------------------------------------------------
+
+	def write(self, filename, attrs, fields):
+		"""
+		Write a snapshot
+		
+		See :func:`~ulula.simulation.writeSnapshot` for the parameters.
+		"""
+
+		ulula_sim.writeSnapshot(filename, attrs, fields, compression = self.compression, 
+							compression_opts = self.compression_opts, shuffle = self.shuffle,
+							chunks = self.chunks)
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def open(self, filename, memmap = True):
+		"""
+		Open a snapshot for reading
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		filename: str
+			Name of the snapshot file
+		memmap: bool
+			If ``True``, contiguous uncompressed fields are memory-mapped; otherwise, the HDF5
+			datasets are returned
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		attrs: dict
+			Groups of attributes
+		fields: dict
+			Lazily loaded arrays of the fields
+		close_func: callable
+			Function that closes the file
+		"""
+
+		f = h5py.File(filename, 'r')
+		if 'series' in f:
+			f.close()
+			raise Exception('File %s is a snapshot series, use SnapshotSeries to read it.' % (filename))
+
+		attrs = {}
+		for group in f:
+			if group != 'grid':
+				attrs[group] = dict(f[group].attrs)
+
+		fields = {}
+		for q in f['grid']:
+			ds = f['grid'][q]
+			offset = ds.id.get_offset()
+			if memmap and (ds.chunks is None) and (ds.compression is None) and (offset is not None):
+				fields[q] = np.memmap(filename, mode = 'r', dtype = ds.dtype, offset = offset, 
+									shape = ds.shape)
+			else:
+				fields[q] = ds
+
+		return attrs, fields, f.close
+
+###################################################################################################
+
+class NpyFormat():
+	"""
+	Snapshot format based on a directory of raw numpy files
+
+	Each snapshot is a directory that contains one ``.npy`` file per field and the attributes in
+	a JSON file. Writing involves no compression, chunking, or library overhead beyond the
+	file system, which makes this the fastest format to write and read; all fields can be 
+	memory-mapped. The attribute file is written last, which means that a directory is only 
+	recognized as a snapshot once it is complete.
+	"""
+
+	name = 'npy'
+	extension = '.npydir'
+	attrs_file = 'attrs.json'
+
+	# ---------------------------------------------------------------------------------------------
+
+	@staticmethod
+	def isFormat(filename):
+		"""
+		Whether a file is in this format
+		"""
+
+		return os.path.isfile(os.path.join(filename, NpyFormat.attrs_file))
+
+	# ---------------------------------------------------------------------------------------------
+
+	def write(self, filename, attrs, fields):
+		"""
+		Write a snapshot
+		
+		See :func:`~ulula.simulation.writeSnapshot` for the parameters.
+		"""
+
+		if not os.path.exists(filename):
+			os.makedirs(filename)
+
+		for q in fields:
+			np.save(os.path.join(filename, '%s.npy' % (q)), np.ascontiguousarray(fields[q]))
+
+		meta = {}
+		meta['fields'] = list(fields.keys())
+		meta['attrs'] = {}
+		for group in attrs:
+			meta['attrs'][group] = {}
+			for k, v in attrs[group].items():
+				if isinstance(v, np.generic):
+					v = v.item()
+				meta['attrs'][group][k] = v
+		with open(os.path.join(filename, self.attrs_file), 'w') as f:
+			json.dump(meta, f, indent = 1)
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def open(self, filename, memmap = True):
+		"""
+		Open a snapshot for reading
+
+		See :func:`HDF5Format.open` for the parameters and return values. If ``memmap == False``,
+		the fields are read into memory.
+		"""
+
+		with open(os.path.join(filename, self.attrs_file), 'r') as f:
+			meta = json.load(f)
+
+		fields = {}
+		for q in meta['fields']:
+			fields[q] = np.load(os.path.join(filename, '%s.npy' % (q)), 
+							mmap_mode = 'r' if memmap else None)
+
+		return meta['attrs'], fields, None
+
+###################################################################################################
+
+# The available snapshot formats. The functions detectFormat() and snapshotFormat() consider the 
+# formats in this order.
+snapshot_formats = {'hdf5': HDF5Format, 'npy': NpyFormat}
+
+###################################################################################################
+
+def snapshotFormat(fmt, compression = None):
+	"""
+	Create a snapshot format object
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	fmt: str or object
+		Name of a format in ``snapshot_formats``, or a format object, which is returned unchanged.
+		Any object with the ``extension`` attribute and the ``write`` and ``open`` functions of
+		:class:`HDF5Format` can be used.
+	compression: str
+		Compression filter; only allowed for the HDF5 format, where it also turns on shuffling
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	fmt: object
+		Format object
+	"""
+
+	if not isinstance(fmt, str):
+		return fmt
+	if not fmt in snapshot_formats:
+		raise Exception('Unknown snapshot format, %s (must be one of %s).' % (fmt, str(list(snapshot_formats.keys()))))
+
+	if fmt == 'hdf5':
+		fmt_obj = HDF5Format(compression = compression, shuffle = (compression is not None))
+	else:
+		if compression is not None:
+			raise Exception('The %s snapshot format does not support compression.' % (fmt))
+		fmt_obj = snapshot_formats[fmt]()
+
+	return fmt_obj
+
+###################################################################################################
+
+def detectFormat(filename):
+	"""
+	Determine the format of a snapshot file
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	filename: str
+		Name of the snapshot file (or directory)
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	fmt: object
+		Format object
+	"""
+
+	if not os.path.exists(filename):
+		raise Exception('Snapshot file %s not found.' % (filename))
+	for cls in snapshot_formats.values():
+		if cls.isFormat(filename):
+			return cls()
+
+	raise Exception('File %s is not a snapshot in any of the formats %s.' \
+				% (filename, str(list(snapshot_formats.keys()))))
+
+###################################################################################################
@@ -66,6 +66,13 @@ def getPlotQuantities(sim, q_plot):
                 % (str(q), str(list(fields.keys())))
             )
 
+    # After a timestep, the ghost cells are out of date. Refreshing them does not change the
+    # physical domain, which means that the stored CFL timestep remains valid.
+    if len(sim.bc_stale) > 0:
+        dt_cfl = sim.dt_cfl
+        sim.enforceBoundaryConditions()
+        sim.dt_cfl = dt_cfl
+
     nq = len(q_plot)
     q_array = np.zeros(
         (nq, sim.nx + 2 * sim.nghost, sim.ny + 2 * sim.nghost), np.float64
@@ -0,0 +1,317 @@
+###################################################################################################
+#
+# Ulula -- riemann.py
+#
+# Exact solution of the Riemann problem for an ideal gas
+#
+# by Benedikt Diemer
+#
+###################################################################################################
+
+import numpy as np
+import functools
+
+###################################################################################################
+
+# The solution follows Toro 2009 (Riemann Solvers and Numerical Methods for Fluid Dynamics),
+# Chapter 4. All functions operate on arrays of Riemann problems (e.g., one per interface), which
+# are solved simultaneously. Scalar inputs are treated as arrays with one element.
+
+###################################################################################################
+
+def pressureFunction(p, rho_K, p_K, cs_K, gamma):
+	"""
+	Velocity jump across a wave as a function of the pressure behind it
+
+	For a given pressure in the star region, the wave that separates it from the initial state K
+	is a shock if the pressure is larger than p_K and a rarefaction otherwise. The function gives
+	the change in velocity across the wave (Toro 2009, Eqs. 4.6 and 4.7), and its derivative is
+	used in the Newton iteration.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	p: array_like
+		Pressure in the star region
+	rho_K: array_like
+		Density of the initial state
+	p_K: array_like
+		Pressure of the initial state
+	cs_K: array_like
+		Sound speed of the initial state
+	gamma: float
+		Adiabatic index
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	f: array_like
+		Pressure function
+	df: array_like
+		Derivative of the pressure function with respect to the star pressure
+	"""
+
+	is_shock = (p > p_K)
+
+	# Shock
+	A = 2.0 / ((gamma + 1.0) * rho_K)
+	B = (gamma - 1.0) / (gamma + 1.0) * p_K
+	sqrt_term = np.sqrt(A / (p + B))
+	f = (p - p_K) * sqrt_term
+	df = sqrt_term * (1.0 - 0.5 * (p - p_K) / (p + B))
+
+	# Rarefaction
+	ratio = p / p_K
+	f_rare = 2.0 * cs_K / (gamma - 1.0) * (ratio**(0.5 * (gamma - 1.0) / gamma) - 1.0)
+	df_rare = ratio**(-0.5 * (gamma + 1.0) / gamma) / (rho_K * cs_K)
+	np.copyto(f, f_rare, where = ~is_shock)
+	np.copyto(df, df_rare, where = ~is_shock)
+
+	return f, df
+
+###################################################################################################
+
+def starState(rho_L, u_L, p_L, rho_R, u_R, p_R, gamma, tol = 1E-10, max_iter = 50):
+	"""
+	Pressure and velocity in the star region between the outer waves
+
+	The star pressure is the root of fL(p) + fR(p) + uR - uL (see :func:`pressureFunction`),
+	which we find by a Newton iteration on all Riemann problems at once. The function is
+	monotonically increasing and concave, so that the iteration converges monotonically once an
+	iterate lies below the root. We start from the two-rarefaction approximation (Toro 2009,
+	Eq. 4.46), which is exact if both waves are rarefactions and otherwise typically converges in
+	a few iterations. Each problem is iterated until the relative change in its pressure is below
+	``tol``. The computation is carried out in double precision.
+
+	If the initial states move apart fast enough, the rarefactions create a vacuum. In that case,
+	the star pressure is zero, and the star velocity is undefined; we return zero for both (see
+	:func:`sampleSolution` for the treatment of the vacuum).
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	rho_L: array_like
+		Density of the left state
+	u_L: array_like
+		Velocity of the left state (normal to the discontinuity)
+	p_L: array_like
+		Pressure of the left state
+	rho_R: array_like
+		Density of the right state
+	u_R: array_like
+		Velocity of the right state
+	p_R: array_like
+		Pressure of the right state
+	gamma: float
+		Adiabatic index
+	tol: float
+		Relative tolerance in pressure
+	max_iter: int
+		Maximum number of iterations; if exceeded, an exception is raised.
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	p_star: array_like
+		Pressure in the star region
+	u_star: array_like
+		Velocity in the star region
+	"""
+
+	states = [rho_L, u_L, p_L, rho_R, u_R, p_R]
+	rho_L, u_L, p_L, rho_R, u_R, p_R = [np.asarray(q, dtype = np.float64) for q in states]
+	cs_L = np.sqrt(gamma * p_L / rho_L)
+	cs_R = np.sqrt(gamma * p_R / rho_R)
+	du = u_R - u_L
+	vacuum = (2.0 / (gamma - 1.0) * (cs_L + cs_R) <= du)
+
+	# Initial guess from the two-rarefaction approximation. It is (close to) zero if the states
+	# (almost) create a vacuum, so we limit it to a small fraction of the smaller input pressure.
+	z = 0.5 * (gamma - 1.0) / gamma
+	num = np.maximum(cs_L + cs_R - 0.5 * (gamma - 1.0) * du, 0.0)
+	p_min = tol * np.minimum(p_L, p_R)
+	p = np.maximum((num / (cs_L / p_L**z + cs_R / p_R**z))**(1.0 / z), p_min)
+	np.copyto(p, p_L, where = vacuum)
+
+	# Each problem is updated until it has converged, so that its result does not depend on the
+	# other problems in the array
+	active = ~vacuum
+	n_iter = 0
+	while np.any(active):
+		if n_iter == max_iter:
+			raise Exception('Exact Riemann solver did not converge after %d iterations.' % (max_iter))
+		fL, dfL = pressureFunction(p, rho_L, p_L, cs_L, gamma)
+		fR, dfR = pressureFunction(p, rho_R, p_R, cs_R, gamma)
+		p_new = np.maximum(p - (fL + fR + du) / (dfL + dfR), p_min)
+		change = np.abs(p_new - p) / (p_new + p)
+		np.copyto(p, p_new, where = active)
+		active &= (change >= 0.5 * tol)
+		n_iter += 1
+
+	fL, _ = pressureFunction(p, rho_L, p_L, cs_L, gamma)
+	fR, _ = pressureFunction(p, rho_R, p_R, cs_R, gamma)
+	u = 0.5 * (u_L + u_R) + 0.5 * (fR - fL)
+	p[vacuum] = 0.0
+	u[vacuum] = 0.0
+
+	return p, u
+
+###################################################################################################
+
+@functools.lru_cache(maxsize = 256)
+def starStateCached(rho_L, u_L, p_L, rho_R, u_R, p_R, gamma):
+	"""
+	Star state of a single Riemann problem, cached by the input states
+
+	Reference solutions of setups need the star state of the same Riemann problem each time they
+	are plotted or compared, which this function computes only once. See :func:`starState` for
+	the parameters, which must be floats here.
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	p_star: float
+		Pressure in the star region
+	u_star: float
+		Velocity in the star region
+	"""
+
+	p, u = starState(np.array([rho_L]), np.array([u_L]), np.array([p_L]), np.array([rho_R]),
+					np.array([u_R]), np.array([p_R]), gamma)
+
+	return float(p[0]), float(u[0])
+
+###################################################################################################
+
+def sampleSolution(s, rho_L, u_L, p_L, rho_R, u_R, p_R, gamma, p_star, u_star):
+	"""
+	Solution of the Riemann problem at given speeds
+
+	The solution is self-similar, i.e., it depends only on the speed s = (x - x0) / t. Left of
+	the contact, which moves with the star velocity, the solution is either the left state, the
+	star state behind a left shock, or the star state behind or the inside of a left
+	rarefaction fan (Toro 2009, Section 4.5); the right side is analogous. If the initial states
+	create a vacuum, the two rarefaction fans are separated by a vacuum instead of a contact
+	(Toro 2009, Section 4.7).
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	s: array_like
+		Speeds at which the solution is evaluated; must have the same shape as the states or be
+		broadcastable to it
+	rho_L, u_L, p_L, rho_R, u_R, p_R: array_like
+		Initial states (see :func:`starState`)
+	gamma: float
+		Adiabatic index
+	p_star: array_like
+		Star pressure computed by :func:`starState`
+	u_star: array_like
+		Star velocity computed by :func:`starState`
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	rho: array_like
+		Density
+	u: array_like
+		Velocity
+	p: array_like
+		Pressure
+	"""
+
+	gm1 = gamma - 1.0
+	gp1 = gamma + 1.0
+	gmr = gm1 / gp1
+	z = 0.5 * gm1 / gamma
+
+	s, rho_L, u_L, p_L, rho_R, u_R, p_R, p_star, u_star = np.broadcast_arrays(s, rho_L, u_L, p_L,
+												rho_R, u_R, p_R, p_star, u_star)
+	cs_L = np.sqrt(gamma * p_L / rho_L)
+	cs_R = np.sqrt(gamma * p_R / rho_R)
+
+	# Fans of the left and right rarefactions (Toro 2009, Eqs. 4.56 and 4.63), evaluated
+	# everywhere and used only where needed
+	with np.errstate(invalid = 'ignore', divide = 'ignore', over = 'ignore'):
+		u_fan_L = 2.0 / gp1 * (cs_L + 0.5 * gm1 * u_L + s)
+		c_fan_L = np.maximum(2.0 / gp1 * (cs_L + 0.5 * gm1 * (u_L - s)), 0.0)
+		u_fan_R = 2.0 / gp1 * (-cs_R + 0.5 * gm1 * u_R + s)
+		c_fan_R = np.maximum(2.0 / gp1 * (cs_R - 0.5 * gm1 * (u_R - s)), 0.0)
+		rho_fan_L = rho_L * (c_fan_L / cs_L)**(2.0 / gm1)
+		p_fan_L = p_L * (c_fan_L / cs_L)**(1.0 / z)
+		rho_fan_R = rho_R * (c_fan_R / cs_R)**(2.0 / gm1)
+		p_fan_R = p_R * (c_fan_R / cs_R)**(1.0 / z)
+
+		# Star densities behind a shock or rarefaction
+		pr_L = p_star / p_L
+		pr_R = p_star / p_R
+		rho_star_L = np.where(p_star > p_L, rho_L * (pr_L + gmr) / (gmr * pr_L + 1.0), rho_L * pr_L**(1.0 / gamma))
+		rho_star_R = np.where(p_star > p_R, rho_R * (pr_R + gmr) / (gmr * pr_R + 1.0), rho_R * pr_R**(1.0 / gamma))
+
+		# Speeds of the waves. For a shock, the head and tail of the wave coincide.
+		S_shock_L = u_L - cs_L * np.sqrt((gp1 * pr_L + gm1) / (2.0 * gamma))
+		S_shock_R = u_R + cs_R * np.sqrt((gp1 * pr_R + gm1) / (2.0 * gamma))
+		S_head_L = np.where(p_star > p_L, S_shock_L, u_L - cs_L)
+		S_tail_L = np.where(p_star > p_L, S_shock_L, u_star - cs_L * pr_L**z)
+		S_head_R = np.where(p_star > p_R, S_shock_R, u_R + cs_R)
+		S_tail_R = np.where(p_star > p_R, S_shock_R, u_star + cs_R * pr_R**z)
+
+	# In a vacuum, the tails of the fans are at the speeds where the sound speed vanishes, and the
+	# vacuum between them takes the place of the contact
+	vacuum = (2.0 / gm1 * (cs_L + cs_R) <= u_R - u_L)
+	left_side = (s <= u_star)
+	if np.any(vacuum):
+		np.copyto(S_tail_L, u_L + 2.0 * cs_L / gm1, where = vacuum)
+		np.copyto(S_tail_R, u_R - 2.0 * cs_R / gm1, where = vacuum)
+		np.copyto(left_side, s <= 0.5 * (S_tail_L + S_tail_R), where = vacuum)
+
+	# Start with the star state and overwrite it with the fans and the initial states
+	rho = np.where(left_side, rho_star_L, rho_star_R)
+	u = u_star.copy()
+	p = p_star.copy()
+	for m, fan_vals in [(left_side & (s > S_head_L) & (s < S_tail_L), (rho_fan_L, u_fan_L, p_fan_L)),
+						(~left_side & (s < S_head_R) & (s > S_tail_R), (rho_fan_R, u_fan_R, p_fan_R)),
+						(left_side & (s <= S_head_L), (rho_L, u_L, p_L)),
+						(~left_side & (s >= S_head_R), (rho_R, u_R, p_R))]:
+		np.copyto(rho, fan_vals[0], where = m)
+		np.copyto(u, fan_vals[1], where = m)
+		np.copyto(p, fan_vals[2], where = m)
+
+	# The vacuum between the tails of the fans
+	if np.any(vacuum):
+		m = vacuum & (s >= S_tail_L) & (s <= S_tail_R)
+		rho[m] = 0.0
+		p[m] = 0.0
+		u[m] = s[m]
+
+	return rho, u, p
+
+###################################################################################################
+
+def exactSolution(s, rho_L, u_L, p_L, rho_R, u_R, p_R, gamma):
+	"""
+	Solution of a single Riemann problem at given speeds
+
+	This function is meant for the reference solutions of test setups. The star state is
+	computed only once for a given set of initial states (see :func:`starStateCached`).
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	s: array_like
+		Speeds (x - x0) / t at which the solution is evaluated
+	rho_L, u_L, p_L, rho_R, u_R, p_R: float
+		Initial states (see :func:`starState`)
+	gamma: float
+		Adiabatic index
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	rho: array_like
+		Density, with the same dimensions as ``s``
+	u: array_like
+		Velocity normal to the discontinuity
+	p: array_like
+		Pressure
+	"""
+
+	p_star, u_star = starStateCached(float(rho_L), float(u_L), float(p_L), float(rho_R),
+									float(u_R), float(p_R), float(gamma))
+	rho, u, p = sampleSolution(np.asarray(s, dtype = float), rho_L, u_L, p_L, rho_R, u_R, p_R,
+							gamma, p_star, u_star)
+
+	return rho, u, p
+
+###################################################################################################
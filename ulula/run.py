@@ -20,6 +20,10 @@ import math
 
 import ulula.simulation as ulula_sim
 import ulula.plots as ulula_plots
+import ulula.decomposition as ulula_decomp
+import ulula.amr as ulula_amr
+import ulula.cache as ulula_cache
+import ulula.output as ulula_output
 
 ###################################################################################################
 
@@ -31,10 +35,19 @@ def run(
     tmax=1.0,
     max_steps=None,
     print_step=100,
+    n_procs=1,
+    nest_boxes=None,
+    nest_block_size=8,
     restart_file=None,
+    checkpoint_step=None,
     output_step=None,
     output_time=None,
     output_suffix="",
+    output_async=False,
+    output_series=False,
+    output_format="hdf5",
+    output_compression=None,
+    output_precision=None,
     plot_step=None,
     plot_time=None,
     plot_ics=True,
@@ -48,6 +61,8 @@ def run(
     movie_length=4.0,
     movie_fps=25,
     movie_dpi=200,
+    cache_dir=None,
+    cache_size=None,
     **kwargs
 ):
     """
@@ -75,9 +90,34 @@ def run(
             a time ``tmax``.
     print_step: int
             Print a line to the console every ``print_step`` timesteps.
+    n_procs: int
+            Number of processes. If larger than one, the domain is divided into tiles that are
+            advanced by separate worker processes (see :doc:`simulation`). The results are
+            identical to a serial run. Note that the timing printed at the end counts only the CPU
+            time of the main process.
+    nest_boxes: array_like
+            If not ``None``, a list of regions that are covered by static nested grids, each given
+            as a tuple (xmin, xmax, ymin, ymax) in code units. In that case, ``nx`` is the
+            resolution of the nested grids, and the rest of the domain is covered by a grid with
+            half the resolution. The nested grids take two substeps per timestep of the coarse
+            grid (see :doc:`simulation`). Snapshots and plots show the combined state at the fine
+            resolution. Cannot be combined with ``n_procs > 1``.
+    nest_block_size: int
+            Size of the blocks (in coarse cells) to which the nested grids are aligned; each box
+            is covered by the smallest range of blocks that contains it, and the boxes must not
+            overlap after this alignment (only active if ``nest_boxes`` is given).
     restart_file: str
             If not ``None``, the simulation is loaded from this filename and restarted at the step
-            where it was saved. The setup is ignored.
+            where it was saved. The setup is ignored. If the file is a checkpoint (see
+            ``checkpoint_step``), the run continues exactly as if it had not been interrupted.
+    checkpoint_step: int
+            Write a checkpoint every ``checkpoint_step`` timesteps and at the end of the run. The
+            checkpoint file, ``ulula_checkpoint<output_suffix>.hdf5``, is overwritten each time.
+            Besides the exact state of the simulation (see
+            :func:`~ulula.simulation.Simulation.saveCheckpoint`), it contains the times of the
+            next outputs, plots, and movie frames and the number of the next frame. When a run is
+            restarted from the checkpoint with the same parameters, it produces the same files
+            and final state as an uninterrupted run. Cannot be combined with ``nest_boxes``.
     output_step: int
             Output a snapshot/restart file every ``output_step`` timesteps. Note that this spacing
             probably does not correspond to fixed times. If the latter is desired, use
@@ -89,6 +129,27 @@ def run(
             to arrive at the desired times are not used for the actual simulation.
     output_suffix: string
             String to add to all output filenames.
+    output_async: bool
+            If ``True``, snapshot files are written by a background thread while the simulation
+            continues (see :class:`~ulula.output.SnapshotWriter`). The files are identical to
+            those written synchronously; all files have been written when this function returns.
+    output_series: bool
+            If ``True``, the snapshots are appended to a single file per type of output instead
+            of being written to separate files: ``ulula_step_series<output_suffix>.hdf5`` for
+            the outputs at given steps and ``ulula_time_series<output_suffix>.hdf5`` for those at
+            given times. These files can be read with :class:`~ulula.output.SnapshotSeries`.
+            When restarting from a file, the snapshots are appended to existing series files.
+    output_format: str or object
+            Format of the snapshot files, ``hdf5`` or ``npy`` (a directory of raw numpy files
+            that is fastest to write and read), or a format object (see
+            :func:`~ulula.output.snapshotFormat`). Series files are always in HDF5 format.
+    output_compression: str
+            Compression filter for HDF5 snapshot and series files, ``gzip`` or ``lzf``. When
+            compression is on, the bytes of the values are shuffled before compressing them.
+    output_precision: str
+            Precision in which the fields are stored in series files, e.g., ``float32`` (only
+            active if ``output_series == True``). If ``None``, the precision of the simulation is
+            used.
     plot_step: int
             Produce a plot every ``plot_step`` timesteps. Note that this spacing probably does not
             correspond to fixed times. If the latter is desired, use ``plot_time``. Both ``plot_step``
@@ -127,6 +188,19 @@ def run(
             Framerate of the movie (25 is typical)
     movie_dpi: int
             Resolution of the png files used to create the movie (see ``plot_dpi``)
+    cache_dir: str
+            If not ``None``, results are cached in this directory (see
+            :class:`~ulula.cache.ResultCache`). If a run with the same setup, hydro scheme,
+            resolution, final time, and output schedule has been cached, its output files, plots,
+            and movie are re-created from the cached states and its final state is returned
+            without running the simulation. If only ``tmax`` is larger than in a cached run, the
+            run is continued from the latest cached state (unless ``max_steps``, ``movie``, or
+            ``nest_boxes`` are used). The result is identical to a run without the cache. Cannot
+            be combined with ``restart_file``.
+    cache_size: float
+            Maximum size of the cache in bytes; the least recently used entries are removed when
+            it is exceeded. If ``None``, the size is not limited (only active if ``cache_dir`` is
+            given).
     kwargs: kwargs
             Additional arguments that are passed to the Ulula plotting function (either 1D or 2D,
             depending on the ``plot1d`` parameter).
@@ -177,19 +251,32 @@ def run(
 
     # ---------------------------------------------------------------------------------------------
 
-    # Perform step-based saving and plotting operations
+    # Nested grids are plotted as the combined state at the fine resolution
 
-    def checkOutputStep(sim, final_step=False):
+    def plotSim(sim):
 
-        if (output_step is not None) and (sim.step % output_step == 0):
-            sim.save(filename="ulula_step_%04d%s.hdf5" % (sim.step, output_suffix))
+        if isinstance(sim, ulula_amr.AMRSimulation):
+            sim = sim.uniformSimulation()
 
-        if (
-            (plot_step is not None)
-            and ((sim.step % plot_step == 0) or final_step)
-            and not ((sim.step == 0) and (plot_ics == False))
-        ):
-            plotFunction(sim, **plot_kwargs)
+        return sim
+
+    # Perform an output operation: save a snapshot file or create a plot or movie frame, either
+    # at a given step or at a given time. If the run is cached, the state of the simulation is
+    # recorded so that the operation can be repeated when the run is loaded from the cache.
+
+    def performEvent(kind, sim, final_step=False, record=True):
+
+        nonlocal step_movie
+
+        if kind == "output_step":
+            sim.save(
+                filename="ulula_step_%04d%s%s" % (sim.step, output_suffix, fmt.extension),
+                writer=writers["step"],
+                fmt=fmt,
+            )
+
+        elif kind == "plot_step":
+            plotFunction(plotSim(sim), **plot_kwargs)
             if save_plots:
                 print(plot_dir)
                 plt.savefig(
@@ -201,6 +288,70 @@ def run(
             else:
                 plt.show()
 
+        elif kind == "output_time":
+            sim.save(
+                filename="ulula_time_%.4f%s%s" % (sim.t, output_suffix, fmt.extension),
+                writer=writers["time"],
+                fmt=fmt,
+            )
+
+        elif kind == "plot_time":
+            plotFunction(plotSim(sim), **plot_kwargs)
+            if save_plots:
+                plt.savefig(
+                    plot_dir
+                    + "/ulula_%s_time_%.4f%s.%s"
+                    % (setup_name, sim.t, plot_suffix, plot_file_ext),
+                    dpi=plot_dpi,
+                )
+                plt.close()
+            else:
+                plt.show()
+
+        elif kind == "movie":
+            plotFunction(plotSim(sim), **plot_kwargs)
+            plt.savefig("frame_%04d.png" % (step_movie), dpi=movie_dpi)
+            plt.close()
+            step_movie += 1
+
+        else:
+            raise Exception("Unknown output operation, %s." % (kind))
+
+        if record and (cache_entry is not None):
+            cache.recordEvent(cache_entry, kind, sim, final_step=final_step)
+
+        return
+
+    # Perform step-based saving and plotting operations
+
+    def checkOutputStep(sim, final_step=False):
+
+        if (output_step is not None) and (sim.step % output_step == 0):
+            performEvent("output_step", sim, final_step=final_step)
+
+        if (
+            (plot_step is not None)
+            and ((sim.step % plot_step == 0) or final_step)
+            and not ((sim.step == 0) and (plot_ics == False))
+        ):
+            performEvent("plot_step", sim, final_step=final_step)
+
+        return
+
+    # Combine the movie frames into a movie file
+
+    def renderMovie():
+
+        cmd_str = "ffmpeg -i frame_%04d.png -pix_fmt yuv420p -y"
+        cmd_str += " -framerate %d" % (movie_fps)
+        cmd_str += " ulula_%s%s.mp4" % (setup_name, plot_suffix)
+        subprocess.run(cmd_str, shell=True)
+        for frame in glob.glob("frame*.png"):
+            try:
+                os.remove(frame)
+            except OSError:
+                pass
+
         return
 
     # Compute the next time when a certain operation needs to happen given the current time and the
@@ -216,6 +367,42 @@ def run(
 
         return next_time
 
+    # When restarting from a checkpoint, the next time of an operation is taken from the
+    # checkpoint if the interval has not changed. Otherwise, it is computed from the current time.
+
+    def restartTime(sim, run_state, kind, interval):
+
+        if (interval is not None) and (run_state.get("%s_time" % (kind)) == interval):
+            next_time = run_state["next_time_%s" % (kind)]
+        else:
+            next_time = nextTime(sim, interval)
+
+        return next_time
+
+    # Write a checkpoint with the state of the simulation and the output schedule. Snapshots that
+    # are still being written in the background are finished first, so that a run restarted
+    # from the checkpoint does not miss any of them.
+
+    def writeCheckpoint(sim):
+
+        for out_type in ["step", "time"]:
+            if writers[out_type] is not None:
+                writers[out_type].flush()
+        run_state = dict(
+            output_time=output_time,
+            next_time_output=next_time_output,
+            plot_time=plot_time,
+            next_time_plot=next_time_plot,
+            movie_time=movie_time,
+            next_time_movie=next_time_movie,
+            step_movie=step_movie,
+        )
+        sim.saveCheckpoint(
+            filename="ulula_checkpoint%s.hdf5" % (output_suffix), run_state=run_state
+        )
+
+        return
+
     # If a particular operation needs to happen at t_next and that time is within the next
     # timestep, we need to return the simulation at time t_next. To avoid messing with the actual
     # simulation run by inserting an artificially small timestep, we copy the entire simulation
@@ -234,7 +421,7 @@ def run(
             if abs(dt_needed) < 1e-7 * tmax:
                 sim_copy = sim
             else:
-                sim_copy = copy.copy(sim)
+                sim_copy = copy.deepcopy(sim)
                 sim_copy.timestep(dt=dt_needed)
         else:
             sim_copy = None
@@ -243,19 +430,124 @@ def run(
 
     # ---------------------------------------------------------------------------------------------
 
+    # If the cache is used, we look for a cached run with the same parameters. If there is one,
+    # we repeat its output operations from the cached states and return its final state. If not,
+    # we look for the latest cached state of the same run at an earlier time and continue from
+    # there, starting with the output operations up to that time. The hash of the parameters
+    # excluding tmax identifies such earlier states.
+    sim = None
+    cache = None
+    cache_entry = None
+
+    # If desired, snapshots are collected into series files and/or written in the background. The
+    # writers must be closed before the function returns, which waits for the remaining files.
+    if output_series:
+        fmt = ulula_output.snapshotFormat("hdf5")
+    else:
+        fmt = ulula_output.snapshotFormat(output_format, compression=output_compression)
+    writers = {}
+    for out_type in ["step", "time"]:
+        if output_series:
+            writers[out_type] = ulula_output.SnapshotSeriesWriter(
+                "ulula_%s_series%s.hdf5" % (out_type, output_suffix),
+                append=(restart_file is not None),
+                compression=output_compression,
+                precision=output_precision,
+                background=output_async,
+            )
+        elif output_async:
+            if not "step" in writers:
+                writers[out_type] = ulula_output.SnapshotWriter(write_func=fmt.write)
+            else:
+                writers[out_type] = writers["step"]
+        else:
+            writers[out_type] = None
+
+    def closeWriters():
+        for out_type in ["step", "time"]:
+            if writers[out_type] is not None:
+                writers[out_type].close()
+        return
+
+    if cache_dir is not None:
+        if restart_file is not None:
+            raise Exception("A restart file cannot be combined with the result cache.")
+        if hydro_scheme is None:
+            hydro_scheme = ulula_sim.HydroScheme()
+        cache = ulula_cache.ResultCache(cache_dir, max_size=cache_size)
+        cache_pars = dict(
+            code_version=ulula_cache.codeVersion(),
+            setup=setup,
+            hydro_scheme=hydro_scheme,
+            nx=nx,
+            max_steps=max_steps,
+            nest_boxes=nest_boxes,
+            nest_block_size=nest_block_size,
+            output_step=output_step,
+            output_time=output_time,
+            plot_step=plot_step,
+            plot_time=plot_time,
+            plot_ics=plot_ics,
+            movie=movie,
+            movie_length=movie_length,
+            movie_fps=movie_fps,
+        )
+        cache_lineage = cache.key(cache_pars)
+        cache_pars["tmax"] = tmax
+        cache_key = cache.key(cache_pars)
+
+        entry = cache.lookup(cache_key)
+        if entry is not None:
+            print("Loading run from cache entry %s." % (cache_key[:12]))
+            for ev in entry["events"]:
+                if not ev["final_step"]:
+                    performEvent(ev["kind"], cache.loadState(entry, ev["file"]), record=False)
+            if movie:
+                renderMovie()
+            for ev in entry["events"]:
+                if ev["final_step"]:
+                    performEvent(ev["kind"], cache.loadState(entry, ev["file"]), record=False)
+            closeWriters()
+            return cache.loadState(entry, "final.pkl")
+
+        events = None
+        if (max_steps is None) and (not movie) and (nest_boxes is None):
+            entry = cache.lookupResumable(cache_lineage, tmax)
+            if entry is not None:
+                print(
+                    "Continuing from cache entry %s at t = %.2e."
+                    % (entry["key"][:12], entry["t"])
+                )
+                events = [ev for ev in entry["events"] if not ev["final_step"]]
+                for ev in events:
+                    performEvent(ev["kind"], cache.loadState(entry, ev["file"]), record=False)
+                sim = cache.loadState(entry, "final.pkl")
+                next_time_output = entry["schedule"]["next_time_output"]
+                next_time_plot = entry["schedule"]["next_time_plot"]
+        cache_entry = cache.beginEntry(
+            cache_key, cache_lineage, cache_pars, events=events, from_entry=entry
+        )
+
     # If a restart file is given, we load it and start the simulation from the respective snapshot.
+    # A checkpoint also restores the output schedule.
     if restart_file is not None:
-        sim = ulula_sim.load(restart_file)
+        if ulula_sim.isCheckpoint(restart_file):
+            sim, run_state = ulula_sim.loadCheckpoint(restart_file)
+        else:
+            sim = ulula_sim.load(restart_file)
+            run_state = {}
         if sim.t >= tmax:
             raise Exception(
                 "The final time tmax (%.2e) must be greater than the time in the restart file (%.2e)."
                 % (tmax, sim.t)
             )
-        next_time_output = nextTime(sim, output_time)
-        next_time_plot = nextTime(sim, plot_time)
-        next_time_movie = nextTime(sim, movie_time)
+        next_time_output = restartTime(sim, run_state, "output", output_time)
+        next_time_plot = restartTime(sim, run_state, "plot", plot_time)
+        next_time_movie = restartTime(sim, run_state, "movie", movie_time)
+        if movie and (run_state.get("movie_time") == movie_time):
+            step_movie = run_state["step_movie"]
 
-    else:
+    elif sim is None:
         # Create simulation object and set initial conditions
         if hydro_scheme is None:
             hydro_scheme = ulula_sim.HydroScheme()
@@ -272,66 +564,83 @@ def run(
         if movie_time is not None:
             next_time_movie = 0.0
 
+    # Distribute the simulation over multiple processes or refine parts of the domain if desired
+    if (n_procs > 1) and (nest_boxes is not None):
+        raise Exception("Nested grids cannot be combined with multiple processes.")
+    if (checkpoint_step is not None) and (nest_boxes is not None):
+        raise Exception("Checkpoints cannot be combined with nested grids.")
+    if n_procs > 1:
+        sim = ulula_decomp.DecomposedSimulation(sim, n_procs)
+    if nest_boxes is not None:
+        sim = ulula_amr.NestedSimulation(sim, nest_boxes, block_size=nest_block_size)
+
     # Main loop over timesteps. We record the starting timestep as it may not be zero if we
     # are restarting from a file.
     t0 = time.process_time()
     step_start = sim.step
 
-    while sim.t < tmax:
-
-        # Compute timestep. Before we actually do the timestep, we need to check whether we need to
-        # output or plot the simulation at a particular time during this timestep.
-        dt = sim.cflCondition()
-
-        # Check whether we need to output a snapshot file during the next timestep
-        do_output, sim_copy = getSimAtTime(sim, dt, next_time_output)
-        if do_output:
-            sim_copy.save(
-                filename="ulula_time_%.4f%s.hdf5" % (sim_copy.t, output_suffix)
-            )
-
-        # Check whether we need to create a plot during the next timestep
-        do_plot, sim_copy = getSimAtTime(sim, dt, next_time_plot)
-        if do_plot:
-            plotFunction(sim_copy, **plot_kwargs)
-            if save_plots:
-                plt.savefig(
-                    plot_dir
-                    + "/ulula_%s_time_%.4f%s.%s"
-                    % (setup_name, sim_copy.t, plot_suffix, plot_file_ext),
-                    dpi=plot_dpi,
-                )
-                plt.close()
-            else:
-                plt.show()
-
-        # Check whether we need to output a movie frame during the next timestep
-        do_movie, sim_copy = getSimAtTime(sim, dt, next_time_movie)
-        if do_movie:
-            plotFunction(sim_copy, **plot_kwargs)
-            plt.savefig("frame_%04d.png" % (step_movie), dpi=movie_dpi)
-            plt.close()
-            step_movie += 1
-
-        # Perform the actual timestep
-        sim.timestep(dt=dt)
-        if sim.step % print_step == 0:
-            print("Timestep %5d, dt = %.2e, t = %.2e" % (sim.step, dt, sim.t))
-
-        # Set the next times for output/plotting/movie frames
-        if do_output:
-            next_time_output = nextTime(sim, output_time)
-        if do_plot:
-            next_time_plot = nextTime(sim, plot_time)
-        if do_movie:
-            next_time_movie = nextTime(sim, movie_time)
-
-        # Save and/or plot at this step if necessary
-        checkOutputStep(sim)
-
-        # Check for abort conditions
-        if (max_steps is not None) and (sim.step >= max_steps):
-            break
+    # If the run fails, the incomplete cache entry is discarded and the writer is stopped
+    try:
+        while sim.t < tmax:
+
+            # Compute timestep. Before we actually do the timestep, we need to check whether we need to
+            # output or plot the simulation at a particular time during this timestep.
+            dt = sim.cflCondition()
+
+            # Check whether we need to output a snapshot file during the next timestep
+            do_output, sim_copy = getSimAtTime(sim, dt, next_time_output)
+            if do_output:
+                performEvent("output_time", sim_copy)
+
+            # Check whether we need to create a plot during the next timestep
+            do_plot, sim_copy = getSimAtTime(sim, dt, next_time_plot)
+            if do_plot:
+                performEvent("plot_time", sim_copy)
+
+            # Check whether we need to output a movie frame during the next timestep
+            do_movie, sim_copy = getSimAtTime(sim, dt, next_time_movie)
+            if do_movie:
+                performEvent("movie", sim_copy)
+
+            # Perform the actual timestep
+            sim.timestep(dt=dt)
+            if sim.step % print_step == 0:
+                print("Timestep %5d, dt = %.2e, t = %.2e" % (sim.step, dt, sim.t))
+
+            # Set the next times for output/plotting/movie frames
+            if do_output:
+                next_time_output = nextTime(sim, output_time)
+            if do_plot:
+                next_time_plot = nextTime(sim, plot_time)
+            if do_movie:
+                next_time_movie = nextTime(sim, movie_time)
+
+            # Save and/or plot at this step if necessary
+            checkOutputStep(sim)
+
+            # Write a checkpoint at this step if necessary
+            if (checkpoint_step is not None) and (sim.step % checkpoint_step == 0):
+                writeCheckpoint(sim)
+
+            # Check for abort conditions
+            if (max_steps is not None) and (sim.step >= max_steps):
+                break
+
+        # Write a checkpoint of the final state unless one was just written
+        if (checkpoint_step is not None) and (sim.step % checkpoint_step != 0):
+            writeCheckpoint(sim)
+    except BaseException:
+        if cache_entry is not None:
+            cache.abortEntry(cache_entry)
+        try:
+            closeWriters()
+        except Exception:
+            pass
+        raise
+
+    # Stop the worker processes; the final state has already been gathered into the sim object
+    if n_procs > 1:
+        sim.shutdown()
 
     # Print timing info
     ttot = time.process_time() - t0
@@ -343,19 +652,22 @@ def run(
 
     # Render movie
     if movie:
-        cmd_str = "ffmpeg -i frame_%04d.png -pix_fmt yuv420p -y"
-        cmd_str += " -framerate %d" % (movie_fps)
-        cmd_str += " ulula_%s%s.mp4" % (setup_name, plot_suffix)
-        subprocess.run(cmd_str, shell=True)
-        for frame in glob.glob("frame*.png"):
-            try:
-                os.remove(frame)
-            except OSError:
-                pass
+        renderMovie()
 
     # Plot final state
     checkOutputStep(sim, final_step=True)
 
+    # Wait for the snapshot files that are still being written
+    closeWriters()
+
+    # Store the final state and the output schedule in the cache
+    if cache_entry is not None:
+        cache.commitEntry(
+            cache_entry,
+            sim,
+            dict(next_time_output=next_time_output, next_time_plot=next_time_plot),
+        )
+
     return sim
 
 
@@ -30,12 +30,25 @@ class SetupAdvect(setup.Setup):
 	In this test, an initially overdense tophat is placed at the center of the domain. The entire
 	fluid moves towards the northeast direction. This test is the 2D equivalent of tophat 
 	advection in 1D and mostly tests how diffusive a hydro solver is.
+	
+	Alternatively, the density can follow a smooth sine wave in both directions, which is useful
+	to measure the convergence order of a hydro solver. In that case, the cell-averaged density is
+	set, which differs from the value at the cell center at second order.
+	
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	profile: str
+		Initial density profile, ``tophat`` or ``sine``
 	"""
 	
-	def __init__(self):
+	def __init__(self, profile = 'tophat'):
 
 		setup.Setup.__init__(self)
 		
+		if not profile in ['tophat', 'sine']:
+			raise Exception('Unknown advection profile, %s.' % (profile))
+		
+		self.profile = profile
 		self.rho0 = 1.0
 		self.rho1 = 2.0
 		self.P0 = 1.0
@@ -50,7 +63,12 @@ class SetupAdvect(setup.Setup):
 
 	def shortName(self):
 		
-		return 'advect'
+		if self.profile == 'tophat':
+			sn = 'advect'
+		else:
+			sn = 'advect_sine'
+		
+		return sn
 
 	# ---------------------------------------------------------------------------------------------
 	
@@ -59,19 +77,50 @@ class SetupAdvect(setup.Setup):
 		sim.setDomain(nx, nx, xmin = 0.0, xmax = 1.0, ymin = 0.0, bc_type = 'periodic')
 		sim.setFluidProperties(self.gamma)
 
-		sim.V[DN] = self.rho0
+		sim.V[DN] = self.trueDensity(sim, 0.0)
 		sim.V[VX] = self.ux
 		sim.V[VY] = self.uy
 		sim.V[PR] = self.P0
+		
+		return
+		
+	# ---------------------------------------------------------------------------------------------
 
-		# Set tophat into the center of the domain
+	def trueDensity(self, sim, t):
+		"""
+		Density field of the advected profile
+		
+		The profile moves with the fluid velocity and is periodically wrapped around the domain.
+
+		Parameters
+		-----------------------------------------------------------------------------------------------
+		sim: Simulation
+			Simulation object
+		t: float
+			Time
+
+		Returns
+		-----------------------------------------------------------------------------------------------
+		rho: array_like
+			2D array with the density in all cells (including ghost cells)
+		"""
+		
+		# Distance from the center of the profile, wrapped into [-0.5, 0.5) in each direction
 		x, y = sim.xyGrid()
-		r = np.sqrt((x - 0.5)**2 + (y - 0.5)**2)
-		mask = (r <= self.r_th)
-		sim.V[DN][mask] = self.rho1
+		x = (x - 0.5 - self.ux * t + 0.5) % 1.0 - 0.5
+		y = (y - 0.5 - self.uy * t + 0.5) % 1.0 - 0.5
 		
-		return
+		if self.profile == 'tophat':
+			r = np.sqrt(x**2 + y**2)
+			rho = np.where(r <= self.r_th, self.rho1, self.rho0)
+		else:
+			# The cell average of a sine wave is reduced by a factor sin(k dx / 2) / (k dx / 2)
+			k = 2.0 * np.pi
+			f_avg = np.sin(0.5 * k * sim.dx) / (0.5 * k * sim.dx)
+			rho = self.rho0 + 0.5 * (self.rho1 - self.rho0) * np.sin(k * x) * np.sin(k * y) * f_avg**2
 		
+		return rho
+
 	# ---------------------------------------------------------------------------------------------
 
 	def plotLimits(self, q_plot):
@@ -312,7 +312,7 @@ class SetupSedov(setup.Setup):
 
 		t = sim.t
 		nq = len(q_plot)
-		V_sol = np.zeros((nq, len(x)), np.float)
+		V_sol = np.zeros((nq, len(x)), float)
 
 		for i in range(nq):
 			if q_plot[i] == 'DN':
@@ -8,10 +8,14 @@
 #
 ###################################################################################################
 
+import os
+import math
+import concurrent.futures
 import numpy as np
 import h5py
 
 import ulula.utils as ulula_utils
+import ulula.riemann as ulula_riemann
 
 ###################################################################################################
 
@@ -29,6 +33,21 @@ ET = 3
 
 slc_none = (slice(None), slice(None), slice(None))
 
+# Names of the scratch buffers in the workspace. The 3D buffers can hold a full fluid array, the
+# 2D buffers a single field. The tmp buffers are reserved for kernels that do not call any other 
+# kernels (such as the conversions between primitive and conserved variables).
+ws_buffers_3d = ['sL', 'sR', 'slim', 'lim_a', 'lim_b', 'lim_c', 'UL', 'UR', 'FL', 'FR', 'flux']
+ws_buffers_2d = ['tmp_a', 'tmp_b', 'cs', 'csL', 'csR', 'SL', 'SR', 'hll']
+ws_buffers_bool = ['mask_a']
+
+# The stages of the strong-stability-preserving Runge-Kutta integrators (Shu & Osher 1988). Each 
+# stage takes an Euler step from the current state and averages the result with the initial state
+# of the step, which has the weight w_old. The second weight is that of the fluxes of the stage in
+# the effective flux over the entire step.
+rk_stages = {}
+rk_stages['rk2'] = [(0.0, 0.5), (0.5, 0.5)]
+rk_stages['rk3'] = [(0.0, 1.0 / 6.0), (0.75, 1.0 / 6.0), (1.0 / 3.0, 2.0 / 3.0)]
+
 # The current file version is written to each Ulula file. If the code tries to open a file that is
 # old enough to be incompatible, an error will be thrown.
 file_version_current = '0.2.0'
@@ -43,28 +62,181 @@ class HydroScheme():
 	Parameters
 	-----------------------------------------------------------------------------------------------
 	reconstruction: string
-		Reconstruction algorithm; see listing for valid choices
+		Reconstruction algorithm; see listing for valid choices. Besides piecewise-constant 
+		(``const``) and piecewise-linear (``linear``) reconstruction, the piecewise-parabolic method
+		(``ppm``) and fifth-order WENO reconstruction (``weno5``) are available. They reach a given
+		accuracy on smooth flows with fewer cells but need three ghost cells (see 
+		:func:`~ulula.simulation.Simulation.reconstructionPPM` and 
+		:func:`~ulula.simulation.Simulation.reconstructionWENO5`). The ``ppm`` scheme uses the 
+		slope limiter; the ``weno5`` scheme does not. Both should be used with the ``hancock`` or
+		Runge-Kutta time integration schemes; like linear reconstruction with the MC limiter, they
+		are unstable with ``euler``. Only the numpy backend supports them.
 	limiter: string
 		Slope limiter algorithm; see listing for valid choices
 	riemann: string
 		Riemann solver; see listing for valid choices
 	time_integration: string
-		Time integration scheme; see listing for valid choices
+		Time integration scheme; see listing for valid choices. Besides the Euler and Hancock 
+		schemes, the strong-stability-preserving Runge-Kutta schemes of second (``rk2``) and 
+		third order (``rk3``) are available. They do not evolve the cell-edge states in time but 
+		take two or three Euler steps per timestep, which makes them the natural partners of the
+		higher-order reconstruction schemes. Only the numpy backend supports them, and the 
+		adaptive and nested grids (see the ``amr`` module) do not.
 	cfl: float
 		CFL number (must be between 0 and 1); determines the timestep as CFL number times cell size
 		divided by the maximum signal speed in the domain
+	backend: string
+		Implementation of the directional sweeps. ``numpy`` executes each step of the algorithm 
+		as a vectorized operation over the entire domain and serves as the reference. ``numba`` 
+		uses a JIT-compiled kernel that fuses all steps of a sweep into a single loop over the 
+		domain, which is much faster on large grids but requires the numba package. Both give 
+		identical results to round-off.
+	n_threads: int
+		Number of threads used to advance the domain. If larger than one, the domain is split into
+		strips that are processed concurrently. With the numba backend, this applies to the entire
+		sweep; with the numpy backend, it applies to the conversion from conserved to primitive 
+		variables. The boundary conditions are parallelized in both cases. The results do not 
+		depend on the number of threads.
+	precision: string
+		Floating-point type of the fluid variables, ``float64`` or ``float32``. Single precision 
+		halves the memory of the simulation and the memory traffic of the sweeps, which are 
+		limited by memory bandwidth on large grids, at the cost of round-off errors of order 
+		1E-7 (rather than 1E-16) in each operation. With the numpy backend, all operations are
+		carried out in the chosen precision; the numba backend stores the fluid variables in 
+		the chosen precision but computes each sweep in double precision.
+	tile_size: int or string
+		Cache blocking of the numpy backend. If ``None``, each step of a sweep is executed over the
+		entire domain, meaning that all intermediate arrays are streamed through main memory on 
+		large grids. Otherwise, the entire sweep is executed on one tile at a time, i.e., on a 
+		block of pencils (rows of cells along the sweep direction), so that the intermediate 
+		arrays stay in the cache. The number can give the desired number of cells per tile; if 
+		``auto``, it is chosen such that the fluid variables of a tile fill the L2 cache. The 
+		results do not depend on the tiling. The tiles are processed one after the other, meaning
+		that the conversions are not distributed among threads if ``n_threads > 1``. The numba 
+		backend always processes one pencil at a time and ignores this parameter.
+	checks: string
+		How often the fluid state is checked for physical validity (positive density and 
+		pressure). If ``always``, each conversion to primitive variables and each sound speed 
+		computation is checked, including those of the cell-edge states; each check is a 
+		reduction over the respective array. If ``every_n_steps``, the density and pressure in 
+		the domain are checked in a single reduction after every ``check_interval`` timesteps. If
+		``off``, no checks are performed. In all cases, a NaN signal speed in the CFL condition
+		leads to an error, which catches negative densities and pressures at no extra cost. The 
+		errors report the step and the coordinates of the offending cells. The numba backend 
+		checks each cell as it is computed, which costs nothing, and thus always behaves like 
+		``always``.
+	check_interval: int
+		Number of timesteps between checks if ``checks`` is ``every_n_steps``
+	unsplit: bool
+		If ``False``, the timestep is dimensionally split, i.e., it consists of a sweep in each 
+		direction. If ``True``, the flux differences in both directions are computed from the 
+		same state and combined into a single update, which halves the number of conversions to 
+		primitive variables and of boundary condition passes per timestep. With the Euler and 
+		Hancock schemes, this selects the corner transport upwind scheme (see 
+		:func:`~ulula.simulation.Simulation.unsplitStep`), which is stable up to a CFL number of 
+		one. With the Runge-Kutta schemes, each stage is an unsplit update, which requires a CFL 
+		number of about 0.5 or lower, since the signal speeds in both directions add up. Only the 
+		numpy backend supports unsplit schemes, and the adaptive and nested grids do not.
 	"""
 	
 	def __init__(self, reconstruction = 'const', limiter = 'minmod', riemann = 'hll', 
-				time_integration = 'euler', cfl = 0.8):
+				time_integration = 'euler', cfl = 0.8, backend = 'numpy', n_threads = 1,
+				precision = 'float64', tile_size = None, checks = 'always', check_interval = 10,
+				unsplit = False):
 
 		self.reconstruction = reconstruction
 		self.limiter = limiter
 		self.riemann = riemann
 		self.time_integration = time_integration
 		self.cfl = cfl
+		self.backend = backend
+		self.n_threads = n_threads
+		self.precision = precision
+		self.tile_size = tile_size
+		self.checks = checks
+		self.check_interval = check_interval
+		self.unsplit = unsplit
+		
+		return
+
+###################################################################################################
+
+class Workspace():
+	"""
+	Preallocated scratch memory for the hydro kernels
+	
+	Each directional sweep needs a number of temporary arrays (slopes, conserved edge states, 
+	fluxes, wave speeds and so on). Allocating those afresh in every sweep means tens of MB of 
+	memory traffic per timestep on large grids. Instead, the simulation creates one workspace in 
+	:func:`~ulula.simulation.Simulation.setDomain`, and the kernels obtain views into its buffers
+	via :func:`get`. Each buffer is flat and large enough to hold a full fluid array (or a single
+	field for the 2D buffers), so that views of any smaller shape can be carved out without 
+	copying. Kernels that call each other must use different buffer names.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	nq: int
+		Number of fluid variables
+	nx_tot: int
+		Number of cells in the x-direction including ghost cells
+	ny_tot: int
+		Number of cells in the y-direction including ghost cells
+	buffers_3d: array_like
+		Names of the 3D buffers to allocate; if ``None``, all buffers in ``ws_buffers_3d``.
+	buffers_2d: array_like
+		Names of the 2D buffers to allocate; if ``None``, all buffers in ``ws_buffers_2d``.
+	buffers_bool: array_like
+		Names of the boolean buffers to allocate; if ``None``, all buffers in ``ws_buffers_bool``.
+	dtype: type
+		Floating-point type of the 3D and 2D buffers
+	"""
+
+	def __init__(self, nq, nx_tot, ny_tot, buffers_3d = None, buffers_2d = None, buffers_bool = None,
+				dtype = np.float64):
+		
+		if buffers_3d is None:
+			buffers_3d = ws_buffers_3d
+		if buffers_2d is None:
+			buffers_2d = ws_buffers_2d
+		if buffers_bool is None:
+			buffers_bool = ws_buffers_bool
+
+		n2 = nx_tot * ny_tot
+		n3 = nq * n2
+		
+		self.buffers = {}
+		for name in buffers_3d:
+			self.buffers[name] = np.empty((n3), dtype)
+		for name in buffers_2d:
+			self.buffers[name] = np.empty((n2), dtype)
+		for name in buffers_bool:
+			self.buffers[name] = np.empty((n3), bool)
 		
 		return
+	
+	# ---------------------------------------------------------------------------------------------
+
+	def get(self, name, shape):
+		"""
+		Get a view into a scratch buffer
+		
+		The contents of the returned array are undefined, i.e., left over from whichever kernel 
+		used the buffer last.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		name: str
+			Name of the buffer; see the ``ws_buffers`` lists for valid choices
+		shape: tuple
+			Shape of the desired array
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		arr: array_like
+			Contiguous array of the given shape that shares memory with the buffer
+		"""
+		
+		return self.buffers[name][:math.prod(shape)].reshape(shape)
 
 ###################################################################################################
 
@@ -92,14 +264,25 @@ class Simulation():
 	``t``         Current time of the simulation
 	``step``      Current step counter
 	``last_dir``  Direction of last sweep in previous timestep (x=0, y=1)
+	``bc_stale``  Set of ghost regions that are out of date (``x``, ``y``, ``corners``)
+	``dt_cfl``    Timestep allowed by the CFL condition for the current state, if already known
+	``flux_store`` If not ``None``, arrays for idir [0, 1] into which the sweeps write the fluxes 
+	              across the interfaces of the physical domain (see :func:`createFluxStore`)
 	``gamma``     Adiabatic index 
 	``gm1``       gamma - 1
 	``gm1_inv``   1 / (gamma - 1)
+	``dtype``     Floating-point type of the fluid variables (set by the precision of the scheme)
+	``checks_always`` Whether every conversion and sound speed computation is checked for validity
+	``in_ensemble`` Whether the fluid arrays are part of an ensemble, in which case the simulation
+	              cannot be advanced on its own (see :class:`~ulula.ensemble.EnsembleSimulation`)
 	------------  ------
 	Settings
 	--------------------
 	``bc_type``   Type of boundary condition ('periodic' or 'outflow')
 	``hs``        HydroScheme object
+	``ws``        Workspace object with preallocated scratch arrays
+	``ws_strips`` Smaller workspaces, one for each strip in ``slc_strips``
+	``pool``      Thread pool if ``n_threads > 1`` in the hydro scheme, otherwise ``None``
 	------------  ------
 	1D vectors
 	--------------------
@@ -108,10 +291,17 @@ class Simulation():
 	------------  ------
 	3D vectors
 	--------------------
-	``U``         Vector of conserved fluid variables (dimensions [nq, nx + 2 ng, ny + 2 ng])
-	``V``         Vector of primitive fluid variables (dimensions [nq, nx + 2 ng, ny + 2 ng])
+	``U``         Vector of conserved fluid variables (dimensions [nq, nx + 2 ng, ny + 2 ng]). 
+	              The ghost cells are valid only after a full refresh with 
+	              :func:`enforceBoundaryConditions` (see ``bc_stale``).
+	``V``         Vector of primitive fluid variables (dimensions [nq, nx + 2 ng, ny + 2 ng]). 
+	              After a timestep, the ghost cells are out of date until they are refreshed.
 	``V_im12``    Cell-edge states at left side (same dimensions as V)
 	``V_ip12``    Cell-edge states at right side (same dimensions as V)
+	``V_jm12``    Cell-edge states at bottom side for unsplit updates (see :func:`unsplitStep`), 
+	              otherwise ``None``
+	``V_jp12``    Cell-edge states at top side for unsplit updates, otherwise ``None``
+	``U_rk``      Conserved variables at the beginning of a Runge-Kutta step, otherwise ``None``
 	------------  ------
 	Slices
 	--------------------
@@ -126,6 +316,12 @@ class Simulation():
 	``slc3aC``    3D slices for idir [0, 1], total domain
 	``slc3fL``    3D slice of flux vector from left interface
 	``slc3fR``    3D slice of flux vector from right interface	
+	``slc3dom``   3D slice of the physical domain in both directions
+	``slc_strips`` Slices along x that divide the physical domain into one strip per thread
+	``slc_tiles`` Tiles for idir [0, 1] for cache-blocked sweeps (see :func:`createTiles`), or 
+	              ``None`` if the sweeps are not tiled
+	``slc_pencils`` Slices for idir [0, 1] that divide the physical cells perpendicular to the sweep
+	              into one strip per thread
 	------------  ------
 	Dictionaries for fluid variables
 	--------------------
@@ -162,13 +358,20 @@ class Simulation():
 		self.hs = hydro_scheme
 	
 		# Set functions based on reconstruction scheme. If we are reconstructing, we need two
-		# ghost zones instead of one due to slope calculations.
+		# ghost zones instead of one due to slope calculations. The higher-order schemes use 
+		# five-cell stencils and need three ghost zones.
 		if self.hs.reconstruction == 'const':
 			self.reconstruction = self.reconstructionConst
 			self.nghost = 1
 		elif self.hs.reconstruction == 'linear':
 			self.reconstruction = self.reconstructionLinear
 			self.nghost = 2
+		elif self.hs.reconstruction == 'ppm':
+			self.reconstruction = self.reconstructionPPM
+			self.nghost = 3
+		elif self.hs.reconstruction == 'weno5':
+			self.reconstruction = self.reconstructionWENO5
+			self.nghost = 3
 		else:
 			raise Exception('Unknown reconstruction scheme, %s.' % (self.hs.reconstruction))
 
@@ -187,19 +390,106 @@ class Simulation():
 		# Set functions related to Riemann solver		
 		if self.hs.riemann == 'hll':
 			self.riemannSolver = self.riemannSolverHLL
+		elif self.hs.riemann == 'hllc':
+			self.riemannSolver = self.riemannSolverHLLC
+		elif self.hs.riemann == 'exact':
+			self.riemannSolver = self.riemannSolverExact
 		else:
 			raise Exception('Unknown Riemann solver, %s.' % self.hs.riemann)
 
 		# Check the time integration scheme for invalid values	
-		if not self.hs.time_integration in ['euler', 'hancock', 'hancock_cons']:
+		if not self.hs.time_integration in ['euler', 'hancock', 'hancock_cons'] + list(rk_stages.keys()):
 			raise Exception('Unknown time integration scheme, %s.' % self.hs.time_integration)
 
+		# Set the floating-point type of all fluid arrays
+		if self.hs.precision == 'float64':
+			self.dtype = np.float64
+		elif self.hs.precision == 'float32':
+			self.dtype = np.float32
+		else:
+			raise Exception('Unknown precision, %s.' % (self.hs.precision))
+
+		# Check the validity checks setting
+		if not self.hs.checks in ['always', 'every_n_steps', 'off']:
+			raise Exception('Unknown checks setting, %s.' % (self.hs.checks))
+		if (self.hs.checks == 'every_n_steps') and (self.hs.check_interval < 1):
+			raise Exception('Invalid check interval, %s (must be a positive integer).' \
+						% (str(self.hs.check_interval)))
+		self.checks_always = (self.hs.checks == 'always')
+
+		# Set the implementation of the directional sweeps. The numba module is imported only 
+		# when needed so that numba remains an optional dependency.
+		if self.hs.backend == 'numpy':
+			self.sweep = self.sweepNumpy
+		elif self.hs.backend == 'numba':
+			try:
+				import ulula.backend_numba as ulula_numba
+			except ImportError:
+				raise Exception('The numba backend requires the numba package to be installed.')
+			if not self.hs.reconstruction in ['const', 'linear']:
+				raise Exception('The numba backend does not support reconstruction scheme %s.' \
+							% (self.hs.reconstruction))
+			if not self.hs.time_integration in ulula_numba.time_integration_codes:
+				raise Exception('The numba backend does not support time integration scheme %s.' \
+							% (self.hs.time_integration))
+			if self.hs.unsplit:
+				raise Exception('The numba backend does not support unsplit time integration.')
+			if not self.hs.riemann in ulula_numba.riemann_codes:
+				raise Exception('The numba backend does not support Riemann solver %s.' % (self.hs.riemann))
+			self.numba = ulula_numba
+			self.sweep = self.sweepNumba
+		else:
+			raise Exception('Unknown backend, %s.' % (self.hs.backend))
+
+		# Create a pool of threads if we are parallelizing
+		if self.hs.n_threads > 1:
+			self.pool = concurrent.futures.ThreadPoolExecutor(max_workers = self.hs.n_threads)
+		else:
+			self.pool = None
+
 		# Variables that need to be set
 		self.gamma = None
+		
+		# Set by an ensemble that this simulation becomes a member of
+		self.in_ensemble = False
 
 		return
 	
 	# ---------------------------------------------------------------------------------------------
+	
+	def __getstate__(self):
+		"""
+		State of the simulation for copying and pickling
+		
+		The thread pool and the numba module cannot be copied, and the workspaces would only 
+		waste memory, so they are omitted and re-created by :func:`__setstate__`.
+		"""
+		
+		state = self.__dict__.copy()
+		for k in ['pool', 'numba', 'ws', 'ws_strips']:
+			state.pop(k, None)
+		
+		return state
+
+	# ---------------------------------------------------------------------------------------------
+	
+	def __setstate__(self, state):
+		
+		self.__dict__.update(state)
+		
+		if self.hs.backend == 'numba':
+			import ulula.backend_numba as ulula_numba
+			self.numba = ulula_numba
+		if self.hs.n_threads > 1:
+			self.pool = concurrent.futures.ThreadPoolExecutor(max_workers = self.hs.n_threads)
+		else:
+			self.pool = None
+		if 'slc_strips' in state:
+			self.createWorkspaces()
+		
+		return
+
+	# ---------------------------------------------------------------------------------------------
 
 	def setDomain(self, nx, ny, xmin = 0.0, xmax = 1.0, ymin = 0.0, bc_type = 'periodic'):
 		"""
@@ -319,11 +609,23 @@ class Simulation():
 			self.slc3fL.append(slc3fL)
 			self.slc3fR.append(slc3fR)
 		
+		self.slc3dom = (slice(None), self.slc1dC[0], self.slc1dC[1])
+		
 		# Time
 		self.t = 0.0
 		self.step = 0
 		self.last_dir = -1
 		
+		# Ghost regions that need to be filled before they are read. Initially, the ghost cells 
+		# hold the initial conditions.
+		self.bc_stale = set()
+		
+		# The CFL timestep of the current state, which is computed during timesteps
+		self.dt_cfl = None
+		
+		# The fluxes are not kept unless a flux store is created
+		self.flux_store = None
+		
 		# Storage for the primitive and conserved fluid variables and other arrays. The initial
 		# conditions can be useful for plotting.
 		self.U = self.emptyArray()
@@ -334,16 +636,184 @@ class Simulation():
 		if self.hs.reconstruction == 'const':
 			self.V_im12 = self.V
 			self.V_ip12 = self.V
-		elif self.hs.reconstruction == 'linear':
+		elif self.hs.reconstruction in ['linear', 'ppm', 'weno5']:
 			self.V_im12 = self.emptyArray()
 			self.V_ip12 = self.emptyArray()
 		else:
 			raise Exception('Unknown reconstruction scheme, %s.' % (self.hs.reconstruction))
 		
+		# The unsplit CTU scheme needs the edge states in both directions at the same time. With
+		# piecewise-constant reconstruction, they are again the cell-centered states.
+		if self.hs.unsplit and (not self.hs.time_integration in rk_stages):
+			if self.hs.reconstruction == 'const':
+				self.V_jm12 = self.V
+				self.V_jp12 = self.V
+			else:
+				self.V_jm12 = self.emptyArray()
+				self.V_jp12 = self.emptyArray()
+		else:
+			self.V_jm12 = None
+			self.V_jp12 = None
+		
+		# Storage for the initial state of a Runge-Kutta step, which is reused in every step
+		if self.hs.time_integration in rk_stages:
+			self.U_rk = self.emptyArray()
+		else:
+			self.U_rk = None
+		
+		# Strips for parallel execution. The strips along x are contiguous in memory and used for
+		# operations that do not depend on neighboring cells, such as conversions. The pencil 
+		# strips divide the physical cells perpendicular to each sweep direction.
+		n_strips = self.hs.n_threads
+		self.slc_strips = [slice(ng + slc.start, ng + slc.stop) for slc in self.splitRange(self.nx, n_strips)]
+		self.slc_pencils = [self.splitRange(self.ny, n_strips), self.splitRange(self.nx, n_strips)]
+		
+		# Tiles for cache-blocked sweeps with the numpy backend
+		self.createTiles()
+		
+		# Scratch memory for the kernels, so that no large arrays are allocated during timesteps
+		self.createWorkspaces()
+		
 		return
 	
 	# ---------------------------------------------------------------------------------------------
 
+	def createWorkspaces(self):
+		"""
+		Allocate the scratch memory for the kernels
+		
+		This function creates the main workspace as well as a smaller workspace for each of the 
+		parallel strips. It is called when the domain is set, but the workspaces are not part of 
+		the state of the simulation (e.g., when it is copied) and can be re-created at any time.
+		"""
+		
+		ng = self.nghost
+		self.ws = Workspace(self.nq, self.nx + 2 * ng, self.ny + 2 * ng, dtype = self.dtype)
+		
+		n_max = self.slc_strips[0].stop - self.slc_strips[0].start
+		self.ws_strips = []
+		for i in range(len(self.slc_strips)):
+			self.ws_strips.append(Workspace(self.nq, n_max, self.ny + 2 * ng, buffers_3d = [], 
+										buffers_2d = ['tmp_a', 'tmp_b', 'cs'], buffers_bool = [], 
+										dtype = self.dtype))
+		
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def createFluxStore(self):
+		"""
+		Keep the fluxes computed during the sweeps
+		
+		Normally, the fluxes across the cell interfaces are discarded once they have been added to
+		the conserved variables. After this function has been called, each sweep writes the fluxes
+		across all interfaces of the physical domain into ``flux_store[idir]``, which has 
+		dimensions [nq, nx + 1, ny] for the x-direction and [nq, nx, ny + 1] for the y-direction. 
+		Index i along the sweep direction refers to the left interface of physical cell i, as in 
+		the flux array of :func:`sweepArrays`. The stored fluxes are used to correct neighboring 
+		grids, e.g., at the coarse-fine boundaries of a refined grid (see the ``amr`` module).
+		"""
+		
+		self.flux_store = [np.zeros((self.nq, self.nx + 1, self.ny), dtype = self.dtype), 
+						np.zeros((self.nq, self.nx, self.ny + 1), dtype = self.dtype)]
+		
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def createTiles(self):
+		"""
+		Divide the domain into tiles for cache-blocked sweeps
+		
+		The tiles are blocks of rows along x, which are contiguous in memory, and contain only the
+		physical pencils (i.e., not the ghost cells perpendicular to the sweep). For sweeps in the
+		y-direction, each tile contains entire pencils so that the tiles are independent. For 
+		sweeps in the x-direction, the tiles cut through the pencils; each tile overlaps its 
+		neighbors by ``nghost`` rows, which are read but not updated. Each tile is a dictionary
+		containing its slice in the domain (``slc``), slices of the updated cells and their 
+		neighbors relative to the tile (``slc3dL``, ``slc3dR``, ``slc3dC``), the slice of 
+		rows that are converted to primitive variables once the tile has been swept (``slc_conv``, 
+		see :func:`conservedToPrimitiveDomain`), and the slice of its interfaces in the flux store
+		(``slc_flux``, see :func:`createFluxStore`). The tiles are ordered as they are laid out in 
+		memory.
+		
+		The number of cells per tile is set by the ``tile_size`` parameter of the hydro scheme. 
+		In the x-direction, each tile updates at least ``nghost`` rows; otherwise, the overlap
+		would reach beyond the neighboring tile.
+		"""
+		
+		if self.hs.tile_size is None:
+			self.slc_tiles = None
+			return
+
+		if self.hs.tile_size == 'auto':
+			tile_size = ulula_utils.cacheSize(level = 2) // self.bytesPerCell()
+		elif isinstance(self.hs.tile_size, (int, np.integer)) and (self.hs.tile_size > 0):
+			tile_size = self.hs.tile_size
+		else:
+			raise Exception('Invalid tile size, %s (must be None, auto, or a positive integer).' \
+						% (str(self.hs.tile_size)))
+		
+		ng = self.nghost
+		ny_tot = self.ny + 2 * ng
+		rows = max(1, tile_size // ny_tot)
+		slc_y = self.slc1dC[1]
+		
+		self.slc_tiles = []
+		for idir in range(2):
+			tiles = []
+			if idir == 0:
+				n_upd = max(ng, rows)
+				for slc in self.splitRange(self.nx, -(-self.nx // n_upd)):
+					i0 = ng + slc.start
+					i1 = ng + slc.stop
+					n_loc = i1 - i0
+					tile = {}
+					tile['slc'] = (slice(None), slice(i0 - ng, i1 + ng), slc_y)
+					tile['slc3dL'] = (slice(None), slice(ng - 1, ng + n_loc), slice(None))
+					tile['slc3dR'] = (slice(None), slice(ng, ng + n_loc + 1), slice(None))
+					tile['slc3dC'] = (slice(None), slice(ng, ng + n_loc), slice(None))
+					tile['slc_conv'] = (slice(None), slice(i0, i1), slice(None))
+					tile['slc_flux'] = (slice(None), slice(slc.start, slc.stop + 1), slice(None))
+					tiles.append(tile)
+			else:
+				for slc in self.splitRange(self.nx, -(-self.nx // rows)):
+					tile = {}
+					tile['slc'] = (slice(None), slice(ng + slc.start, ng + slc.stop), slice(None))
+					tile['slc3dL'] = self.slc3dL[idir]
+					tile['slc3dR'] = self.slc3dR[idir]
+					tile['slc3dC'] = self.slc3dC[idir]
+					tile['slc_conv'] = (slice(None), tile['slc'][1], slice(None))
+					tile['slc_flux'] = (slice(None), slc, slice(None))
+					tiles.append(tile)
+			tiles.sort(key = lambda tile: tile['slc'][1].start)
+			self.slc_tiles.append(tiles)
+		
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def bytesPerCell(self):
+		"""
+		Memory per grid cell that a sweep needs to keep in the cache
+		
+		This number counts the primitive and conserved variables and the cell-edge states, which 
+		are used throughout the sweep. Each scratch buffer is used only in one or two steps, 
+		meaning that it does not need to stay in the cache for the entire sweep. The number 
+		determines the size of a tile that fits into a given cache.
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		n_bytes: int
+			Number of bytes per cell
+		"""
+		
+		n_bytes = 4 * self.nq * np.dtype(self.dtype).itemsize
+		
+		return n_bytes
+	
+	# ---------------------------------------------------------------------------------------------
+
 	def setFluidProperties(self, gamma = 5.0 / 3.0):
 		"""
 		Set the physical properties of the fluid
@@ -363,6 +833,64 @@ class Simulation():
 	
 	# ---------------------------------------------------------------------------------------------
 
+	def splitRange(self, n, n_strips):
+		"""
+		Divide a range of cells into strips
+		
+		Parameters
+		-------------------------------------------------------------------------------------------
+		n: int
+			Number of cells
+		n_strips: int
+			Number of strips; if larger than ``n``, only ``n`` strips are returned
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		slices: array_like
+			List of slices of nearly equal size that cover the range [0, n); the first slice is 
+			the largest.
+		"""
+		
+		n_strips = max(1, min(n_strips, n))
+		edges = np.linspace(0, n, n_strips + 1).astype(int)
+		slices = [slice(edges[i], edges[i + 1]) for i in range(n_strips)]
+		slices.sort(key = lambda slc: slc.start - slc.stop)
+		
+		return slices
+
+	# ---------------------------------------------------------------------------------------------
+
+	def runParallel(self, func, args_list):
+		"""
+		Execute a function for a list of arguments, in parallel if possible
+		
+		If the simulation has a thread pool, the function calls are distributed among the threads;
+		otherwise, they are executed one by one. Exceptions raised in the threads are passed on to
+		the caller.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		func: function
+			Function to execute
+		args_list: array_like
+			List of argument tuples, one per call
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		results: array_like
+			List of the return values, in the same order as ``args_list``
+		"""
+		
+		if self.pool is None:
+			results = [func(*args) for args in args_list]
+		else:
+			futures = [self.pool.submit(func, *args) for args in args_list]
+			results = [f.result() for f in futures]
+		
+		return results
+
+	# ---------------------------------------------------------------------------------------------
+
 	# Return an empty array with the dimensions of the solution
 	
 	def emptyArray(self, nq = None):
@@ -378,17 +906,17 @@ class Simulation():
 		Returns
 		-------------------------------------------------------------------------------------------
 		ret: array_like
-			Float array of size nq times the size of the domain including ghost cells. If 
-			``nq == 1``, the first dimension is omitted.
+			Float array of size nq times the size of the domain including ghost cells, with the 
+			floating-point type of the simulation. If ``nq == 1``, the first dimension is omitted.
 		"""
 			
 		if nq is None:
 			nq = self.nq
 			
 		if nq == 1:
-			ret = np.zeros((self.nx + 2 * self.nghost, self.ny + 2 * self.nghost), float)
+			ret = np.zeros((self.nx + 2 * self.nghost, self.ny + 2 * self.nghost), self.dtype)
 		else:
-			ret = np.zeros((nq, self.nx + 2 * self.nghost, self.ny + 2 * self.nghost), float)
+			ret = np.zeros((nq, self.nx + 2 * self.nghost, self.ny + 2 * self.nghost), self.dtype)
 			
 		return ret 
 
@@ -413,18 +941,84 @@ class Simulation():
 
 	# ---------------------------------------------------------------------------------------------
 	
-	def enforceBoundaryConditions(self):
+	def enforceBoundaryConditions(self, idir = None, corners = False):
 		"""
 		Enforce boundary conditions after changes
 		
 		This function fills the ghost cells with values from the physical domain. For periodic BCs,
 		those originate from the other side; for outflow BCs, they are copied from the edge of the
-		physical domain. This function must be executed at each timestep.
+		physical domain. 
+		
+		If no direction is given, all ghost cells of both the primitive and conserved variables 
+		are filled. This is necessary whenever the fluid state was set or changed from the outside,
+		e.g., when loading a file. For the same reason, the cached CFL timestep is discarded (see 
+		:func:`cflCondition`). During a timestep, however, a sweep in a given direction reads 
+		only the ghost cells of the primitive variables along that direction, and only next to the
+		physical domain (i.e., not the corners). Given a direction, this function thus fills only
+		those ghost cells, and only if they are stale, i.e., if the physical domain has changed 
+		since they were last filled. The ``bc_stale`` set keeps track of which regions (``x``, 
+		``y``, ``corners``) are stale.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		idir: int
+			Direction of the next sweep (0 = x, 1 = y), or ``None`` to fill all ghost cells
+		corners: bool
+			If ``True`` and a direction is given, the corners of the primitive variables are also 
+			filled if they are stale. Unsplit updates read them (see :func:`unsplitStep`).
 		"""
 			
 		if self.bc_type is None:
 			raise Exception('Type of boundary condition must be set.')
 		
+		if idir is None:
+			arrays = [self.V, self.U]
+			regions = ['x', 'y', 'corners']
+		else:
+			arrays = [self.V]
+			regions = [['x', 'y'][idir]]
+			if corners:
+				regions.append('corners')
+			regions = [r for r in regions if r in self.bc_stale]
+			if len(regions) == 0:
+				return
+
+		# When running in parallel, each fluid variable is filled independently so that the work
+		# can be distributed among threads.
+		args_list = []
+		for v in arrays:
+			if self.pool is None:
+				args_list.append((v, regions))
+			else:
+				for q in range(self.nq):
+					args_list.append((v[q:q + 1], regions))
+		self.runParallel(self.enforceBoundaryConditionsArray, args_list)
+		
+		if idir is None:
+			self.bc_stale = set()
+			self.dt_cfl = None
+		else:
+			self.bc_stale.difference_update(regions)
+		
+		return
+
+	# ---------------------------------------------------------------------------------------------
+	
+	def enforceBoundaryConditionsArray(self, v, regions = ['x', 'y', 'corners']):
+		"""
+		Fill the ghost cells of one array
+		
+		See :func:`enforceBoundaryConditions`.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		v: array_like
+			Array with the dimensions of the domain and any number of fluid variables
+		regions: array_like
+			Ghost regions to fill; can contain ``x`` (left/right), ``y`` (bottom/top), and 
+			``corners``
+		"""
+		
 		xlo = self.xlo
 		xhi = self.xhi
 		ylo = self.ylo
@@ -433,42 +1027,44 @@ class Simulation():
 		slc_x = self.slc1dC[0]
 		slc_y = self.slc1dC[1]
 		
-		for v in [self.V, self.U]:
-			
-			if self.bc_type == 'periodic':
+		if self.bc_type == 'periodic':
+			if 'x' in regions:
 				# Left/right ghost
 				v[:, 0:ng, slc_y] = v[:, xhi-ng+1:xhi+1, slc_y]		
 				v[:, -ng:, slc_y] = v[:, xlo:xlo+ng,     slc_y]
+			if 'y' in regions:
 				# Bottom/top ghost
 				v[:, slc_x, 0:ng] = v[:, slc_x, yhi-ng+1:yhi+1]		
 				v[:, slc_x, -ng:] = v[:, slc_x,     ylo:ylo+ng]
-				# Corners
+			if 'corners' in regions:
 				v[:, 0:ng,  0:ng] = v[:, xhi-ng+1:xhi+1, yhi-ng+1:yhi+1]
 				v[:, 0:ng,  -ng:] = v[:, xhi-ng+1:xhi+1, ylo:ylo+ng]
 				v[:, -ng:,  0:ng] = v[:, xlo:xlo+ng,     yhi-ng+1:yhi+1]
 				v[:, -ng:,  -ng:] = v[:, xlo:xlo+ng,     ylo:ylo+ng]
-			
-			elif self.bc_type == 'outflow':
+		
+		elif self.bc_type == 'outflow':
+			if 'x' in regions:
 				# Left/right ghost
 				v[:, 0:ng, slc_y] = v[:, xlo, slc_y][:, None, :]
 				v[:, -ng:, slc_y] = v[:, xhi, slc_y][:, None, :]
+			if 'y' in regions:
 				# Bottom/top ghost
 				v[:, slc_x, 0:ng] = v[:, slc_x, ylo][:, :, None]
 				v[:, slc_x, -ng:] = v[:, slc_x, yhi][:, :, None]
-				# Corners
+			if 'corners' in regions:
 				v[:, 0:ng, 0:ng]  = v[:, xlo, ylo][:, None, None]
 				v[:, 0:ng, -ng:]  = v[:, xlo, yhi][:, None, None]
 				v[:, -ng:, 0:ng]  = v[:, xhi, ylo][:, None, None]
 				v[:, -ng:, -ng:]  = v[:, xhi, yhi][:, None, None]
-			
-			else:
-				raise Exception('Unknown type of boundary condition, %s.' % (self.bc_type))
-			
+		
+		else:
+			raise Exception('Unknown type of boundary condition, %s.' % (self.bc_type))
+		
 		return
 
 	# ---------------------------------------------------------------------------------------------
 	
-	def primitiveToConserved(self, V, U):
+	def primitiveToConserved(self, V, U, ws = None):
 		"""
 		Convert primitive to conserved variables
 		
@@ -482,16 +1078,31 @@ class Simulation():
 			Input array of primitive fluid variables with first dimension nq (rho, vx, vy, P...)
 		U: array_like
 			Output array of fluid variables with first dimension nq (rho, u * vx...)
+		ws: Workspace
+			Workspace for temporary arrays; if ``None``, the workspace of the simulation is used.
 		"""
-				
+		
+		if ws is None:
+			ws = self.ws
+		
 		rho = V[DN]
 		ux = V[VX]
 		uy = V[VY]
 		
+		# Kinetic and thermal energy density
+		ekin = ws.get('tmp_a', rho.shape)
+		eint = ws.get('tmp_b', rho.shape)
+		np.square(ux, out = ekin)
+		np.square(uy, out = eint)
+		ekin += eint
+		ekin *= 0.5
+		ekin *= rho
+		np.multiply(V[PR], self.gm1_inv, out = eint)
+		
 		U[DN] = rho
-		U[MX] = ux * rho
-		U[MY] = uy * rho
-		U[ET] = 0.5 * (ux**2 + uy**2) * rho + V[PR] * self.gm1_inv
+		np.multiply(ux, rho, out = U[MX])
+		np.multiply(uy, rho, out = U[MY])
+		np.add(ekin, eint, out = U[ET])
 
 		return
 
@@ -522,13 +1133,14 @@ class Simulation():
 
 	# ---------------------------------------------------------------------------------------------
 	
-	def conservedToPrimitive(self, U, V):
+	def conservedToPrimitive(self, U, V, ws = None, slc_speed = None, check = True):
 		"""
 		Convert conserved to primitive variables
 		
 		This function takes the input and output arrays as parameters instead of assuming that it
 		should use the main U and V arrays. In some cases, conversions need to be performed on 
-		other fluid states.
+		other fluid states. Optionally, the largest signal speed among the converted cells is 
+		computed while they are still in the cache.
 
 		Parameters
 		-------------------------------------------------------------------------------------------
@@ -536,25 +1148,100 @@ class Simulation():
 			Input array of conserved fluid variables with first dimension nq (rho, u * vx...)
 		V: array_like
 			Output array of primitive fluid variables with first dimension nq (rho, vx, vy, P...)
+		ws: Workspace
+			Workspace for temporary arrays; if ``None``, the workspace of the simulation is used. 
+			Concurrent conversions must use separate workspaces.
+		slc_speed: tuple
+			If not ``None``, the part of ``V`` (e.g., without ghost cells) in which the largest 
+			signal speed is computed.
+		check: bool
+			If ``False``, the pressure is not checked even if the checks are always performed. 
+			This setting is meant for callers that handle invalid states themselves.
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		c_max: float
+			Largest signal speed (see :func:`maxSpeed`) if ``slc_speed`` is given, otherwise 
+			``None``.
 		"""
 		
+		if ws is None:
+			ws = self.ws
+		
 		rho = U[DN]
-		ux = U[MX] / rho
-		uy = U[MY] / rho
+		ux = V[VX]
+		uy = V[VY]
+		np.divide(U[MX], rho, out = ux)
+		np.divide(U[MY], rho, out = uy)
+		
+		# Kinetic energy density
+		ekin = ws.get('tmp_a', rho.shape)
+		tmp = ws.get('tmp_b', rho.shape)
+		np.square(ux, out = ekin)
+		np.square(uy, out = tmp)
+		ekin += tmp
+		np.multiply(rho, 0.5, out = tmp)
+		ekin *= tmp
 		
 		V[DN] = rho
-		V[VX] = ux
-		V[VY] = uy
-		V[PR] = (U[ET] - 0.5 * rho * (ux**2 + uy**2)) * self.gm1
+		np.subtract(U[ET], ekin, out = V[PR])
+		np.multiply(V[PR], self.gm1, out = V[PR])
 
-		if np.min(V[PR]) <= 0.0:
-			raise Exception('Zero or negative pressure found. Aborting.')
+		if check and self.checks_always and (np.min(V[PR]) <= 0.0):
+			raise self.invalidStateError('Zero or negative pressure found.')
 		
-		return
+		if slc_speed is None:
+			c_max = None
+		else:
+			c_max = self.maxSpeed(V[slc_speed], ws = ws)
+		
+		return c_max
+
+	# ---------------------------------------------------------------------------------------------
+	
+	def conservedToPrimitiveDomain(self, max_speed = False):
+		"""
+		Convert the conserved to the primitive variables in the physical domain
+		
+		The domain is converted in strips along x, which are distributed among threads if the 
+		simulation runs in parallel. The ghost cells along x are not converted; they are filled by 
+		the boundary conditions when needed. The strips do contain the ghost cells along y, which 
+		keeps them contiguous in memory. This is faster than skipping those cells, even though their
+		values are overwritten by the boundary conditions before they are used.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		max_speed: bool
+			If ``True``, compute the largest signal speed in the physical domain along with the 
+			conversion.
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		c_max: float
+			Largest signal speed in the domain if ``max_speed`` is ``True``, otherwise ``None``.
+		"""
+		
+		if max_speed:
+			slc_speed = (slice(None), slice(None), self.slc1dC[1])
+		else:
+			slc_speed = None
+		
+		args_list = []
+		for i in range(len(self.slc_strips)):
+			slc = (slice(None), self.slc_strips[i], slice(None))
+			args_list.append((self.U[slc], self.V[slc], self.ws_strips[i], slc_speed))
+		c_max_strips = self.runParallel(self.conservedToPrimitive, args_list)
+		
+		if max_speed:
+			c_max = max(c_max_strips)
+		else:
+			c_max = None
+		
+		return c_max
 
 	# ---------------------------------------------------------------------------------------------
 
-	def fluxVector(self, idir, V):
+	def fluxVector(self, idir, V, F = None):
 		"""
 		Convert the flux vector F(V)
 		
@@ -567,6 +1254,8 @@ class Simulation():
 			Direction of sweep (0 = x, 1 = y)
 		V: array_like
 			Input array of primitive fluid variables with first dimension nq (rho, vx, vy, P...)
+		F: array_like
+			Output array with the same dimensions as ``V``; if ``None``, a new array is created.
 
 		Returns
 		-------------------------------------------------------------------------------------------
@@ -581,21 +1270,34 @@ class Simulation():
 		u2 = V[VX + idir2]
 		prs = V[PR]
 		
-		rho_u1 = rho * u1
-		etot = 0.5 * rho * (u1**2 + u2**2) + prs * self.gm1_inv
-
-		F = np.zeros_like(V)
-		F[DN] = rho_u1
-		F[MX + idir] = rho_u1 * u1 + prs
-		F[MX + idir2] = rho_u1 * u2
-		F[ET] = (etot + prs) * u1
+		if F is None:
+			F = np.zeros_like(V)
+
+		# Total energy plus pressure
+		etot = self.ws.get('tmp_a', rho.shape)
+		tmp = self.ws.get('tmp_b', rho.shape)
+		np.square(u1, out = etot)
+		np.square(u2, out = tmp)
+		etot += tmp
+		np.multiply(rho, 0.5, out = tmp)
+		etot *= tmp
+		np.multiply(prs, self.gm1_inv, out = tmp)
+		etot += tmp
+		etot += prs
+		
+		rho_u1 = F[DN]
+		np.multiply(rho, u1, out = rho_u1)
+		np.multiply(rho_u1, u1, out = F[MX + idir])
+		np.add(F[MX + idir], prs, out = F[MX + idir])
+		np.multiply(rho_u1, u2, out = F[MX + idir2])
+		np.multiply(etot, u1, out = F[ET])
 		
 		return F
 
 	# ---------------------------------------------------------------------------------------------
 
 
-	def primitiveEvolution(self, idir, V, dV_dx):
+	def primitiveEvolution(self, idir, V, dV_dx, dV_dt = None):
 		"""
 		Linear approximation of the Euler equations
 		
@@ -612,6 +1314,9 @@ class Simulation():
 			Array of primitive fluid variables with first dimension nq (rho, vx, vy, P...)
 		dV_dx: array_like
 			Array of derivative of fluid variables with first dimension nq
+		dV_dt: array_like
+			Output array with the same dimensions as ``dV_dx``; if ``None``, a new array is 
+			created.
 
 		Returns
 		-------------------------------------------------------------------------------------------
@@ -624,18 +1329,32 @@ class Simulation():
 		V1 = VX + idir
 		V2 = VX + idir2
 		
-		dV_dt = np.zeros_like(dV_dx)
+		if dV_dt is None:
+			dV_dt = np.zeros_like(dV_dx)
+		tmp = self.ws.get('tmp_a', V[DN].shape)
+		
+		np.multiply(V[V1], dV_dx[DN], out = dV_dt[DN])
+		np.multiply(dV_dx[V1], V[DN], out = tmp)
+		np.add(dV_dt[DN], tmp, out = dV_dt[DN])
 		
-		dV_dt[DN] = -(V[V1] * dV_dx[DN] + dV_dx[V1] * V[DN])
-		dV_dt[V1] = -(V[V1] * dV_dx[V1] + dV_dx[PR] / V[DN])
-		dV_dt[V2] = -(V[V1] * dV_dx[V2])
-		dV_dt[PR] = -(V[V1] * dV_dx[PR] + dV_dx[V1] * V[PR] * self.gamma)
+		np.multiply(V[V1], dV_dx[V1], out = dV_dt[V1])
+		np.divide(dV_dx[PR], V[DN], out = tmp)
+		np.add(dV_dt[V1], tmp, out = dV_dt[V1])
+		
+		np.multiply(V[V1], dV_dx[V2], out = dV_dt[V2])
+		
+		np.multiply(V[V1], dV_dx[PR], out = dV_dt[PR])
+		np.multiply(dV_dx[V1], V[PR], out = tmp)
+		tmp *= self.gamma
+		np.add(dV_dt[PR], tmp, out = dV_dt[PR])
+		
+		np.negative(dV_dt, out = dV_dt)
 
 		return dV_dt
 
 	# ---------------------------------------------------------------------------------------------
 
-	def soundSpeed(self, V):
+	def soundSpeed(self, V, cs = None):
 		"""
 		Sound speed
 		
@@ -643,6 +1362,9 @@ class Simulation():
 		-------------------------------------------------------------------------------------------
 		V: array_like
 			Input array of primitive fluid variables with first dimension nq (rho, vx, vy, P...)
+		cs: array_like
+			Output array with the dimensions of a single field of ``V``; if ``None``, a new array 
+			is created.
 
 		Returns
 		-------------------------------------------------------------------------------------------
@@ -650,11 +1372,14 @@ class Simulation():
 			Array of sound speed with first dimension nq and same dimensions as input array.
 		"""
 		
-		cs = np.sqrt(self.gamma * V[PR] / V[DN])
+		if cs is None:
+			cs = np.zeros_like(V[DN])
+		np.multiply(V[PR], self.gamma, out = cs)
+		cs /= V[DN]
+		np.sqrt(cs, out = cs)
 
-		if np.any(np.isnan(cs)):
-			print(np.min(V[PR]), np.min(V[DN]))
-			raise Exception('Could not compute sound speed. Aborting.')
+		if self.checks_always and np.isnan(np.min(cs)):
+			raise self.invalidStateError('Could not compute sound speed.')
 		
 		return cs
 
@@ -668,30 +1393,125 @@ class Simulation():
 		evaluates the sound speed and adds it to the absolute x and y velocities. We do not need to
 		add those velocities in quadrature since we are taking separate sweeps in the x and y 
 		directions. Thus, the largest allowed timestep is determined by the largest speed in 
-		either direction.
+		either direction. The ghost cells are included only if none of them are stale; otherwise,
+		only the physical domain is considered. Up-to-date ghost cells contain copies of physical 
+		cells anyway, except for the initial conditions, which may set them differently.
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		c_max: float
+			Largest possible signal speed in the domain.
+		"""
+		
+		if len(self.bc_stale) == 0:
+			V = self.V
+		else:
+			V = self.V[self.slc3dom]
+		c_max = self.maxSpeed(V)
+		
+		return c_max
+
+	# ---------------------------------------------------------------------------------------------
+
+	def maxSpeed(self, V, ws = None):
+		"""
+		Largest signal speed in an array of fluid states
+		
+		See :func:`maxSpeedInDomain`.
 		
 		Parameters
 		-------------------------------------------------------------------------------------------
 		V: array_like
 			Input array of primitive fluid variables with first dimension nq (rho, vx, vy, P...)
+		ws: Workspace
+			Workspace for temporary arrays; if ``None``, the workspace of the simulation is used.
 
 		Returns
 		-------------------------------------------------------------------------------------------
 		c_max: float
-			Largest possible signal speed in the domain.
+			Largest possible signal speed in the array.
 		"""
 		
-		cs = self.soundSpeed(self.V)
-		c_max = np.max(np.maximum(np.abs(self.V[VX]), np.abs(self.V[VY])) + cs)
+		if ws is None:
+			ws = self.ws
+
+		shape = V[DN].shape
+		cs = self.soundSpeed(V, cs = ws.get('cs', shape))
+		vx_abs = ws.get('tmp_a', shape)
+		vy_abs = ws.get('tmp_b', shape)
+		np.abs(V[VX], out = vx_abs)
+		np.abs(V[VY], out = vy_abs)
+		np.maximum(vx_abs, vy_abs, out = vx_abs)
+		vx_abs += cs
+		
+		# Return a Python float so that the timestep (and thus the time) is kept in double 
+		# precision even if the fluid variables are not
+		c_max = float(np.max(vx_abs))
 		
 		if np.isnan(c_max):
-			raise Exception('Could not compute fastest speed in domain. Aborting.')
+			raise self.invalidStateError('Could not compute fastest speed in domain.')
 		
 		return c_max
 
 	# ---------------------------------------------------------------------------------------------
 
-	def reconstructionConst(self, idir, dt):
+	def checkFluidState(self):
+		"""
+		Check that the density and pressure are positive in the domain
+		
+		Both fields are checked in a single reduction over a strided view. A NaN minimum fails the
+		comparison, meaning that NaN values are caught as well.
+		"""
+		
+		slc = (slice(DN, PR + 1, PR - DN), self.slc1dC[0], self.slc1dC[1])
+		if not (np.min(self.V[slc]) > 0.0):
+			raise self.invalidStateError('Zero, negative, or NaN density or pressure found.')
+		
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def invalidStateError(self, msg):
+		"""
+		Create an exception for an invalid fluid state
+		
+		This function searches the domain for cells with zero, negative, or NaN density or 
+		pressure, and adds their number and the coordinates of the first such cell to the error 
+		message, along with the current step and time. This search is expensive but happens only
+		once the simulation has failed. If the domain contains no such cells, the invalid state 
+		occurred in an intermediate array such as the cell-edge states.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		msg: str
+			Description of the failed check
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		e: Exception
+			Exception to be raised
+		"""
+		
+		slc = (slice(DN, PR + 1, PR - DN), self.slc1dC[0], self.slc1dC[1])
+		invalid = np.any(np.logical_not(self.V[slc] > 0.0), axis = 0)
+		idx = np.argwhere(invalid)
+		
+		msg = '%s Timestep starting at step %d, t = %.6e.' % (msg, self.step, self.t)
+		if len(idx) > 0:
+			i = idx[0][0] + self.xlo
+			j = idx[0][1] + self.ylo
+			msg += ' Found %d invalid cells in the domain; the first is cell (%d, %d) at x = %.6e, ' \
+				'y = %.6e with density %.6e and pressure %.6e.' \
+				% (len(idx), i, j, self.x[i], self.y[j], self.V[DN, i, j], self.V[PR, i, j])
+		else:
+			msg += ' No invalid cells found in the domain; the error occurred in an intermediate state.'
+		msg += ' Aborting.'
+		
+		return Exception(msg)
+
+	# ---------------------------------------------------------------------------------------------
+
+	def reconstructionConst(self, idir, dt, V, V_im12, V_ip12):
 		"""
 		Piecewise-constant reconstruction
 		
@@ -705,13 +1525,19 @@ class Simulation():
 			Direction of sweep (0 = x, 1 = y)
 		dt: float
 			Timestep
+		V: array_like
+			Primitive fluid variables
+		V_im12: array_like
+			Output array for the left cell-edge states (same dimensions as ``V``)
+		V_ip12: array_like
+			Output array for the right cell-edge states (same dimensions as ``V``)
 		"""
 		
 		return
 
 	# ---------------------------------------------------------------------------------------------
 
-	def reconstructionLinear(self, idir, dt):
+	def reconstructionLinear(self, idir, dt, V, V_im12, V_ip12):
 		"""
 		Piecewise-linear reconstruction
 		
@@ -737,43 +1563,468 @@ class Simulation():
 			Direction of sweep (0 = x, 1 = y)
 		dt: float
 			Timestep
+		V: array_like
+			Primitive fluid variables
+		V_im12: array_like
+			Output array for the left cell-edge states (same dimensions as ``V``)
+		V_ip12: array_like
+			Output array for the right cell-edge states (same dimensions as ``V``)
 		"""
 		
-		V = self.V
+		ws = self.ws
 		slc3aL = self.slc3aL[idir]
 		slc3aR = self.slc3aR[idir]
 		slc3aC = self.slc3aC[idir]
+		V_im12 = V_im12[slc3aC]
+		V_ip12 = V_ip12[slc3aC]
+		shape = V_im12.shape
 
 		# Compute undivided derivatives
-		sL = (V[slc3aC] - V[slc3aL])
-		sR = (V[slc3aR] - V[slc3aC])
+		sL = ws.get('sL', shape)
+		sR = ws.get('sR', shape)
+		np.subtract(V[slc3aC], V[slc3aL], out = sL)
+		np.subtract(V[slc3aR], V[slc3aC], out = sR)
 		
-		# Apply slope limiter. 
-		slim = np.zeros_like(sL)
+		# Apply slope limiter, which sets all elements of the limited slope
+		slim = ws.get('slim', shape)
 		self.limiter(sL, sR, slim)
 	
-		# Set left and right edge states in each cell (except one layer of ghost cells)
-		self.V_im12[slc3aC] = self.V[slc3aC] - slim * 0.5
-		self.V_ip12[slc3aC] = self.V[slc3aC] + slim * 0.5		
+		# Set left and right edge states in each cell (except one layer of ghost cells). The 
+		# buffers of the left and right slopes are free to be reused after this point.
+		half_slope = ws.get('sL', shape)
+		np.multiply(slim, 0.5, out = half_slope)
+		np.subtract(V[slc3aC], half_slope, out = V_im12)
+		np.add(V[slc3aC], half_slope, out = V_ip12)
 		
 		# Hancock step, if that time integration scheme is selected
+		self.hancockStep(idir, dt, V_im12, V_ip12, slim, slim)
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def hancockStep(self, idir, dt, V_im12, V_ip12, slope_im12, slope_ip12):
+		"""
+		Advance the cell-edge states by half a timestep
+		
+		This function performs the Hancock step of the reconstruction schemes if the ``hancock``
+		or ``hancock_cons`` time integration scheme is selected (see 
+		:func:`reconstructionLinear`); otherwise, it does nothing. The primitive Hancock step 
+		evolves each edge state according to the undivided spatial derivative at that edge, which 
+		is the same at both edges for a linear reconstruction. The conservative Hancock step uses
+		the fluxes of the edge states instead.
+		
+		Parameters
+		-------------------------------------------------------------------------------------------
+		idir: int
+			Direction of sweep (0 = x, 1 = y)
+		dt: float
+			Timestep
+		V_im12: array_like
+			Left cell-edge states, which are updated
+		V_ip12: array_like
+			Right cell-edge states, which are updated
+		slope_im12: array_like
+			Undivided derivative of the primitive variables at the left cell edge, with the same 
+			dimensions as the edge states
+		slope_ip12: array_like
+			Undivided derivative of the primitive variables at the right cell edge
+		"""
+		
+		ws = self.ws
+		shape = V_im12.shape
+		
 		if self.hs.time_integration == 'hancock':
 			fac = 0.5 * dt / self.dx
-			self.V_im12[slc3aC] += fac * self.primitiveEvolution(idir, self.V_im12[slc3aC], slim)
-			self.V_ip12[slc3aC] += fac * self.primitiveEvolution(idir, self.V_ip12[slc3aC], slim)
+			dV_dt = ws.get('sR', shape)
+			for V_edge, slope in [[V_im12, slope_im12], [V_ip12, slope_ip12]]:
+				self.primitiveEvolution(idir, V_edge, slope, dV_dt = dV_dt)
+				dV_dt *= fac
+				V_edge += dV_dt
 	
 		elif self.hs.time_integration == 'hancock_cons':
 			fac = 0.5 * dt / self.dx
-			U_im12 = self.primitiveToConservedRet(self.V_im12[slc3aC])
-			U_ip12 = self.primitiveToConservedRet(self.V_ip12[slc3aC])
-			F_im12 = self.fluxVector(idir, self.V_im12[slc3aC])
-			F_ip12 = self.fluxVector(idir, self.V_ip12[slc3aC])
-			Fdiff = (F_im12 - F_ip12)
-			U_im12 += fac * Fdiff
-			U_ip12 += fac * Fdiff
-			self.conservedToPrimitive(U_im12, self.V_im12[slc3aC])
-			self.conservedToPrimitive(U_ip12, self.V_ip12[slc3aC])
+			U_im12 = ws.get('UL', shape)
+			U_ip12 = ws.get('UR', shape)
+			F_im12 = ws.get('FL', shape)
+			F_ip12 = ws.get('FR', shape)
+			self.primitiveToConserved(V_im12, U_im12)
+			self.primitiveToConserved(V_ip12, U_ip12)
+			self.fluxVector(idir, V_im12, F = F_im12)
+			self.fluxVector(idir, V_ip12, F = F_ip12)
+			Fdiff = F_im12
+			Fdiff -= F_ip12
+			Fdiff *= fac
+			U_im12 += Fdiff
+			U_ip12 += Fdiff
+			self.conservedToPrimitive(U_im12, V_im12)
+			self.conservedToPrimitive(U_ip12, V_ip12)
+
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def hancockStepParabola(self, idir, dt, V, V_im12, V_ip12):
+		"""
+		Hancock step for the higher-order reconstruction schemes
+		
+		The cell-centered value and the edge values define a parabola in each cell, whose 
+		derivative at the edges is used for the primitive Hancock step (see :func:`hancockStep`). 
+		In the notation of Colella & Woodward 1984, the undivided derivatives at the left and 
+		right edges are :math:`\Delta a \pm a_6`, where :math:`\Delta a = a_R - a_L` is the 
+		difference of the edge values and :math:`a_6 = 6 a - 3 (a_L + a_R)`. 
+		
+		Where the parabola is not monotonic within the cell (which can happen with WENO 
+		reconstruction but not with monotonized PPM), the derivatives at the edges can be much 
+		larger than the change across the cell. There, the curvature :math:`-2 a_6` is limited to
+		1.25 times the smallest second difference of the cell-centered values in the cell and its
+		neighbors, and set to zero if the second differences do not all have its sign (similar to
+		Colella & Sekora 2008). This limiter preserves smooth extrema but not the oscillations 
+		that WENO reconstruction can create next to discontinuities.
+		
+		Parameters
+		-------------------------------------------------------------------------------------------
+		idir: int
+			Direction of sweep (0 = x, 1 = y)
+		dt: float
+			Timestep
+		V: array_like
+			Primitive fluid variables
+		V_im12: array_like
+			Left cell-edge states in all cells except two layers of ghost cells, which are updated
+		V_ip12: array_like
+			Right cell-edge states in all cells except two layers of ghost cells, which are updated
+		"""
+		
+		ws = self.ws
+		V_c = V[self.sliceAlong(idir, 2, -2)]
+		shape = V_im12.shape
+		slope_im12 = ws.get('lim_a', shape)
+		slope_ip12 = ws.get('slim', shape)
+		
+		if self.hs.time_integration == 'hancock':
+			a6 = ws.get('lim_b', shape)
+			d = ws.get('lim_c', shape)
+			np.add(V_im12, V_ip12, out = a6)
+			a6 *= -3.0
+			np.multiply(V_c, 6.0, out = d)
+			a6 += d
+			np.subtract(V_ip12, V_im12, out = d)
+			
+			# Find the cells where the parabola is not monotonic
+			mask = ws.get('mask_a', shape)
+			np.abs(a6, out = slope_im12)
+			np.abs(d, out = slope_ip12)
+			np.greater(slope_im12, slope_ip12, out = mask)
+			
+			# Limit the curvature in those cells
+			if np.any(mask):
+				curv = ws.get('UL', shape)
+				curv_lim = ws.get('UR', shape)
+				d2 = ws.get('FL', shape)
+				same = ws.get('FR', shape)
+				np.multiply(a6, -2.0, out = curv)
+				np.abs(curv, out = curv_lim)
+				for k in range(-1, 2):
+					V_m = V[self.sliceAlong(idir, k + 1, k - 3)]
+					V_0 = V[self.sliceAlong(idir, k + 2, k - 2)]
+					V_p = V[self.sliceAlong(idir, k + 3, k - 1)]
+					np.add(V_m, V_p, out = d2)
+					d2 -= V_0
+					d2 -= V_0
+					np.multiply(d2, curv, out = same)
+					np.greater(same, 0.0, out = same)
+					curv_lim *= same
+					np.abs(d2, out = d2)
+					d2 *= 1.25
+					np.minimum(curv_lim, d2, out = curv_lim)
+				np.copysign(curv_lim, curv, out = curv_lim)
+				curv_lim *= -0.5
+				np.copyto(a6, curv_lim, where = mask)
+			
+			np.add(d, a6, out = slope_im12)
+			np.subtract(d, a6, out = slope_ip12)
+
+		self.hancockStep(idir, dt, V_im12, V_ip12, slope_im12, slope_ip12)
+		
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def sliceAlong(self, idir, i0, i1):
+		"""
+		Slice of a fluid array along the sweep direction
+		
+		Parameters
+		-------------------------------------------------------------------------------------------
+		idir: int
+			Direction of sweep (0 = x, 1 = y)
+		i0: int
+			First index along the sweep direction
+		i1: int
+			End index along the sweep direction; can be negative (counting from the end) or zero
+			(meaning the end of the array)
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		slc: tuple
+			Slice that selects all variables and all cells perpendicular to the sweep
+		"""
+		
+		if i1 == 0:
+			i1 = None
+		if idir == 0:
+			slc = (slice(None), slice(i0, i1), slice(None))
+		else:
+			slc = (slice(None), slice(None), slice(i0, i1))
+		
+		return slc
+
+	# ---------------------------------------------------------------------------------------------
+
+	def reconstructionPPM(self, idir, dt, V, V_im12, V_ip12):
+		"""
+		Piecewise-parabolic reconstruction
+		
+		This function implements the piecewise-parabolic method (PPM) of Colella & Woodward 1984. 
+		The values at the interfaces are interpolated to fourth order from the cell-centered values
+		and the limited slopes of the two adjacent cells (using the selected slope limiter). They 
+		serve as the left and right edge values of a parabola in each cell, which are then 
+		monotonized: in local extrema, the parabola is flattened to a constant, and if the 
+		parabola would overshoot the edge values within the cell, the edge value on the opposite 
+		side is moved so that the derivative of the parabola vanishes at the cell edge.
+		
+		Instead of integrating the parabola over the domains of dependence of the interfaces 
+		(characteristic tracing), the edge states are advanced by half a timestep with a Hancock 
+		step that uses the derivative of the parabola at each edge (see 
+		:func:`hancockStepParabola`). The edge states are computed in all cells except two layers 
+		of ghost cells.
+		
+		Parameters
+		-------------------------------------------------------------------------------------------
+		idir: int
+			Direction of sweep (0 = x, 1 = y)
+		dt: float
+			Timestep
+		V: array_like
+			Primitive fluid variables
+		V_im12: array_like
+			Output array for the left cell-edge states (same dimensions as ``V``)
+		V_ip12: array_like
+			Output array for the right cell-edge states (same dimensions as ``V``)
+		"""
+		
+		ws = self.ws
+		slc3aL = self.slc3aL[idir]
+		slc3aR = self.slc3aR[idir]
+		slc3aC = self.slc3aC[idir]
+		
+		# Compute the limited slopes in all cells except one layer of ghost cells
+		shape = V[slc3aC].shape
+		sL = ws.get('sL', shape)
+		sR = ws.get('sR', shape)
+		np.subtract(V[slc3aC], V[slc3aL], out = sL)
+		np.subtract(V[slc3aR], V[slc3aC], out = sR)
+		slim = ws.get('slim', shape)
+		self.limiter(sL, sR, slim)
+		
+		# Interpolate the interface values between cells i and i+1, where i runs over all cells 
+		# except one layer of ghost cells on the left and two on the right
+		V_a = V[self.sliceAlong(idir, 1, -2)]
+		V_b = V[self.sliceAlong(idir, 2, -1)]
+		shape = V_a.shape
+		V_int = ws.get('lim_a', shape)
+		V_sum = ws.get('sL', shape)
+		np.subtract(slim[self.sliceAlong(idir, 0, -1)], slim[self.sliceAlong(idir, 1, 0)], out = V_int)
+		V_int *= 1.0 / 6.0
+		np.add(V_a, V_b, out = V_sum)
+		V_sum *= 0.5
+		V_int += V_sum
+		
+		# Set the edge values of the parabola in each cell except two layers of ghost cells
+		slc_cells = self.sliceAlong(idir, 2, -2)
+		V_c = V[slc_cells]
+		V_im12 = V_im12[slc_cells]
+		V_ip12 = V_ip12[slc_cells]
+		shape = V_c.shape
+		V_im12[...] = V_int[self.sliceAlong(idir, 0, -1)]
+		V_ip12[...] = V_int[self.sliceAlong(idir, 1, 0)]
+		
+		# Flatten the parabola in local extrema, i.e., where the edge values do not lie on either
+		# side of the cell value
+		dR = ws.get('sL', shape)
+		dL = ws.get('sR', shape)
+		mask = ws.get('mask_a', shape)
+		np.subtract(V_ip12, V_c, out = dR)
+		np.subtract(V_c, V_im12, out = dL)
+		dR *= dL
+		np.less_equal(dR, 0.0, out = mask)
+		np.copyto(V_im12, V_c, where = mask)
+		np.copyto(V_ip12, V_c, where = mask)
+		
+		# Where the parabola overshoots, move the opposite edge value. With d = aR - aL and 
+		# a6 = 6 a - 3 (aL + aR), the overshoot conditions are d * a6 > d^2 (set aL = 3 a - 2 aR) 
+		# and d * a6 < -d^2 (set aR = 3 a - 2 aL), which are mutually exclusive.
+		d = ws.get('sL', shape)
+		a6 = ws.get('sR', shape)
+		d2 = ws.get('lim_b', shape)
+		V_new = ws.get('lim_c', shape)
+		V_c3 = ws.get('lim_a', shape)
+		np.multiply(V_c, 3.0, out = V_c3)
+		np.subtract(V_ip12, V_im12, out = d)
+		np.add(V_im12, V_ip12, out = a6)
+		a6 *= -3.0
+		np.multiply(V_c3, 2.0, out = V_new)
+		a6 += V_new
+		a6 *= d
+		np.square(d, out = d2)
+		
+		np.greater(a6, d2, out = mask)
+		np.multiply(V_ip12, -2.0, out = V_new)
+		V_new += V_c3
+		np.copyto(V_im12, V_new, where = mask)
+		
+		np.negative(d2, out = d2)
+		np.less(a6, d2, out = mask)
+		np.multiply(V_im12, -2.0, out = V_new)
+		V_new += V_c3
+		np.copyto(V_ip12, V_new, where = mask)
+		
+		# Hancock step, if that time integration scheme is selected
+		self.hancockStepParabola(idir, dt, V, V_im12, V_ip12)
+		
+		return
 
+	# ---------------------------------------------------------------------------------------------
+
+	def reconstructionWENO5(self, idir, dt, V, V_im12, V_ip12):
+		"""
+		Fifth-order WENO reconstruction
+		
+		This function implements the weighted essentially non-oscillatory (WENO) reconstruction of
+		Jiang & Shu 1996, applied to each primitive variable separately. The edge value is a 
+		weighted average of the second-order interpolations from the three three-cell stencils 
+		that contain the cell. In smooth regions, the weights approach the values that combine 
+		the interpolations into a fifth-order interpolation from the five-cell stencil; near 
+		discontinuities, the weights of the stencils across the discontinuity become very small. 
+		There is no slope limiter. 
+		
+		Where the reconstructed density or pressure is not positive, both edge states of the cell 
+		are set to the cell-centered values. As in :func:`reconstructionPPM`, the edge states 
+		are advanced by the Hancock step of the parabola through the edge values (see 
+		:func:`hancockStepParabola`), and they are computed in all cells except two layers of 
+		ghost cells.
+		
+		Parameters
+		-------------------------------------------------------------------------------------------
+		idir: int
+			Direction of sweep (0 = x, 1 = y)
+		dt: float
+			Timestep
+		V: array_like
+			Primitive fluid variables
+		V_im12: array_like
+			Output array for the left cell-edge states (same dimensions as ``V``)
+		V_ip12: array_like
+			Output array for the right cell-edge states (same dimensions as ``V``)
+		"""
+		
+		ws = self.ws
+		
+		# The five-cell stencil of each cell except two layers of ghost cells. The left edge 
+		# value is computed from the mirrored stencil.
+		slc_cells = self.sliceAlong(idir, 2, -2)
+		stencil = [V[self.sliceAlong(idir, 2 + k, k - 2)] for k in range(-2, 3)]
+		V_c = stencil[2]
+		V_im12 = V_im12[slc_cells]
+		V_ip12 = V_ip12[slc_cells]
+		shape = V_c.shape
+		
+		self.weno5Edge(stencil, V_ip12)
+		self.weno5Edge(stencil[::-1], V_im12)
+		
+		# Fall back to the cell-centered values where the density or pressure is not positive
+		V_min = ws.get('tmp_a', shape[1:])
+		np.minimum(V_im12[DN], V_im12[PR], out = V_min)
+		np.minimum(V_min, V_ip12[DN], out = V_min)
+		np.minimum(V_min, V_ip12[PR], out = V_min)
+		mask = ws.get('mask_a', shape[1:])
+		np.less_equal(V_min, 0.0, out = mask)
+		if np.any(mask):
+			np.copyto(V_im12, V_c, where = mask)
+			np.copyto(V_ip12, V_c, where = mask)
+		
+		# Hancock step, if that time integration scheme is selected
+		self.hancockStepParabola(idir, dt, V, V_im12, V_ip12)
+		
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def weno5Edge(self, stencil, V_edge):
+		"""
+		WENO interpolation of the right edge value in each cell
+		
+		Parameters
+		-------------------------------------------------------------------------------------------
+		stencil: list
+			The primitive variables in the five cells of the stencil, ordered from left to right
+			(i.e., the cells i-2 to i+2 for the right edge of cell i); the left edge value is 
+			computed by passing the stencil in reverse order.
+		V_edge: array_like
+			Output array for the edge states
+		"""
+		
+		ws = self.ws
+		shape = V_edge.shape
+		weight = ws.get('lim_a', shape)
+		v_int = ws.get('lim_b', shape)
+		tmp = ws.get('lim_c', shape)
+		weight_sum = ws.get('sR', shape)
+		
+		# For each of the three sub-stencils, the optimal weight and the coefficients of the two 
+		# smoothness indicators and the interpolation
+		eps = 1E-6
+		sub_stencils = [[0.1, [1.0, -2.0, 1.0], [1.0, -4.0, 3.0], [2.0, -7.0, 11.0]], 
+						[0.6, [1.0, -2.0, 1.0], [1.0, 0.0, -1.0], [-1.0, 5.0, 2.0]], 
+						[0.3, [1.0, -2.0, 1.0], [3.0, -4.0, 1.0], [2.0, 5.0, -1.0]]]
+		
+		def linearCombination(k, coeffs, out):
+			np.multiply(stencil[k], coeffs[0], out = out)
+			for j in range(1, 3):
+				if coeffs[j] != 0.0:
+					np.multiply(stencil[k + j], coeffs[j], out = tmp)
+					out += tmp
+			return
+		
+		for k in range(3):
+			w_opt, c_beta1, c_beta2, c_int = sub_stencils[k]
+			
+			# Smoothness indicator, converted into the non-normalized weight
+			linearCombination(k, c_beta1, v_int)
+			np.square(v_int, out = weight)
+			weight *= 13.0 / 12.0
+			linearCombination(k, c_beta2, v_int)
+			np.square(v_int, out = v_int)
+			v_int *= 0.25
+			weight += v_int
+			weight += eps
+			np.square(weight, out = weight)
+			np.divide(w_opt, weight, out = weight)
+			
+			# Add the weighted interpolation
+			linearCombination(k, c_int, v_int)
+			v_int *= weight
+			if k == 0:
+				np.copyto(V_edge, v_int)
+				np.copyto(weight_sum, weight)
+			else:
+				V_edge += v_int
+				weight_sum += weight
+		
+		weight_sum *= 6.0
+		V_edge /= weight_sum
+		
 		return
 
 	# ---------------------------------------------------------------------------------------------
@@ -796,7 +2047,8 @@ class Simulation():
 			Output array of limited slope; must have same dimensions as sL and sR.
 		"""
 			
-		slim[:] = 0.5 * (sL + sR)	
+		np.add(sL, sR, out = slim)
+		slim *= 0.5
 		
 		return
 
@@ -807,7 +2059,13 @@ class Simulation():
 		Minimum-modulus limiter
 		
 		The most conservative limiter, which always chooses the shallower out of the left and 
-		right slopes.
+		right slopes. Where the slopes have opposite signs, the limited slope is zero.
+		
+		Like the other limiters, this function is written without masks or conditional copies. 
+		The shallower absolute slope is multiplied by one if the slopes have the same sign and 
+		zero otherwise, and the sign of the left slope is copied to the result. Adding zero turns
+		the resulting negative zeros into positive ones. All operations are exact, so the result 
+		is bit by bit the same as choosing one of the slopes.
 		
 		Parameters
 		-------------------------------------------------------------------------------------------
@@ -819,12 +2077,9 @@ class Simulation():
 			Output array of limited slope; must have same dimensions as sL and sR.
 		"""
 		
-		sL_abs = np.abs(sL)
-		sR_abs = np.abs(sR)
-		mask = (sL * sR > 0.0) & (sL_abs <= sR_abs)
-		slim[mask] = sL[mask]
-		mask = (sL * sR > 0.0) & (sL_abs > sR_abs)
-		slim[mask] = sR[mask]		
+		self.limiterMinModAbs(sL, sR, slim)
+		np.copysign(slim, sL, out = slim)
+		slim += 0.0
 		
 		return
 
@@ -835,7 +2090,11 @@ class Simulation():
 		The limiter of van Leer
 		
 		An intermediate limiter that is less conservative than minimum modulus but more 
-		conservative than monotonized central.
+		conservative than monotonized central. The limited slope is the harmonic mean of the left
+		and right slopes if they have the same sign, and zero otherwise. Instead of a masked 
+		division, the left slope is multiplied by zero where the slopes do not have the same sign. 
+		The denominator can only be zero in that case and is replaced by one to avoid dividing by 
+		zero. As in :func:`limiterMinMod`, adding zero removes the sign of zeros.
 		
 		Parameters
 		-------------------------------------------------------------------------------------------
@@ -847,8 +2106,49 @@ class Simulation():
 			Output array of limited slope; must have same dimensions as sL and sR.
 		"""
 		
-		mask = (sL * sR > 0.0)
-		slim[mask] = 2.0 * sL[mask]* sR[mask] / (sL[mask] + sR[mask])	
+		ws = self.ws
+		same = ws.get('lim_a', sL.shape)
+		denom = ws.get('lim_b', sL.shape)
+		np.multiply(sL, sR, out = same)
+		np.greater(same, 0.0, out = same)
+		np.multiply(sL, same, out = slim)
+		slim *= 2.0
+		slim *= sR
+		np.add(sL, sR, out = denom)
+		np.equal(denom, 0.0, out = same)
+		denom += same
+		slim /= denom
+		slim += 0.0
+		
+		return
+
+	# ---------------------------------------------------------------------------------------------
+
+	def limiterMinModAbs(self, sL, sR, slim):
+		"""
+		Absolute value of the minmod slope, used by the minmod and MC limiters
+		
+		Parameters
+		-------------------------------------------------------------------------------------------
+		sL: array_like
+			Array of left slopes
+		sR: array_like
+			Array of right slopes
+		slim: array_like
+			Output array for the absolute value of the shallower slope, or zero where the slopes
+			do not have the same sign (i.e., where their product is not positive)
+		"""
+		
+		ws = self.ws
+		same = ws.get('lim_a', sL.shape)
+		sR_abs = ws.get('lim_b', sL.shape)
+		
+		np.multiply(sL, sR, out = same)
+		np.greater(same, 0.0, out = same)
+		np.abs(sR, out = sR_abs)
+		sR_abs *= same
+		np.abs(sL, out = slim)
+		np.minimum(slim, sR_abs, out = slim)
 		
 		return
 
@@ -860,7 +2160,9 @@ class Simulation():
 		
 		As the name suggests, this limiter chooses the central derivative wherever possible, but 
 		reduces its slope where it would cause negative cell-edge values. This limiter leads to the
-		sharpest solutions but is also the least stable.
+		sharpest solutions but is also the least stable. Where the slopes have the same sign, the 
+		limited slope is the shallower of twice the minmod slope and the central slope, which both
+		have the sign of the left slope (see :func:`limiterMinMod`).
 		
 		Parameters
 		-------------------------------------------------------------------------------------------
@@ -872,21 +2174,22 @@ class Simulation():
 			Output array of limited slope; must have same dimensions as sL and sR.
 		"""
 		
-		sC = (sL + sR) * 0.5
-		sL_abs = np.abs(sL)
-		sR_abs = np.abs(sR)
-		mask = (sL * sR > 0.0) & (sL_abs <= sR_abs)
-		slim[mask] = 2.0 * sL[mask]
-		mask = (sL * sR > 0.0) & (sL_abs > sR_abs)
-		slim[mask] = 2.0 * sR[mask]
-		mask = np.abs(slim) > np.abs(sC)
-		slim[mask] = sC[mask]
+		self.limiterMinModAbs(sL, sR, slim)
+		slim *= 2.0
+		
+		sC_abs = self.ws.get('lim_c', sL.shape)
+		np.add(sL, sR, out = sC_abs)
+		sC_abs *= 0.5
+		np.abs(sC_abs, out = sC_abs)
+		np.minimum(slim, sC_abs, out = slim)
+		np.copysign(slim, sL, out = slim)
+		slim += 0.0
 		
 		return
 
 	# ---------------------------------------------------------------------------------------------
 	
-	def riemannSolverHLL(self, idir, VL, VR):
+	def riemannSolverHLL(self, idir, VL, VR, flux = None):
 		"""
 		The HLL Riemann solver
 		
@@ -904,6 +2207,8 @@ class Simulation():
 			Array of primitive state vectors on the left sides of the interfaces
 		VR: array_like
 			Array of primitive state vectors on the right sides of the interfaces
+		flux: array_like
+			Output array with the same dimensions as VL and VR; if ``None``, a new array is created.
 	
 		Returns
 		-------------------------------------------------------------------------------------------
@@ -911,21 +2216,31 @@ class Simulation():
 			Array of conservative fluxes across interfaces; has the same dimensions as VL and VR.
 		"""
 	
+		ws = self.ws
+		shape = VL.shape
+		shape2 = VL[DN].shape
+		if flux is None:
+			flux = np.zeros_like(VL)
+		
 		# Sound speed to the left and right of the interface
-		csL = self.soundSpeed(VL)
-		csR = self.soundSpeed(VR)
+		csL = self.soundSpeed(VL, cs = ws.get('csL', shape2))
+		csR = self.soundSpeed(VR, cs = ws.get('csR', shape2))
 		
 		# Maximum negative velocity to the left and positive velocity to the right
-		SL = VL[VX + idir] - csL
-		SR = VR[VX + idir] + csR
+		SL = ws.get('SL', shape2)
+		SR = ws.get('SR', shape2)
+		np.subtract(VL[VX + idir], csL, out = SL)
+		np.add(VR[VX + idir], csR, out = SR)
 		
 		# Get conserved states for left and right states
-		UL = self.primitiveToConservedRet(VL)
-		UR = self.primitiveToConservedRet(VR)
+		UL = ws.get('UL', shape)
+		UR = ws.get('UR', shape)
+		self.primitiveToConserved(VL, UL)
+		self.primitiveToConserved(VR, UR)
 		
 		# F(V) on the left and right
-		FL = self.fluxVector(idir, VL)
-		FR = self.fluxVector(idir, VR)
+		FL = self.fluxVector(idir, VL, F = ws.get('FL', shape))
+		FR = self.fluxVector(idir, VR, F = ws.get('FR', shape))
 		
 		# Formula for the HLL Riemann solver. We first set all fields to the so-called HLL flux, i.e.,
 		# the flux in the intermediate state between the two fastest waves SL and SR. If even SL is 
@@ -933,15 +2248,214 @@ class Simulation():
 		# going to the left, we take the right flux. Since these cases can be rare in some problems,
 		# we first do a quick check whether there are any cells that match the condition before setting
 		# them to the correct fluxes.
-		flux = (SR * FL - SL * FR + SL * SR * (UR - UL)) / (SR - SL)
+		# flux = (SR * FL - SL * FR + SL * SR * (UR - UL)) / (SR - SL)
+		# The conserved state buffers are overwritten with intermediate terms.
+		hll = ws.get('hll', shape2)
+		np.multiply(SR, FL, out = flux)
+		UR -= UL
+		np.multiply(SL, FR, out = UL)
+		flux -= UL
+		np.multiply(SL, SR, out = hll)
+		UR *= hll
+		flux += UR
+		np.subtract(SR, SL, out = hll)
+		flux /= hll
 
 		# Check for cases where all speeds are on one side of the fan		
-		if np.any(SL >= 0.0):
-			mask_L = (SL >= 0.0)
-			flux[:, mask_L] = FL[:, mask_L]
-		if np.any(SR <= 0.0):
-			mask_R = (SR <= 0.0)
-			flux[:, mask_R] = FR[:, mask_R]
+		mask = ws.get('mask_a', shape2)
+		np.greater_equal(SL, 0.0, out = mask)
+		if np.any(mask):
+			np.copyto(flux, FL, where = mask)
+		np.less_equal(SR, 0.0, out = mask)
+		if np.any(mask):
+			np.copyto(flux, FR, where = mask)
+		
+		return flux
+
+	# ---------------------------------------------------------------------------------------------
+	
+	def riemannSolverHLLC(self, idir, VL, VR, flux = None):
+		"""
+		The HLLC Riemann solver
+		
+		The HLLC solver (Toro et al. 1994) restores the contact discontinuity that the HLL solver
+		ignores. Between the fastest waves SL and SR, it considers two intermediate states that
+		are separated by the contact wave, which moves with the speed S* (Toro 2009, Eq. 10.37). 
+		The wave speeds are the estimates of Davis (1988), SL = min(uL - csL, uR - csR) and 
+		SR = max(uL + csL, uR + csR), which bound the signal speeds of both states. With the 
+		one-sided estimates of :func:`riemannSolverHLL`, Eq. 10.37 reduces to the acoustic 
+		estimate of S*, which can lie outside the wave fan if the pressure jump is large. Each 
+		interface takes the flux of the state in which it lies, F*K = FK + SK (U*K - UK) for 
+		the side K on which the interface lies relative to the contact. Density jumps are thus 
+		advected with much less diffusion than with the HLL flux, at the cost of somewhat more 
+		operations per interface.
+		
+		The four cases are combined without branching on the states: we select the side K by the
+		sign of S* and replace SK by min(SL, 0) or max(SR, 0), which makes the correction vanish 
+		if all waves move in the same direction. All intermediate results are kept in workspace 
+		buffers.
+		
+		Parameters
+		-------------------------------------------------------------------------------------------
+		idir: int
+			Direction of sweep (0 = x, 1 = y)
+		VL: array_like
+			Array of primitive state vectors on the left sides of the interfaces
+		VR: array_like
+			Array of primitive state vectors on the right sides of the interfaces
+		flux: array_like
+			Output array with the same dimensions as VL and VR; if ``None``, a new array is created.
+	
+		Returns
+		-------------------------------------------------------------------------------------------
+		flux: array_like
+			Array of conservative fluxes across interfaces; has the same dimensions as VL and VR.
+		"""
+	
+		ws = self.ws
+		shape = VL.shape
+		shape2 = VL[DN].shape
+		if flux is None:
+			flux = np.zeros_like(VL)
+		i1 = VX + idir
+		i2 = VX + (idir + 1) % 2
+		
+		# Wave speed estimates of Davis (1988); conserved states and fluxes as in the HLL solver
+		csL = self.soundSpeed(VL, cs = ws.get('csL', shape2))
+		csR = self.soundSpeed(VR, cs = ws.get('csR', shape2))
+		SL = ws.get('SL', shape2)
+		SR = ws.get('SR', shape2)
+		tmp = ws.get('hll', shape2)
+		np.subtract(VL[i1], csL, out = SL)
+		np.subtract(VR[i1], csR, out = tmp)
+		np.minimum(SL, tmp, out = SL)
+		np.add(VR[i1], csR, out = SR)
+		np.add(VL[i1], csL, out = tmp)
+		np.maximum(SR, tmp, out = SR)
+		UL = ws.get('UL', shape)
+		UR = ws.get('UR', shape)
+		self.primitiveToConserved(VL, UL)
+		self.primitiveToConserved(VR, UR)
+		FL = self.fluxVector(idir, VL, F = ws.get('FL', shape))
+		FR = self.fluxVector(idir, VR, F = ws.get('FR', shape))
+		
+		# Speed of the contact wave, S* = (pR - pL + mL uL - mR uR) / (mL - mR), where 
+		# mK = rhoK (SK - uK) (Toro 2009, Eq. 10.37). Since SL < uL and SR > uR for any valid 
+		# states, the denominator is negative. The temporary buffer of the conversion functions is
+		# free from here on, and the sound speeds are no longer needed.
+		sstar = ws.get('tmp_a', shape2)
+		mL = csL
+		mR = csR
+		np.subtract(SL, VL[i1], out = mL)
+		mL *= VL[DN]
+		np.subtract(SR, VR[i1], out = mR)
+		mR *= VR[DN]
+		np.multiply(mL, VL[i1], out = sstar)
+		np.multiply(mR, VR[i1], out = tmp)
+		sstar -= tmp
+		sstar += VR[PR]
+		sstar -= VL[PR]
+		np.subtract(mL, mR, out = tmp)
+		sstar /= tmp
+		
+		# Select the side of the contact on which each interface lies. The buffers of the left 
+		# side now hold UK and FK, the right conserved state buffer holds VK, csL holds the 
+		# limited wave speed sK, and SL holds the unlimited wave speed SK.
+		mask = ws.get('mask_a', shape2)
+		np.less(sstar, 0.0, out = mask)
+		np.copyto(UL, UR, where = mask)
+		np.copyto(FL, FR, where = mask)
+		VK = UR
+		np.copyto(VK, VL)
+		np.copyto(VK, VR, where = mask)
+		sK = csL
+		np.minimum(SL, 0.0, out = sK)
+		np.maximum(SR, 0.0, out = csR)
+		np.copyto(sK, csR, where = mask)
+		SK = SL
+		np.copyto(SK, SR, where = mask)
+		
+		# Mass flux through the wave relative to the fluid, m = rhoK (SK - uK), and the ratio 
+		# sK / (SK - S*). The denominator vanishes only if sK is zero, in which case we set it to 
+		# one to obtain a zero ratio.
+		m = SR
+		np.subtract(SK, VK[i1], out = m)
+		m *= VK[DN]
+		np.subtract(SK, sstar, out = tmp)
+		np.equal(sK, 0.0, out = mask)
+		np.copyto(tmp, 1.0, where = mask)
+		ratio = csR
+		np.divide(sK, tmp, out = ratio)
+		
+		# Energy term of the intermediate state, (m S* + pK) (S* - uK) sK / (SK - S*), plus the 
+		# term m EK / rhoK sK / (SK - S*) 
+		etot = tmp
+		np.multiply(m, sstar, out = etot)
+		etot += VK[PR]
+		np.subtract(sstar, VK[i1], out = SK)
+		etot *= SK
+		etot *= ratio
+		ratio *= m
+		np.divide(UL[ET], VK[DN], out = SK)
+		SK *= ratio
+		etot += SK
+		
+		# flux = FK - sK UK + m sK / (SK - S*) (1, S*, u2K, etot)
+		UL *= sK
+		np.subtract(FL, UL, out = flux)
+		flux[DN] += ratio
+		np.multiply(ratio, sstar, out = SK)
+		flux[i1] += SK
+		np.multiply(ratio, VK[i2], out = SK)
+		flux[i2] += SK
+		flux[ET] += etot
+		
+		return flux
+
+	# ---------------------------------------------------------------------------------------------
+	
+	def riemannSolverExact(self, idir, VL, VR, flux = None):
+		"""
+		The exact Riemann solver
+		
+		The Godunov flux is computed from the exact solution of the Riemann problem at each 
+		interface, i.e., from the state that lies on the interface once the waves have formed (see
+		the :mod:`~ulula.riemann` module). The velocity perpendicular to the sweep is advected with
+		the contact, meaning that it is taken from the left state if the star velocity is positive
+		and from the right state otherwise. The star pressure is found by a Newton iteration on all
+		interfaces at once, which typically takes a few iterations and makes this solver several 
+		times more expensive than the approximate solvers. It serves mostly as a reference. Unlike
+		the other solvers, it does not use the workspace, and the functions of the
+		:mod:`~ulula.riemann` module allocate temporary arrays of the size of the interface arrays.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		idir: int
+			Direction of sweep (0 = x, 1 = y)
+		VL: array_like
+			Array of primitive state vectors on the left sides of the interfaces
+		VR: array_like
+			Array of primitive state vectors on the right sides of the interfaces
+		flux: array_like
+			Output array with the same dimensions as VL and VR; if ``None``, a new array is created.
+	
+		Returns
+		-------------------------------------------------------------------------------------------
+		flux: array_like
+			Array of conservative fluxes across interfaces; has the same dimensions as VL and VR.
+		"""
+		
+		i1 = VX + idir
+		i2 = VX + (idir + 1) % 2
+		
+		p_star, u_star = ulula_riemann.starState(VL[DN], VL[i1], VL[PR], VR[DN], VR[i1], VR[PR],
+												self.gamma)
+		V_int = np.empty_like(VL)
+		V_int[DN], V_int[i1], V_int[PR] = ulula_riemann.sampleSolution(0.0, VL[DN], VL[i1], VL[PR], 
+												VR[DN], VR[i1], VR[PR], self.gamma, p_star, u_star)
+		np.copyto(V_int[i2], VR[i2])
+		np.copyto(V_int[i2], VL[i2], where = (u_star >= 0.0))
+		flux = self.fluxVector(idir, V_int, F = flux)
 		
 		return flux
 
@@ -952,7 +2466,12 @@ class Simulation():
 		Compute the size of the next timestep
 		
 		This function computes the maximum signal speed anywhere in the domain and sets a timestep
-		based on the CFL condition. This routine 
+		based on the CFL condition. During a timestep, the maximum speed is computed along with 
+		the final conversion to primitive variables, where the new fluid state is in the cache 
+		anyway, and the resulting timestep is stored in ``dt_cfl``. In that case, this function 
+		returns the stored value and does not need to make another pass over the domain. The 
+		timestep is the same either way. If the fluid state is changed from the outside, the 
+		stored value is discarded by :func:`enforceBoundaryConditions`.
 		
 		Returns
 		-------------------------------------------------------------------------------------------
@@ -960,13 +2479,427 @@ class Simulation():
 			Size of the next timestep
 		"""
 		
+		if self.in_ensemble:
+			raise Exception('Cannot compute the timestep of an ensemble member; the ensemble must be advanced instead.')
+		if self.dt_cfl is not None:
+			return self.dt_cfl
+		
 		u_max = self.maxSpeedInDomain()
+		dt = self.cflTimestep(u_max)
+		
+		return dt
+
+	# ---------------------------------------------------------------------------------------------
+
+	def cflTimestep(self, u_max):
+		"""
+		Timestep allowed by the CFL condition for a given signal speed
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		u_max: float
+			Largest signal speed in the domain
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		dt: float
+			Size of the timestep
+		"""
+		
 		dt = self.hs.cfl * self.dx / u_max
 		
 		return dt
 		
 	# ---------------------------------------------------------------------------------------------
 	
+	def sweepNumpy(self, idir, dt, max_speed = False, rk_stage = None, convert = True):
+		"""
+		Directional sweep with vectorized NumPy operations
+		
+		In each direction, we reconstruct the cell-edge states, compute the conservative Godunov 
+		fluxes with the Riemann solver, add the flux difference to the conserved fluid variables, 
+		and convert them back to primitive variables. The ghost cells must be set by the boundary 
+		conditions afterwards.
+		
+		If the sweeps are not tiled, each of those steps is executed over the entire domain. On 
+		large grids, this means that every step streams its inputs and outputs through main 
+		memory. Otherwise, all steps are executed on one tile at a time (see 
+		:func:`createTiles`), and the scratch buffers are reused for each tile so that they 
+		remain in the cache. The primitive variables of a tile are updated only after the next 
+		tile has been swept, since the tiles overlap in the x-direction. The result does not 
+		depend on the tiling.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		idir: int
+			Direction of sweep (0 = x, 1 = y)
+		dt: float
+			Timestep
+		max_speed: bool
+			If ``True``, compute the largest signal speed in the physical domain after the sweep 
+			(see :func:`maxSpeedInDomain`) along with the conversion to primitive variables.
+		rk_stage: tuple
+			If not ``None``, the sweep is a stage of a Runge-Kutta integrator, given by the weights
+			of the initial state in ``U_rk`` and of the fluxes (see ``rk_stages`` and 
+			:func:`sweepArrays`).
+		convert: bool
+			If ``False``, the conserved variables are not converted to primitive variables after 
+			the sweep, and ``max_speed`` is ignored. This way, the next sweep starts from the same
+			primitive state.
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		c_max: float
+			Largest signal speed if ``max_speed`` is ``True``, otherwise ``None``.
+		"""
+
+		if self.slc_tiles is None:
+			
+			# Sweep the physical pencils, i.e., exclude the ghost cells perpendicular to the sweep
+			if idir == 0:
+				slc = (slice(None), slice(None), self.slc1dC[1])
+			else:
+				slc = (slice(None), self.slc1dC[0], slice(None))
+			if self.flux_store is None:
+				flux_out = None
+			else:
+				flux_out = self.flux_store[idir]
+			if rk_stage is None:
+				U_rk = None
+			else:
+				U_rk = self.U_rk[slc]
+			self.sweepArrays(idir, dt, self.V[slc], self.U[slc], self.V_im12[slc], self.V_ip12[slc],
+							flux_out = flux_out, U_rk = U_rk, rk_stage = rk_stage)
+		
+			# Convert U -> V; this way, we are sure that plotting functions etc find both the 
+			# correct conserved and primitive variables.
+			if convert:
+				c_max = self.conservedToPrimitiveDomain(max_speed = max_speed)
+			else:
+				c_max = None
+		
+		else:
+			if max_speed:
+				slc_speed = (slice(None), slice(None), self.slc1dC[1])
+			else:
+				slc_speed = None
+			c_max_tiles = []
+			slc_conv = None
+			for tile in self.slc_tiles[idir]:
+				slc = tile['slc']
+				if self.flux_store is None:
+					flux_out = None
+				else:
+					flux_out = self.flux_store[idir][tile['slc_flux']]
+				if rk_stage is None:
+					U_rk = None
+				else:
+					U_rk = self.U_rk[slc]
+				self.sweepArrays(idir, dt, self.V[slc], self.U[slc], self.V_im12[slc], self.V_ip12[slc],
+								slc3d = (tile['slc3dL'], tile['slc3dR'], tile['slc3dC']), 
+								flux_out = flux_out, U_rk = U_rk, rk_stage = rk_stage)
+				if (slc_conv is not None) and convert:
+					c_max_tiles.append(self.conservedToPrimitive(self.U[slc_conv], self.V[slc_conv], 
+																slc_speed = slc_speed))
+				slc_conv = tile['slc_conv']
+			if convert:
+				c_max_tiles.append(self.conservedToPrimitive(self.U[slc_conv], self.V[slc_conv], 
+															slc_speed = slc_speed))
+			if max_speed and convert:
+				c_max = max(c_max_tiles)
+			else:
+				c_max = None
+		
+		return c_max
+
+	# ---------------------------------------------------------------------------------------------
+	
+	def sweepArrays(self, idir, dt, V, U, V_im12, V_ip12, slc3d = None, flux_out = None, U_rk = None,
+				rk_stage = None):
+		"""
+		Update the conserved variables in a set of pencils
+		
+		This function performs the reconstruction, Riemann solver, and flux difference steps of
+		:func:`sweepNumpy` on a given set of arrays, which can be the entire domain or a tile. 
+		The arrays must contain at least ``nghost`` cells on either side of the updated cells 
+		along the sweep direction.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		idir: int
+			Direction of sweep (0 = x, 1 = y)
+		dt: float
+			Timestep
+		V: array_like
+			Primitive fluid variables
+		U: array_like
+			Conserved fluid variables, which are updated
+		V_im12: array_like
+			Array for the left cell-edge states
+		V_ip12: array_like
+			Array for the right cell-edge states
+		slc3d: tuple
+			Slices of the updated cells shifted left, shifted right, and centered (see 
+			``slc3dL``, ``slc3dR``, ``slc3dC``); if ``None``, the slices of the entire domain 
+			are used.
+		flux_out: array_like
+			If not ``None``, the fluxes across the interfaces of the updated cells are copied into 
+			this array (see :func:`createFluxStore`).
+		U_rk: array_like
+			Conserved fluid variables at the beginning of the Runge-Kutta step; used only if 
+			``rk_stage`` is given.
+		rk_stage: tuple
+			If not ``None``, the weights ``(w_old, w_flux)`` of a Runge-Kutta stage. The conserved 
+			variables are then set to the average of ``U_rk`` (with weight ``w_old``) and the Euler
+			update, and the fluxes, multiplied by ``w_flux``, are added to ``flux_out`` rather than 
+			copied.
+		"""
+
+		# Load slices for this dimension
+		if slc3d is None:
+			slc3dL = self.slc3dL[idir]
+			slc3dR = self.slc3dR[idir]
+			slc3dC = self.slc3dC[idir]
+		else:
+			slc3dL, slc3dR, slc3dC = slc3d
+		slc3fL = self.slc3fL[idir]
+		slc3fR = self.slc3fR[idir]
+		
+		# Reconstruct states at left and right cell edges
+		self.reconstruction(idir, dt, V, V_im12, V_ip12)
+		
+		# Use states at cell edges (right edges in left cells, left edges in right cells) as 
+		# input for the Riemann solver, which computes the Godunov fluxes at the interface 
+		# walls. Here, we call interface i the interface between cells i-1 and i.
+		VL = V_ip12[slc3dL]
+		flux = self.riemannSolver(idir, VL, V_im12[slc3dR], flux = self.ws.get('flux', VL.shape))
+		if (flux_out is not None) and (rk_stage is None):
+			flux_out[...] = flux
+	
+		# Update conserved fluid state. We are using Godunov's scheme, as in, we difference the 
+		# fluxes taken from the Riemann solver. Note the convention that index i in the flux array
+		# means the left interface of cell i, and i+1 the right interface of cell i. The buffer
+		# for the left conserved states is free to hold the update.
+		dU = self.ws.get('UL', U[slc3dC].shape)
+		np.subtract(flux[slc3fL], flux[slc3fR], out = dU)
+		dU *= dt / self.dx
+		if (rk_stage is None) or (rk_stage[0] == 0.0):
+			np.add(U[slc3dC], dU, out = U[slc3dC])
+		else:
+			dU += U[slc3dC]
+			dU *= 1.0 - rk_stage[0]
+			np.multiply(U_rk[slc3dC], rk_stage[0], out = U[slc3dC])
+			U[slc3dC] += dU
+		
+		# In a Runge-Kutta stage, the fluxes are accumulated such that the stored flux is the 
+		# effective flux over the entire step
+		if (flux_out is not None) and (rk_stage is not None):
+			flux *= rk_stage[1]
+			flux_out += flux
+		
+		return
+
+	# ---------------------------------------------------------------------------------------------
+	
+	def sweepNumba(self, idir, dt, max_speed = False):
+		"""
+		Directional sweep with a fused, JIT-compiled kernel
+		
+		This function performs the same operations as :func:`sweepNumpy`, but in a single compiled
+		loop over one-dimensional pencils of cells along the sweep direction (see the 
+		``backend_numba`` module). Only the physical domain is updated; the ghost cells are set by
+		the boundary conditions afterwards.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		idir: int
+			Direction of sweep (0 = x, 1 = y)
+		dt: float
+			Timestep
+		max_speed: bool
+			If ``True``, compute the largest signal speed in the physical domain after the sweep 
+			(see :func:`maxSpeedInDomain`).
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		c_max: float
+			Largest signal speed if ``max_speed`` is ``True``, otherwise ``None``.
+		"""
+		
+		# Arrange the fluid arrays as [nq, pencil, cell] views, with the sweep along the last 
+		# dimension and only the physical pencils. The pencils are divided into strips that are
+		# distributed among threads; the kernel releases the GIL.
+		if idir == 0:
+			slc = (slice(None), slice(None), self.slc1dC[1])
+			V = self.V[slc].transpose(0, 2, 1)
+			U = self.U[slc].transpose(0, 2, 1)
+			if self.flux_store is not None:
+				F = self.flux_store[idir].transpose(0, 2, 1)
+			lo = self.xlo
+			hi = self.xhi
+		else:
+			slc = (slice(None), self.slc1dC[0], slice(None))
+			V = self.V[slc]
+			U = self.U[slc]
+			if self.flux_store is not None:
+				F = self.flux_store[idir]
+			lo = self.ylo
+			hi = self.yhi
+		
+		# The kernel writes the fluxes only if the flux array contains any pencils
+		if self.flux_store is None:
+			F = np.zeros((self.nq, 0, 0), dtype = self.dtype)
+		
+		args_list = []
+		for slc in self.slc_pencils[idir]:
+			if self.flux_store is None:
+				F_strip = F
+			else:
+				F_strip = F[:, slc, :]
+			args_list.append((V[:, slc, :], U[:, slc, :], F_strip, VX + idir, VX + (idir + 1) % 2, lo, hi, 
+							self.hs.reconstruction == 'linear', 
+							self.numba.limiter_codes[self.hs.limiter], 
+							self.numba.time_integration_codes[self.hs.time_integration], 
+							self.numba.riemann_codes[self.hs.riemann], 
+							dt, self.dx, self.gamma, self.gm1, self.gm1_inv, max_speed))
+		res = self.runParallel(self.numba.sweep, args_list)
+		err = max([r[0] for r in res])
+		
+		if err == self.numba.ERR_PRESSURE:
+			raise self.invalidStateError('Zero or negative pressure found.')
+		elif err == self.numba.ERR_SOUND_SPEED:
+			raise self.invalidStateError('Could not compute sound speed.')
+		
+		if max_speed:
+			c_max = max([r[1] for r in res])
+		else:
+			c_max = None
+		
+		return c_max
+
+	# ---------------------------------------------------------------------------------------------
+	
+	def unsplitStep(self, dt, max_speed = False):
+		"""
+		Unsplit update with the corner transport upwind (CTU) scheme
+		
+		Instead of two directional sweeps, this function computes the fluxes in both directions 
+		from the same initial state and adds them to the conserved variables in a single update. 
+		On its own, such an update would ignore the waves that cross a cell diagonally and would be
+		unstable for CFL numbers above 0.5. The CTU scheme of Colella (1990) takes them into 
+		account by correcting the cell-edge states with the transverse flux differences before the
+		final Riemann problems are solved:
+		
+		1. The edge states in both directions are reconstructed (including the Hancock step) in 
+		   all cells that border the physical domain. 
+		2. The Riemann solver gives preliminary fluxes in each direction, whose differences across
+		   a cell change the conserved edge states in the other direction by half a timestep.
+		3. The corrected edge states give the final fluxes, whose differences are added to the 
+		   conserved variables.
+
+		This method needs twice as many Riemann problems as a split step, but it converts the fluid
+		state to primitive variables once rather than twice per timestep, it needs to fill the 
+		ghost cells only once, and it is stable up to a CFL number of one. The ghost cells must
+		be filled including the corners. The update is always executed over the entire domain, 
+		meaning that the ``tile_size`` parameter is ignored. Since the transverse corrections 
+		amplify the oscillations that WENO reconstruction can create next to strong shocks (see 
+		:func:`reconstructionWENO5`), that combination is not robust, e.g., in the Sedov-Taylor 
+		explosion.
+
+		Parameters
+		-------------------------------------------------------------------------------------------
+		dt: float
+			Timestep
+		max_speed: bool
+			If ``True``, compute the largest signal speed in the physical domain after the update 
+			(see :func:`maxSpeedInDomain`) along with the conversion to primitive variables.
+
+		Returns
+		-------------------------------------------------------------------------------------------
+		c_max: float
+			Largest signal speed if ``max_speed`` is ``True``, otherwise ``None``.
+		"""
+		
+		ws = self.ws
+		V = self.V
+		xlo = self.xlo
+		xhi = self.xhi
+		ylo = self.ylo
+		yhi = self.yhi
+		fac = 0.5 * dt / self.dx
+		
+		# Reconstruct the edge states in both directions; this includes the half-step in time of 
+		# the Hancock schemes along the respective direction.
+		self.reconstruction(0, dt, V, self.V_im12, self.V_ip12)
+		self.reconstruction(1, dt, V, self.V_jm12, self.V_jp12)
+		
+		# The x-edge states are needed in the physical rows and in one layer of ghost cells along
+		# x, and vice versa for the y-edge states
+		slc_x = (slice(None), slice(xlo - 1, xhi + 2), slice(ylo, yhi + 1))
+		slc_y = (slice(None), slice(xlo, xhi + 1), slice(ylo - 1, yhi + 2))
+		
+		# Preliminary fluxes across the y-interfaces of the cells that hold the x-edge states, 
+		# and vice versa. Index j refers to the lower interface of cell j.
+		VL = self.V_jp12[:, xlo - 1:xhi + 2, ylo - 1:yhi + 1]
+		G_t = self.riemannSolver(1, VL, self.V_jm12[:, xlo - 1:xhi + 2, ylo:yhi + 2], 
+								flux = ws.get('lim_a', VL.shape))
+		VL = self.V_ip12[:, xlo - 1:xhi + 1, ylo - 1:yhi + 2]
+		F_t = self.riemannSolver(0, VL, self.V_im12[:, xlo:xhi + 2, ylo - 1:yhi + 2], 
+								flux = ws.get('lim_b', VL.shape))
+		
+		# Correct the conserved edge states by the transverse flux differences over half a 
+		# timestep. The corrected primitive states are kept in separate buffers because the 
+		# edge states of piecewise-constant reconstruction are the fluid variables themselves.
+		# Near strong shocks, the correction can lead to negative densities or pressures; in 
+		# those cells, we fall back to the uncorrected state (as in Stone et al. 2008).
+		corrected = []
+		for slc, V_im12, V_ip12, dF, names in [
+				[slc_x, self.V_im12, self.V_ip12, (G_t[:, :, :-1], G_t[:, :, 1:]), ['sL', 'sR']], 
+				[slc_y, self.V_jm12, self.V_jp12, (F_t[:, :-1, :], F_t[:, 1:, :]), ['slim', 'lim_c']]]:
+			shape = V_im12[slc].shape
+			dU = ws.get('UR', shape)
+			np.subtract(dF[0], dF[1], out = dU)
+			dU *= fac
+			for V_edge, name in [[V_im12, names[0]], [V_ip12, names[1]]]:
+				U_edge = ws.get('UL', shape)
+				self.primitiveToConserved(V_edge[slc], U_edge)
+				U_edge += dU
+				V_corr = ws.get(name, shape)
+				self.conservedToPrimitive(U_edge, V_corr, check = False)
+				V_min = ws.get('tmp_a', shape[1:])
+				invalid = ws.get('mask_a', shape[1:])
+				np.minimum(V_corr[DN], V_corr[PR], out = V_min)
+				np.greater(V_min, 0.0, out = invalid)
+				np.logical_not(invalid, out = invalid)
+				if np.any(invalid):
+					np.copyto(V_corr, V_edge[slc], where = invalid)
+				corrected.append(V_corr)
+		V_xm, V_xp, V_ym, V_yp = corrected
+		
+		# Final fluxes and update of the conserved variables. The buffer of the preliminary 
+		# y-fluxes is free to hold the update.
+		U = self.U[self.slc3dom]
+		dU = ws.get('lim_a', U.shape)
+		VL = V_xp[:, :-1, :]
+		flux = self.riemannSolver(0, VL, V_xm[:, 1:, :], flux = ws.get('flux', VL.shape))
+		np.subtract(flux[:, :-1, :], flux[:, 1:, :], out = dU)
+		if self.flux_store is not None:
+			self.flux_store[0][...] = flux
+		VL = V_yp[:, :, :-1]
+		flux = self.riemannSolver(1, VL, V_ym[:, :, 1:], flux = ws.get('flux', VL.shape))
+		dU += flux[:, :, :-1]
+		dU -= flux[:, :, 1:]
+		if self.flux_store is not None:
+			self.flux_store[1][...] = flux
+		dU *= dt / self.dx
+		U += dU
+		
+		c_max = self.conservedToPrimitiveDomain(max_speed = max_speed)
+		
+		return c_max
+
+	# ---------------------------------------------------------------------------------------------
+	
 	def timestep(self, dt = None):
 		"""
 		Advance the fluid state by one timestep
@@ -980,6 +2913,18 @@ class Simulation():
 		perfectly cancel. However, we omit this complication, given that the timestep should not
 		change drastically between steps.
 		
+		With the Runge-Kutta schemes, each directional sweep consists of two or three stages, 
+		i.e., Euler steps that start from the updated state and are averaged with the initial 
+		state of the sweep (kept in ``U_rk``). If the ``unsplit`` option is set, each stage 
+		instead takes an Euler step in both directions from the same state, and the stages 
+		average with the initial state of the timestep. If a flux store exists (see 
+		:func:`createFluxStore`), it holds the weighted sum of the stage fluxes, which is the 
+		effective flux of the timestep.
+		
+		With the Euler and Hancock schemes, the ``unsplit`` option replaces the two sweeps by a 
+		single corner transport upwind update (see :func:`unsplitStep`), which needs all ghost 
+		cells of the primitive variables including the corners.
+		
 		Parameters
 		-------------------------------------------------------------------------------------------
 		dt: float
@@ -995,46 +2940,80 @@ class Simulation():
 			The timestep taken
 		"""
 			
-		# If the timestep is not given, compute it from the CFL condition
+		if self.in_ensemble:
+			raise Exception('Cannot advance an ensemble member on its own; the ensemble must be advanced instead.')
+		
+		# If the timestep is not given, compute it from the CFL condition. Either way, the stored
+		# CFL timestep is no longer valid once the fluid state changes.
 		if dt is None:
 			dt = self.cflCondition()
+		self.dt_cfl = None
 	
 		# Use Strang splitting to maintain 2nd order accuracy; we go xy-yx-xy-yx and so on
 		if self.last_dir == 0:
 			dirs = [0, 1]
 		else:
 			dirs = [1, 0]
+		
+		# The Runge-Kutta stages accumulate the fluxes
+		if self.hs.time_integration in rk_stages:
+			stages = rk_stages[self.hs.time_integration]
+			if self.flux_store is not None:
+				for F in self.flux_store:
+					F.fill(0.0)
+		else:
+			stages = None
+		
+		if (stages is not None) and self.hs.unsplit:
 			
-		for idir in dirs:
-	
-			# Load slices for this dimension
-			slc3dL = self.slc3dL[idir]
-			slc3dR = self.slc3dR[idir]
-			slc3dC = self.slc3dC[idir]
-			slc3fL = self.slc3fL[idir]
-			slc3fR = self.slc3fR[idir]
-			
-			# Reconstruct states at left and right cell edges
-			self.reconstruction(idir, dt)
+			# In each stage, both sweeps start from the same primitive state, and the update is 
+			# converted to primitive variables only after the second sweep
+			np.copyto(self.U_rk, self.U)
+			for i in range(len(stages)):
+				for idir in dirs:
+					self.enforceBoundaryConditions(idir)
+				self.sweep(dirs[0], dt, rk_stage = (0.0, stages[i][1]), convert = False)
+				c_max = self.sweep(dirs[1], dt, max_speed = (i == len(stages) - 1), rk_stage = stages[i])
+				self.bc_stale = set(['x', 'y', 'corners'])
+		
+		elif self.hs.unsplit:
 			
-			# Use states at cell edges (right edges in left cells, left edges in right cells) as 
-			# input for the Riemann solver, which computes the Godunov fluxes at the interface 
-			# walls. Here, we call interface i the interface between cells i-1 and i.
-			flux = self.riemannSolver(idir, self.V_ip12[slc3dL], self.V_im12[slc3dR])
-		
-			# Update conserved fluid state. We are using Godunov's scheme, as in, we difference the 
-			# fluxes taken from the Riemann solver. Note the convention that index i in the flux array
-			# means the left interface of cell i, and i+1 the right interface of cell i.
-			self.U[slc3dC] = self.U[slc3dC] + dt / self.dx * (flux[slc3fL] - flux[slc3fR])
+			# One update from a single primitive state; the direction of the "last" sweep has no 
+			# meaning but is kept alternating.
+			self.enforceBoundaryConditions(0)
+			self.enforceBoundaryConditions(1, corners = True)
+			c_max = self.unsplitStep(dt, max_speed = True)
+			self.bc_stale = set(['x', 'y', 'corners'])
+			idir = dirs[-1]
 			
-			# Convert U -> V; this way, we are sure that plotting functions etc find both the correct
-			# conserved and primitive variables.
-			self.conservedToPrimitive(self.U, self.V)
-		
-			# Impose boundary conditions. This needs to happen after each dimensional sweep rather
-			# than after each timestep, otherwise the second sweep will encounter some less 
-			# advanced cells near the boundaries.
-			self.enforceBoundaryConditions()
+		else:
+			for idir in dirs:
+				
+				# Impose boundary conditions. This needs to happen before each dimensional sweep 
+				# rather than once per timestep, otherwise the second sweep will encounter some less
+				# advanced cells near the boundaries. Only the ghost cells read by this sweep are 
+				# filled, and only if they have become stale.
+				self.enforceBoundaryConditions(idir)
+				
+				# Advance the fluid state in this direction; this changes the physical domain, 
+				# which means that all ghost cells are now stale. The last sweep also computes the
+				# largest signal speed, which sets the next timestep. With a Runge-Kutta scheme,
+				# each stage is a sweep in this direction.
+				if stages is None:
+					c_max = self.sweep(idir, dt, max_speed = (idir == dirs[-1]))
+					self.bc_stale = set(['x', 'y', 'corners'])
+				else:
+					np.copyto(self.U_rk, self.U)
+					for i in range(len(stages)):
+						self.enforceBoundaryConditions(idir)
+						c_max = self.sweep(idir, dt, max_speed = (idir == dirs[-1]) and (i == len(stages) - 1),
+										rk_stage = stages[i])
+						self.bc_stale = set(['x', 'y', 'corners'])
+		self.dt_cfl = self.cflTimestep(c_max)
+		
+		# Check the new fluid state if checks are not performed in each operation
+		if (self.hs.checks == 'every_n_steps') and ((self.step + 1) % self.hs.check_interval == 0):
+			self.checkFluidState()
 		
 		# Increase timestep
 		self.t += dt
@@ -1045,7 +3024,61 @@ class Simulation():
 
 	# ---------------------------------------------------------------------------------------------
 	
-	def save(self, filename = None):
+	def snapshotAttributes(self):
+		"""
+		Metadata of a snapshot file
+		
+		Returns
+		-------------------------------------------------------------------------------------------
+		attrs: dict
+			Dictionary of groups in the snapshot file, each a dictionary of attributes
+		"""
+		
+		attrs = {}
+		
+		attrs['code'] = {}
+		attrs['code']['file_version'] = file_version_current
+		
+		attrs['hydro_scheme'] = {}
+		attrs['hydro_scheme']['reconstruction'] = self.hs.reconstruction
+		attrs['hydro_scheme']['limiter'] = self.hs.limiter
+		attrs['hydro_scheme']['riemann'] = self.hs.riemann
+		attrs['hydro_scheme']['time_integration'] = self.hs.time_integration
+		attrs['hydro_scheme']['cfl'] = self.hs.cfl
+		attrs['hydro_scheme']['backend'] = self.hs.backend
+		attrs['hydro_scheme']['n_threads'] = self.hs.n_threads
+		attrs['hydro_scheme']['precision'] = self.hs.precision
+		if self.hs.tile_size is not None:
+			attrs['hydro_scheme']['tile_size'] = self.hs.tile_size
+		attrs['hydro_scheme']['checks'] = self.hs.checks
+		attrs['hydro_scheme']['check_interval'] = self.hs.check_interval
+		attrs['hydro_scheme']['unsplit'] = self.hs.unsplit
+	
+		attrs['domain'] = {}
+		attrs['domain']['xmin'] = self.xmin
+		attrs['domain']['xmax'] = self.xmax
+		attrs['domain']['ymin'] = self.ymin
+		attrs['domain']['ymax'] = self.ymax
+		attrs['domain']['dx'] = self.dx
+		attrs['domain']['nq'] = self.nq
+		attrs['domain']['nx'] = self.nx
+		attrs['domain']['ny'] = self.ny
+		attrs['domain']['nghost'] = self.nghost
+		attrs['domain']['bc_type'] = self.bc_type
+	
+		attrs['physics'] = {}
+		attrs['physics']['gamma'] = self.gamma
+	
+		attrs['run'] = {}
+		attrs['run']['t'] = self.t
+		attrs['run']['step'] = self.step
+		attrs['run']['last_dir'] = self.last_dir
+		
+		return attrs
+
+	# ---------------------------------------------------------------------------------------------
+	
+	def save(self, filename = None, writer = None, fmt = None):
 		"""
 		Save the current state of a simulation
 		
@@ -1053,55 +3086,143 @@ class Simulation():
 		-------------------------------------------------------------------------------------------
 		filename: str
 			Output filename; auto-generated if ``None``
+		writer: SnapshotWriter
+			If ``None``, the file is written before this function returns. Otherwise, the snapshot
+			is passed to the writer, e.g., a :class:`~ulula.output.SnapshotWriter` that writes the
+			file in the background or a :class:`~ulula.output.SnapshotSeriesWriter` that appends 
+			it to a series file.
+		fmt: object
+			Format of the file, e.g., :class:`~ulula.output.HDF5Format` or 
+			:class:`~ulula.output.NpyFormat`. If ``None``, an uncompressed HDF5 file is written.
+			This parameter is ignored if a writer is given.
 		"""
 		
 		if filename is None:
-			filename = 'ulula_%04d.hdf5' % (self.step)
-	
-		print('Saving to file %s' % (filename))
-	
-		f = h5py.File(filename, 'w')
-
-		f.create_group('code')
-		f['code'].attrs['file_version'] = file_version_current
-		
-		f.create_group('hydro_scheme')
-		f['hydro_scheme'].attrs['reconstruction'] = self.hs.reconstruction
-		f['hydro_scheme'].attrs['limiter'] = self.hs.limiter
-		f['hydro_scheme'].attrs['riemann'] = self.hs.riemann
-		f['hydro_scheme'].attrs['time_integration'] = self.hs.time_integration
-		f['hydro_scheme'].attrs['cfl'] = self.hs.cfl
-	
-		f.create_group('domain')
-		f['domain'].attrs['xmin'] = self.xmin
-		f['domain'].attrs['xmax'] = self.xmax
-		f['domain'].attrs['ymin'] = self.ymin
-		f['domain'].attrs['ymax'] = self.ymax
-		f['domain'].attrs['dx'] = self.dx
-		f['domain'].attrs['nq'] = self.nq
-		f['domain'].attrs['nx'] = self.nx
-		f['domain'].attrs['ny'] = self.ny
-		f['domain'].attrs['nghost'] = self.nghost
-		f['domain'].attrs['bc_type'] = self.bc_type
-	
-		f.create_group('physics')
-		f['physics'].attrs['gamma'] = self.gamma
-	
-		f.create_group('run')
-		f['run'].attrs['t'] = self.t
-		f['run'].attrs['step'] = self.step
-		f['run'].attrs['last_dir'] = self.last_dir
-		
-		f.create_group('grid')
+			filename = 'ulula_%04d%s' % (self.step, '.hdf5' if (fmt is None) else fmt.extension)
+	
+		attrs = self.snapshotAttributes()
+		fields = {}
 		for q in self.q_prim:
-			f['grid'][q] = self.V[self.q_prim[q], self.xlo:self.xhi+1, self.ylo:self.yhi+1]
+			fields[q] = self.V[self.q_prim[q], self.xlo:self.xhi+1, self.ylo:self.yhi+1]
+		
+		if writer is None:
+			print('Saving to file %s' % (filename))
+			if fmt is None:
+				writeSnapshot(filename, attrs, fields)
+			else:
+				fmt.write(filename, attrs, fields)
+		else:
+			writer.submit(filename, attrs, fields)
+		
+		return
+
+	# ---------------------------------------------------------------------------------------------
+	
+	def saveCheckpoint(self, filename = None, run_state = None):
+		"""
+		Save the exact state of a simulation for a restart
+		
+		A snapshot contains only the primitive variables in the physical domain, from which 
+		:func:`~ulula.simulation.load` computes the conserved variables. This conversion is not
+		exact to the last bit, and the next timestep is computed anew, which means that a restarted
+		run slowly drifts away from an uninterrupted one. A checkpoint is an HDF5 snapshot with an
+		additional ``checkpoint`` group that holds the full arrays of the conserved and primitive
+		variables, the timestep set by the CFL condition (if already known), and the state of the
+		caller, such as the output schedule of :func:`~ulula.run.run`. A simulation loaded with 
+		:func:`~ulula.simulation.loadCheckpoint` continues exactly like the saved one. The file is 
+		written under a temporary name and then renamed, which means that an existing checkpoint is
+		not destroyed if the run is killed while writing.
+		
+		Parameters
+		-------------------------------------------------------------------------------------------
+		filename: str
+			Output filename; auto-generated if ``None``
+		run_state: dict
+			Scalar values to be stored in the checkpoint; entries that are ``None`` are omitted
+		"""
+		
+		if filename is None:
+			filename = 'ulula_checkpoint_%04d.hdf5' % (self.step)
+		print('Saving checkpoint to file %s' % (filename))
 		
+		fields = {}
+		for q in self.q_prim:
+			fields[q] = self.V[self.q_prim[q], self.xlo:self.xhi+1, self.ylo:self.yhi+1]
+		filename_tmp = filename + '.tmp'
+		writeSnapshot(filename_tmp, self.snapshotAttributes(), fields)
+		
+		f = h5py.File(filename_tmp, 'a')
+		f.create_group('checkpoint')
+		f['checkpoint']['U'] = self.U
+		f['checkpoint']['V'] = self.V
+		if self.dt_cfl is not None:
+			f['checkpoint'].attrs['dt_cfl'] = self.dt_cfl
+		f['checkpoint'].create_group('run_state')
+		if run_state is not None:
+			for k, v in run_state.items():
+				if v is not None:
+					f['checkpoint']['run_state'].attrs[k] = v
 		f.close()
+		os.replace(filename_tmp, filename)
 		
 		return
 
 ###################################################################################################
 
+def writeSnapshot(filename, attrs, fields, compression = None, compression_opts = None, 
+				shuffle = False, chunks = None):
+	"""
+	Write a snapshot file in HDF5 format
+	
+	By default, the fields are stored contiguously and without compression, which is the fastest
+	format to write and allows memory-mapping the fields when reading (see 
+	:class:`~ulula.output.SnapshotView`). Compression requires chunked datasets; if no chunk 
+	size is given, each field is one chunk.
+	
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	filename: str
+		Output filename
+	attrs: dict
+		Groups of attributes (see :func:`~ulula.simulation.Simulation.snapshotAttributes`)
+	fields: dict
+		Arrays of the primitive variables in the physical domain
+	compression: str
+		Compression filter, ``gzip`` or ``lzf``; if ``None``, the data are not compressed
+	compression_opts: int
+		Compression level for ``gzip`` (0-9)
+	shuffle: bool
+		If ``True``, the bytes of the values are shuffled before compression
+	chunks: tuple
+		Chunk dimensions of the fields; if ``None``, the fields are contiguous unless they are 
+		compressed
+	"""
+	
+	f = h5py.File(filename, 'w')
+	
+	for group in attrs:
+		f.create_group(group)
+		for k, v in attrs[group].items():
+			f[group].attrs[k] = v
+	
+	f.create_group('grid')
+	for q in fields:
+		if (compression is None) and (chunks is None) and (not shuffle):
+			f['grid'][q] = fields[q]
+		else:
+			if chunks is None:
+				chunks_q = fields[q].shape
+			else:
+				chunks_q = tuple(min(c, n) for c, n in zip(chunks, fields[q].shape))
+			f['grid'].create_dataset(q, data = fields[q], chunks = chunks_q, compression = compression,
+							compression_opts = compression_opts, shuffle = shuffle)
+	
+	f.close()
+	
+	return
+
+###################################################################################################
+
 def load(filename):
 	"""
 	Load a snapshot file into a simulation object
@@ -1109,7 +3230,8 @@ def load(filename):
 	Parameters
 	-----------------------------------------------------------------------------------------------
 	filename: str
-		Input filename
+		Input filename; the format is detected automatically (see 
+		:func:`~ulula.output.detectFormat`)
 
 	Returns
 	-----------------------------------------------------------------------------------------------
@@ -1117,12 +3239,107 @@ def load(filename):
 		Object of type :data:`~ulula.simulation.Simulation`
 	"""
 
+	# The output module imports this module, so it can only be imported at runtime
+	import ulula.output as ulula_output
+	
 	print('Loading simulation from file %s' % (filename))
 
+	with ulula_output.SnapshotView(filename) as view:
+		sim = simulationFromSnapshot(view.attrs, view.fields, filename = filename)
+	
+	return sim
+
+###################################################################################################
+
+def isCheckpoint(filename):
+	"""
+	Whether a file is a checkpoint written by :func:`~ulula.simulation.Simulation.saveCheckpoint`
+	"""
+	
+	if not (os.path.isfile(filename) and h5py.is_hdf5(filename)):
+		return False
+	with h5py.File(filename, 'r') as f:
+		ret = ('checkpoint' in f)
+	
+	return ret
+
+###################################################################################################
+
+def loadCheckpoint(filename):
+	"""
+	Load a checkpoint file into a simulation object
+	
+	The simulation is restored exactly as it was saved (see 
+	:func:`~ulula.simulation.Simulation.saveCheckpoint`). The ghost cells are marked as stale,
+	which means that they are filled from the physical domain before the next sweep.
+	
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	filename: str
+		Input filename
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	sim: Simulation
+		Object of type :data:`~ulula.simulation.Simulation`
+	run_state: dict
+		Values that were stored with the checkpoint; omitted (``None``) values are missing
+	"""
+
+	print('Loading checkpoint from file %s' % (filename))
+
 	f = h5py.File(filename, 'r')
+	if not 'checkpoint' in f:
+		f.close()
+		raise Exception('File %s is not a checkpoint file.' % (filename))
+	
+	attrs = {}
+	for group in ['code', 'hydro_scheme', 'domain', 'physics', 'run']:
+		attrs[group] = f[group].attrs
+	sim = simulationFromSnapshot(attrs, f['grid'], filename = filename)
+	
+	# Overwrite the state computed from the primitive variables with the saved arrays, whose 
+	# ghost cells may be out of date. The CFL timestep must be set after the boundary conditions,
+	# which discard it. As for the other attributes, a Python float is needed so that 
+	# single-precision arrays are not promoted.
+	f['checkpoint']['U'].read_direct(sim.U)
+	f['checkpoint']['V'].read_direct(sim.V)
+	sim.bc_stale = set(['x', 'y', 'corners'])
+	if 'dt_cfl' in f['checkpoint'].attrs:
+		sim.dt_cfl = float(f['checkpoint'].attrs['dt_cfl'])
+	
+	run_state = {}
+	for k, v in f['checkpoint']['run_state'].attrs.items():
+		if isinstance(v, np.generic):
+			v = v.item()
+		run_state[k] = v
+	f.close()
+	
+	return sim, run_state
+
+###################################################################################################
+
+def simulationFromSnapshot(attrs, fields, filename = None):
+	"""
+	Create a simulation object from the contents of a snapshot
+	
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	attrs: dict
+		Groups of attributes (see :func:`~ulula.simulation.Simulation.snapshotAttributes`)
+	fields: dict
+		Arrays of the primitive variables in the physical domain
+	filename: str
+		Name of the file that the snapshot was read from (used only in error messages)
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	sim: Simulation
+		Object of type :data:`~ulula.simulation.Simulation`
+	"""
 
 	# Check file version for compatibility
-	file_version = f['code'].attrs['file_version']
+	file_version = attrs['code']['file_version']
 	
 	if ulula_utils.versionIsOlder(file_version_oldest, file_version):
 		raise Exception('Cannot load simulation from file %s because version %s is too old (allowed %s).' \
@@ -1130,43 +3347,45 @@ def load(filename):
 
 	# Load hydro scheme parameters
 	hs_pars = {}
-	hs_pars['reconstruction'] = f['hydro_scheme'].attrs['reconstruction']
-	hs_pars['limiter'] = f['hydro_scheme'].attrs['limiter']
-	hs_pars['riemann'] = f['hydro_scheme'].attrs['riemann']
-	hs_pars['time_integration'] = f['hydro_scheme'].attrs['time_integration']
-	hs_pars['cfl'] = f['hydro_scheme'].attrs['cfl']
+	hs_pars['reconstruction'] = attrs['hydro_scheme']['reconstruction']
+	hs_pars['limiter'] = attrs['hydro_scheme']['limiter']
+	hs_pars['riemann'] = attrs['hydro_scheme']['riemann']
+	hs_pars['time_integration'] = attrs['hydro_scheme']['time_integration']
+	hs_pars['cfl'] = float(attrs['hydro_scheme']['cfl'])
+	for p in ['backend', 'n_threads', 'precision', 'tile_size', 'checks', 'check_interval', 'unsplit']:
+		if p in attrs['hydro_scheme']:
+			hs_pars[p] = attrs['hydro_scheme'][p]
 	
 	# Create hydro scheme and simulation objects
 	hs = HydroScheme(**hs_pars)	
 	sim = Simulation(hs)
 	
-	# Load domain parameters and initialize domain
-	nx = f['domain'].attrs['nx']
-	ny = f['domain'].attrs['ny']
-	xmin = f['domain'].attrs['xmin']
-	xmax = f['domain'].attrs['xmax']
-	ymin = f['domain'].attrs['ymin']
-	bc_type = f['domain'].attrs['bc_type']
+	# Load domain parameters and initialize domain. The attributes are converted to Python types;
+	# NumPy double-precision scalars would promote single-precision fluid arrays in arithmetic.
+	nx = int(attrs['domain']['nx'])
+	ny = int(attrs['domain']['ny'])
+	xmin = float(attrs['domain']['xmin'])
+	xmax = float(attrs['domain']['xmax'])
+	ymin = float(attrs['domain']['ymin'])
+	bc_type = attrs['domain']['bc_type']
 	sim.setDomain(nx, ny, xmin = xmin, xmax = xmax, ymin = ymin, bc_type = bc_type)
 
 	# Load fluid parameters
-	gamma = f['physics'].attrs['gamma']
+	gamma = float(attrs['physics']['gamma'])
 	sim.setFluidProperties(gamma)
 	
 	# Load and reset time and step
-	sim.t = f['run'].attrs['t']
-	sim.step = f['run'].attrs['step']
-	sim.last_dir = f['run'].attrs['last_dir']
+	sim.t = float(attrs['run']['t'])
+	sim.step = int(attrs['run']['step'])
+	sim.last_dir = int(attrs['run']['last_dir'])
 	
 	# Set grid variables
 	for q in sim.q_prim:
-		sim.V[sim.q_prim[q], sim.xlo:sim.xhi+1, sim.ylo:sim.yhi+1] = f['grid'][q]
+		sim.V[sim.q_prim[q], sim.xlo:sim.xhi+1, sim.ylo:sim.yhi+1] = fields[q]
 		
 	# Initialize the conserved variables and ghost cells
 	sim.primitiveToConserved(sim.V, sim.U)
 	sim.enforceBoundaryConditions()
-
-	f.close()
 	
 	return sim
 
@@ -0,0 +1,334 @@
+###################################################################################################
+#
+# Ulula -- sweep.py
+#
+# Parameter studies that execute many runs in parallel processes
+#
+# by Benedikt Diemer
+#
+###################################################################################################
+
+import os
+import io
+import copy
+import json
+import time
+import itertools
+import contextlib
+import traceback
+import multiprocessing
+import concurrent.futures
+
+import ulula.run as ulula_run
+import ulula.decomposition as ulula_decomp
+
+###################################################################################################
+
+# Environment variables that limit the number of threads used by the BLAS and OpenMP libraries
+# that numpy may be linked against
+blas_thread_vars = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+				'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+###################################################################################################
+
+def run_sweep(setup_factory, grid_of_params = None, hydro_schemes = None, nx_list = [200],
+			n_workers = None, n_blas_threads = 1, run_kwargs = None, diagnostics = None,
+			output_dir = None, manifest_file = 'ulula_sweep_manifest.json', save_final = False,
+			return_sims = True, callback = None, verbose = True):
+	"""
+	Execute a parameter study in parallel processes
+
+	This function executes :func:`~ulula.run.run` for every combination of setup parameters,
+	hydro scheme, and resolution, distributing the runs over a pool of worker processes. Each run
+	is serial within its worker (unless the hydro scheme asks for threads), which is the most
+	efficient way to use many cores when there are more runs than cores. The workers are started
+	with the ``spawn`` method and with the thread count of the BLAS/OpenMP libraries limited to
+	``n_blas_threads``, so that they do not compete for the cores. As a consequence, the setup
+	factory and the diagnostics function must be picklable (e.g., a setup class or a function
+	defined at the top level of a module), and scripts that call this function must protect their
+	main code with ``if __name__ == '__main__':``.
+
+	The results are passed to ``callback`` in the order in which the runs complete. After each
+	completed run, a manifest file in JSON format is rewritten that lists the parameters, status,
+	timing, and diagnostics of all completed runs, so that it is valid even if the sweep is
+	interrupted. A run that raises an exception does not stop the sweep; its result has the
+	status ``error`` and contains the error message.
+
+	Each result is a dictionary with the following entries:
+
+	* ``index``, ``label``: Index of the run in the sweep and a label that is derived from it
+	* ``params``, ``nx``, ``hydro_scheme``: Setup parameters, resolution, and hydro scheme
+	  parameters of the run
+	* ``status``, ``error``: ``ok`` or ``error``, and the error message in the latter case
+	* ``t``, ``step``: Final time and step of the simulation
+	* ``time_wall``, ``time_cpu``: Wall-clock and CPU time of the run in seconds
+	* ``diagnostics``: Dictionary returned by the ``diagnostics`` function (or ``None``)
+	* ``filename``: Snapshot file of the final state (if ``save_final == True``)
+	* ``sim``: Final simulation object (if ``return_sims == True``)
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	setup_factory: callable
+		Function or class that returns a setup object when called with the setup parameters as
+		keyword arguments, e.g., ``ulula.setups.kelvin_helmholtz.SetupKelvinHelmholtz``
+	grid_of_params: dict or array_like
+		If a dictionary, each entry is a list of values of a setup parameter, and the sweep covers
+		all combinations. If a list, each element is a dictionary of setup parameters. If
+		``None``, the setup is created without parameters.
+	hydro_schemes: array_like
+		List of HydroScheme objects; if ``None``, the default scheme is used
+	nx_list: array_like
+		List of resolutions
+	n_workers: int
+		Number of worker processes; if ``None``, the number of CPUs is used
+	n_blas_threads: int
+		Number of threads that the BLAS/OpenMP libraries may use in each worker. If ``None``,
+		the thread count is not limited.
+	run_kwargs: dict
+		Further parameters passed to :func:`~ulula.run.run` for all runs, e.g., ``tmax``. The
+		label of the run is appended to ``output_suffix`` and ``plot_suffix`` so that the files
+		of different runs do not collide.
+	diagnostics: callable
+		Function that is called with the final simulation object in the worker and returns a
+		dictionary of quantities to be recorded in the result and manifest; the values should be
+		convertible to JSON.
+	output_dir: str
+		Directory in which the workers execute the runs, i.e., where the output files, plots, and
+		the manifest are written. If ``None``, the current directory is used.
+	manifest_file: str
+		Name of the manifest file in ``output_dir``; if ``None``, no manifest is written
+	save_final: bool
+		If ``True``, each worker saves the final state of its run to a snapshot file
+	return_sims: bool
+		If ``True``, the final simulation objects are sent back to the main process. For large
+		grids or many runs, it can be more economical to save the final states instead.
+	callback: callable
+		Function that is called with each result as soon as the run has completed
+	verbose: bool
+		If ``True``, a line is printed for each completed run. The console output of the runs
+		themselves is always suppressed.
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	results: array_like
+		List of result dictionaries, ordered by the index of the run
+	"""
+
+	if run_kwargs is None:
+		run_kwargs = {}
+	if n_workers is None:
+		n_workers = os.cpu_count()
+	if output_dir is None:
+		output_dir = os.getcwd()
+	else:
+		output_dir = os.path.abspath(output_dir)
+		if not os.path.exists(output_dir):
+			os.makedirs(output_dir)
+
+	tasks = sweepTasks(grid_of_params, hydro_schemes, nx_list)
+	if len(tasks) == 0:
+		raise Exception('The parameter sweep contains no runs.')
+	for k in ['setup', 'hydro_scheme', 'nx']:
+		if k in run_kwargs:
+			raise Exception('The %s of the runs cannot be set via run_kwargs.' % (k))
+
+	if verbose:
+		print('Running sweep of %d runs with %d workers.' % (len(tasks), n_workers))
+
+	# The BLAS and OpenMP libraries read their thread count when they are loaded, which happens
+	# when a spawned worker imports numpy. The workers inherit the environment of this process at
+	# the time they are started, which may be as late as the last submission.
+	results = []
+	t0 = time.time()
+	with blasThreadLimit(n_blas_threads):
+		ctx = multiprocessing.get_context('spawn')
+		with concurrent.futures.ProcessPoolExecutor(max_workers = n_workers, mp_context = ctx) as pool:
+			futures = {}
+			for task in tasks:
+				future = pool.submit(runSweepTask, task, setup_factory, run_kwargs, diagnostics,
+									output_dir, save_final, return_sims)
+				futures[future] = task
+			for future in concurrent.futures.as_completed(futures):
+				# Exceptions in a run are caught in the worker; an exception here means that the
+				# worker died or that the result could not be sent back.
+				try:
+					res = future.result()
+				except Exception as e:
+					task = futures[future]
+					res = dict(index = task['index'], label = task['label'], params = task['params'],
+							nx = task['nx'], status = 'error', error = '%s: %s' % (type(e).__name__, str(e)))
+				results.append(res)
+				if verbose:
+					if res['status'] == 'ok':
+						msg = 't = %.2e after %d steps, %.1f s' % (res['t'], res['step'], res['time_wall'])
+					else:
+						msg = 'error: %s' % (res['error'])
+					print('Run %4d (%3d/%3d done) nx = %4d, %s.' % (res['index'], len(results),
+											len(tasks), res['nx'], msg))
+				if manifest_file is not None:
+					writeManifest(os.path.join(output_dir, manifest_file), results, len(tasks),
+								setup_factory)
+				if callback is not None:
+					callback(res)
+
+	results.sort(key = lambda res: res['index'])
+	if verbose:
+		n_err = sum([res['status'] != 'ok' for res in results])
+		print('Sweep finished in %.1f s, %d runs failed.' % (time.time() - t0, n_err))
+
+	return results
+
+###################################################################################################
+
+def sweepTasks(grid_of_params, hydro_schemes, nx_list):
+	"""
+	List of the runs in a parameter sweep
+
+	The runs are ordered by setup parameters, then hydro scheme, then resolution. See
+	:func:`run_sweep` for the parameters.
+
+	Returns
+	-----------------------------------------------------------------------------------------------
+	tasks: array_like
+		List of dictionaries with the index, label, setup parameters, hydro scheme, and resolution
+		of each run
+	"""
+
+	if grid_of_params is None:
+		param_list = [{}]
+	elif isinstance(grid_of_params, dict):
+		keys = list(grid_of_params.keys())
+		param_list = []
+		for values in itertools.product(*[grid_of_params[k] for k in keys]):
+			param_list.append(dict(zip(keys, values)))
+	else:
+		param_list = list(grid_of_params)
+	if hydro_schemes is None:
+		hydro_schemes = [None]
+
+	tasks = []
+	for params, hs, nx in itertools.product(param_list, hydro_schemes, nx_list):
+		idx = len(tasks)
+		tasks.append(dict(index = idx, label = 'run%04d' % (idx), params = params,
+						hydro_scheme = hs, nx = nx))
+
+	return tasks
+
+###################################################################################################
+
+@contextlib.contextmanager
+def blasThreadLimit(n_threads):
+	"""
+	Context in which the environment limits the number of BLAS/OpenMP threads
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	n_threads: int
+		Maximum number of threads; if ``None``, the environment is not changed
+	"""
+
+	if n_threads is None:
+		yield
+		return
+
+	old = {}
+	for var in blas_thread_vars:
+		old[var] = os.environ.get(var, None)
+		os.environ[var] = '%d' % (n_threads)
+	try:
+		yield
+	finally:
+		for var in blas_thread_vars:
+			if old[var] is None:
+				del os.environ[var]
+			else:
+				os.environ[var] = old[var]
+
+###################################################################################################
+
+def runSweepTask(task, setup_factory, run_kwargs, diagnostics, output_dir, save_final, return_sims):
+	"""
+	Execute one run of a parameter sweep in a worker process
+
+	See :func:`run_sweep` for the parameters and the contents of the returned result.
+	"""
+
+	hs = task['hydro_scheme']
+	res = dict(index = task['index'], label = task['label'], params = task['params'],
+			nx = task['nx'], hydro_scheme = None if hs is None else vars(hs).copy(),
+			status = 'ok', error = None, t = None, step = None, time_wall = None, time_cpu = None,
+			diagnostics = None, filename = None, sim = None)
+
+	kwargs = dict(run_kwargs)
+	for k in ['output_suffix', 'plot_suffix']:
+		kwargs[k] = '%s_%s' % (kwargs.get(k, ''), task['label'])
+
+	t0_wall = time.time()
+	t0_cpu = time.process_time()
+	try:
+		os.chdir(output_dir)
+		with contextlib.redirect_stdout(io.StringIO()):
+			setup = setup_factory(**task['params'])
+			sim = ulula_run.run(setup, hydro_scheme = hs, nx = task['nx'], **kwargs)
+			if save_final:
+				res['filename'] = os.path.join(output_dir, 'ulula_%s_final.hdf5' % (task['label']))
+				sim.save(filename = res['filename'])
+		res['t'] = float(sim.t)
+		res['step'] = int(sim.step)
+		if diagnostics is not None:
+			res['diagnostics'] = diagnostics(sim)
+		if return_sims:
+			# A decomposed simulation cannot be sent to another process, but its copy is a serial
+			# simulation with the same state.
+			if isinstance(sim, ulula_decomp.DecomposedSimulation):
+				sim = copy.deepcopy(sim)
+			res['sim'] = sim
+	except Exception as e:
+		res['status'] = 'error'
+		res['error'] = '%s: %s' % (type(e).__name__, str(e))
+		res['traceback'] = traceback.format_exc()
+	res['time_wall'] = time.time() - t0_wall
+	res['time_cpu'] = time.process_time() - t0_cpu
+
+	return res
+
+###################################################################################################
+
+def writeManifest(filename, results, n_runs, setup_factory):
+	"""
+	Write the manifest of a parameter sweep
+
+	The file is first written under a temporary name and then renamed, so that the manifest on
+	disk is always complete.
+
+	Parameters
+	-----------------------------------------------------------------------------------------------
+	filename: str
+		Name of the manifest file
+	results: array_like
+		List of the results of the completed runs
+	n_runs: int
+		Total number of runs in the sweep
+	setup_factory: callable
+		Function or class that creates the setups
+	"""
+
+	runs = []
+	for res in sorted(results, key = lambda res: res['index']):
+		runs.append({k: v for k, v in res.items() if k not in ['sim', 'traceback']})
+
+	manifest = {}
+	manifest['setup_factory'] = '%s.%s' % (getattr(setup_factory, '__module__', ''),
+								getattr(setup_factory, '__qualname__', str(setup_factory)))
+	manifest['n_runs'] = n_runs
+	manifest['n_completed'] = len(results)
+	manifest['runs'] = runs
+
+	filename_tmp = filename + '.tmp'
+	with open(filename_tmp, 'w') as f:
+		json.dump(manifest, f, indent = 1, default = str)
+	os.replace(filename_tmp, filename)
+
+	return
+
+###################################################################################################
@@ -8,6 +8,8 @@
 #
 ###################################################################################################
 
+import os
+import glob
 import numpy as np
 
 ###################################################################################################
@@ -181,3 +183,57 @@ def circleSquareOverlap(circle_x, circle_y, circle_r, square_x, square_y, square
 	return olp
 
 ###################################################################################################
+
+def cacheSize(level = 2, default = 1048576):
+	"""
+	Size of a CPU data cache.
+	
+	The size is taken from the operating system if it provides this information (on Linux, via
+	sysconf or the sysfs file system); otherwise, the default is returned.
+
+	Parameters
+	---------------------------
+	level: int
+		The cache level (1, 2, or 3).
+	default: int
+		The size in bytes to return if the actual size cannot be determined.
+	
+	Returns
+	-------
+	size: int
+		The size of the cache in bytes.
+	"""
+
+	names = {1: 'SC_LEVEL1_DCACHE_SIZE', 2: 'SC_LEVEL2_CACHE_SIZE', 3: 'SC_LEVEL3_CACHE_SIZE'}
+	
+	size = 0
+	try:
+		size = os.sysconf(names[level])
+	except Exception:
+		pass
+
+	if size <= 0:
+		try:
+			for fn in sorted(glob.glob('/sys/devices/system/cpu/cpu0/cache/index*/')):
+				with open(fn + 'level') as f:
+					lvl = int(f.read())
+				with open(fn + 'type') as f:
+					typ = f.read().strip()
+				if (lvl == level) and (typ in ['Data', 'Unified']):
+					with open(fn + 'size') as f:
+						s = f.read().strip()
+					units = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
+					if s[-1] in units:
+						size = int(s[:-1]) * units[s[-1]]
+					else:
+						size = int(s)
+					break
+		except Exception:
+			size = 0
+	
+	if size <= 0:
+		size = default
+	
+	return size
+
+###################################################################################################